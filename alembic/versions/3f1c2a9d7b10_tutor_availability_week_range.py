@@ -0,0 +1,68 @@
+"""tutor availability minutes-of-week range
+
+Revision ID: 3f1c2a9d7b10
+Revises: 
+Create Date: 2026-10-19 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from app.utils.availability.minutes_of_week import to_week_range
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a9d7b10'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("tutor_availability") as batch_op:
+        batch_op.add_column(sa.Column("start_minute", sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column("end_minute", sa.Integer(), nullable=True))
+        batch_op.create_index("ix_tutor_availability_week_range", ["start_minute", "end_minute"])
+
+    # backfill the normalised range of the existing rows: the free-form strings are parsed
+    # once per distinct (day, start_time, end_time), then set in a single UPDATE ... FROM
+    connection = op.get_bind()
+    ranges = []
+    for day, start_time, end_time in connection.execute(
+        sa.text("SELECT DISTINCT day, start_time, end_time FROM tutor_availability")
+    ):
+        try:
+            start_minute, end_minute = to_week_range(day or "", start_time or "", end_time or "")
+        except ValueError:
+            continue
+        ranges.append(
+            {
+                "day": day,
+                "start_time": start_time,
+                "end_time": end_time,
+                "start_minute": start_minute,
+                "end_minute": end_minute,
+            }
+        )
+    if not ranges:
+        return
+    connection.execute(sa.text("CREATE TEMP TABLE week_range (day, start_time, end_time, start_minute, end_minute)"))
+    connection.execute(
+        sa.text("INSERT INTO week_range VALUES (:day, :start_time, :end_time, :start_minute, :end_minute)"),
+        ranges,
+    )
+    connection.execute(
+        sa.text(
+            "UPDATE tutor_availability SET start_minute = week_range.start_minute, end_minute = week_range.end_minute "
+            "FROM week_range WHERE week_range.day = tutor_availability.day "
+            "AND week_range.start_time = tutor_availability.start_time "
+            "AND week_range.end_time = tutor_availability.end_time"
+        )
+    )
+    connection.execute(sa.text("DROP TABLE week_range"))
+
+
+def downgrade():
+    with op.batch_alter_table("tutor_availability") as batch_op:
+        batch_op.drop_index("ix_tutor_availability_week_range")
+        batch_op.drop_column("end_minute")
+        batch_op.drop_column("start_minute")
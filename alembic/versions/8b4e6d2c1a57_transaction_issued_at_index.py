@@ -0,0 +1,30 @@
+"""index transaction.issued_at for as-of reads
+
+Revision ID: 8b4e6d2c1a57
+Revises: 3f1c2a9d7b10
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b4e6d2c1a57'
+down_revision = '3f1c2a9d7b10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the transaction table is created with the version tables (by create_all, or by f2b4d6a8c0e3)
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table("transaction"):
+        return
+    indexes = [index["name"] for index in inspector.get_indexes("transaction")]
+    if "ix_transaction_issued_at" not in indexes:
+        op.create_index("ix_transaction_issued_at", "transaction", ["issued_at"])
+
+
+def downgrade():
+    op.drop_index("ix_transaction_issued_at", table_name="transaction")
@@ -0,0 +1,32 @@
+"""partition index of the archived messages
+
+Revision ID: a3c5e7f9b1d4
+Revises: f2b4d6a8c0e3
+Create Date: 2026-10-19 20:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3c5e7f9b1d4'
+down_revision = 'f2b4d6a8c0e3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the months archived before are indexed by the next archive run (archive.index_partitions)
+    if sa.inspect(op.get_bind()).has_table("archived_message"):
+        return
+    op.create_table(
+        "archived_message",
+        sa.Column("message_id", sa.String(), primary_key=True),
+        sa.Column("month", sa.String(), nullable=False),
+    )
+    op.create_index("ix_archived_message_month", "archived_message", ["month"])
+
+
+def downgrade():
+    op.drop_table("archived_message")
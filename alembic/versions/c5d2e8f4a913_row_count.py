@@ -0,0 +1,32 @@
+"""maintained row counts
+
+Revision ID: c5d2e8f4a913
+Revises: 8b4e6d2c1a57
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5d2e8f4a913'
+down_revision = '8b4e6d2c1a57'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the counters are backfilled by the application on startup (app.database.counts)
+    if sa.inspect(op.get_bind()).has_table("row_count"):
+        return
+    op.create_table(
+        "row_count",
+        sa.Column("name", sa.String(), primary_key=True),
+        sa.Column("key", sa.String(), primary_key=True),
+        sa.Column("count", sa.Integer(), nullable=False),
+    )
+
+
+def downgrade():
+    op.drop_table("row_count")
@@ -0,0 +1,29 @@
+"""index message.date_sent for the archive partitions
+
+Revision ID: d7e3f9a1b2c4
+Revises: c5d2e8f4a913
+Create Date: 2026-10-19 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd7e3f9a1b2c4'
+down_revision = 'c5d2e8f4a913'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table("message"):
+        return
+    indexes = [index["name"] for index in inspector.get_indexes("message")]
+    if "ix_message_date_sent" not in indexes:
+        op.create_index("ix_message_date_sent", "message", ["date_sent"])
+
+
+def downgrade():
+    op.drop_index("ix_message_date_sent", table_name="message")
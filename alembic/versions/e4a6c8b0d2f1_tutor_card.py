@@ -0,0 +1,54 @@
+"""tutor cards and the profile foreign key indexes they are built with
+
+Revision ID: e4a6c8b0d2f1
+Revises: d7e3f9a1b2c4
+Create Date: 2026-10-19 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4a6c8b0d2f1'
+down_revision = 'd7e3f9a1b2c4'
+branch_labels = None
+depends_on = None
+
+
+CHILD_TABLES = ("tutor_subject", "tutor_availability", "tutor_review")
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    for table in CHILD_TABLES:
+        if not inspector.has_table(table):
+            continue
+        indexes = [index["name"] for index in inspector.get_indexes(table)]
+        if f"ix_{table}_tutor_profile_id" not in indexes:
+            op.create_index(f"ix_{table}_tutor_profile_id", table, ["tutor_profile_id"])
+    # the cards are built with python -m app.database.tutor_card --rebuild
+    if inspector.has_table("tutor_card"):
+        return
+    op.create_table(
+        "tutor_card",
+        sa.Column("tutor_profile_id", sa.String(), primary_key=True),
+        sa.Column("display_name", sa.String()),
+        sa.Column("tutor_title", sa.String()),
+        sa.Column("profile_photo", sa.String()),
+        sa.Column("short_bio", sa.String()),
+        sa.Column("average_response_time", sa.String()),
+        sa.Column("experience_years", sa.String()),
+        sa.Column("subjects", sa.JSON(), nullable=False),
+        sa.Column("min_price", sa.Float()),
+        sa.Column("days", sa.JSON(), nullable=False),
+        sa.Column("review_count", sa.Integer(), nullable=False),
+        sa.Column("rating", sa.Float()),
+        sa.Column("refreshed_on", sa.DateTime(), nullable=False),
+    )
+
+
+def downgrade():
+    op.drop_table("tutor_card")
+    for table in CHILD_TABLES:
+        op.drop_index(f"ix_{table}_tutor_profile_id", table_name=table)
@@ -0,0 +1,134 @@
+"""version history tables of the versioned models
+
+Revision ID: f2b4d6a8c0e3
+Revises: e4a6c8b0d2f1
+Create Date: 2026-10-19 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2b4d6a8c0e3'
+down_revision = 'e4a6c8b0d2f1'
+branch_labels = None
+depends_on = None
+
+
+# sqlalchemy-continuum keys versions by transaction id: BIGINT, INTEGER on SQLite
+TransactionId = sa.BigInteger().with_variant(sa.Integer(), "sqlite")
+
+# columns of the versioned tables (primary key first), copied to their <table>_version
+VERSIONED = {
+    "user": [
+        ("user_id", sa.String()),
+        ("role", sa.String()),
+        ("username", sa.String()),
+        ("first_name", sa.String()),
+        ("last_name", sa.String()),
+        ("display_name", sa.String()),
+        ("profile_picture", sa.String()),
+        ("email", sa.String()),
+        ("phone_number", sa.String()),
+        ("DOB", sa.Date()),
+    ],
+    "message": [
+        ("message_id", sa.String()),
+        ("sender_id", sa.String()),
+        ("receiver_id", sa.String()),
+        ("message", sa.String()),
+        ("date_sent", sa.DateTime()),
+        ("date_read", sa.DateTime()),
+    ],
+    "tutor_profile": [
+        ("tutor_profile_id", sa.String()),
+        ("user_id", sa.String()),
+        ("profile_photo", sa.String()),
+        ("first_name", sa.String()),
+        ("last_name", sa.String()),
+        ("display_name", sa.String()),
+        ("email", sa.String()),
+        ("tutor_title", sa.String()),
+        ("average_response_time", sa.String()),
+        ("short_bio", sa.String()),
+        ("about_me", sa.String()),
+        ("tutoring_style", sa.String()),
+        ("experience_years", sa.String()),
+        ("is_active", sa.Boolean()),
+    ],
+    "tutor_availability": [
+        ("tutor_availability_id", sa.String()),
+        ("tutor_profile_id", sa.String()),
+        ("day", sa.String()),
+        ("start_time", sa.String()),
+        ("end_time", sa.String()),
+        ("start_minute", sa.Integer()),
+        ("end_minute", sa.Integer()),
+        ("is_active", sa.Boolean()),
+    ],
+    "tutor_qualification": [
+        ("tutor_qualification_id", sa.String()),
+        ("tutor_profile_id", sa.String()),
+        ("qualification_institution", sa.String()),
+        ("qualification_subject", sa.String()),
+        ("qualification_type", sa.String()),
+        ("qualification_grade", sa.String()),
+        ("is_active", sa.Boolean()),
+    ],
+    "tutor_subject": [
+        ("tutor_subject_id", sa.String()),
+        ("tutor_profile_id", sa.String()),
+        ("subject", sa.String()),
+        ("level", sa.String()),
+        ("price", sa.String()),
+        ("is_active", sa.Boolean()),
+    ],
+    "tutor_review": [
+        ("tutor_review_id", sa.String()),
+        ("tutor_profile_id", sa.String()),
+        ("user_id", sa.String()),
+        ("review", sa.String()),
+        ("rating", sa.String()),
+        ("is_active", sa.Boolean()),
+    ],
+}
+
+VERSION_INDEXES = ("transaction_id", "end_transaction_id", "operation_type")
+
+
+def upgrade():
+    # databases created by create_all already have them
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table("transaction"):
+        op.create_table(
+            "transaction",
+            sa.Column("id", TransactionId, primary_key=True, autoincrement=True),
+            sa.Column("remote_addr", sa.String(50), nullable=True),
+            sa.Column("issued_at", sa.DateTime(), nullable=True),
+        )
+    indexes = [index["name"] for index in inspector.get_indexes("transaction")] if inspector.has_table("transaction") else []
+    if "ix_transaction_issued_at" not in indexes:
+        op.create_index("ix_transaction_issued_at", "transaction", ["issued_at"])
+
+    for table, columns in VERSIONED.items():
+        name = f"{table}_version"
+        if inspector.has_table(name):
+            continue
+        (key, key_type), *others = columns
+        op.create_table(
+            name,
+            sa.Column(key, key_type, primary_key=True, autoincrement=False),
+            *[sa.Column(column, column_type, nullable=True) for column, column_type in others],
+            sa.Column("transaction_id", TransactionId, primary_key=True, autoincrement=False),
+            sa.Column("end_transaction_id", TransactionId, nullable=True),
+            sa.Column("operation_type", sa.SmallInteger(), nullable=False),
+        )
+        for column in VERSION_INDEXES:
+            op.create_index(f"ix_{name}_{column}", name, [column])
+
+
+def downgrade():
+    for table in VERSIONED:
+        op.drop_table(f"{table}_version")
+    op.drop_table("transaction")
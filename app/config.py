@@ -0,0 +1,182 @@
+"""
+Application settings read from the environment
+"""
+
+import os
+
+
+def env_bool(name: str, default: bool = False) -> bool:
+    """Read a boolean flag from the environment ("1", "true", "yes" and "on" are truthy)"""
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+# database
+SQLITE_WAL = env_bool("SQLITE_WAL", True)
+SQLITE_BUSY_TIMEOUT = float(os.environ.get("SQLITE_BUSY_TIMEOUT", "5"))
+# storage of the UUID primary and foreign keys: "text" (36 characters) or "blob" (16 bytes),
+# convert an existing database with python -m app.database.convert_ids
+ID_STORAGE = os.environ.get("ID_STORAGE", "text")
+
+
+# read/write routing
+# run the CRUD reads on a separate read engine: read-only connections to the database file
+# (WAL lets them read alongside the writer) or READ_DATABASE_URL, e.g. a replica
+READ_ROUTING_ENABLED = env_bool("READ_ROUTING_ENABLED")
+READ_DATABASE_URL = os.environ.get("READ_DATABASE_URL")
+READ_POOL_SIZE = int(os.environ.get("READ_POOL_SIZE", "10"))
+
+
+# single writer / group commit
+# route the service writes through the writer thread, committing them in groups
+WRITER_ENABLED = env_bool("WRITER_ENABLED")
+WRITER_QUEUE_SIZE = int(os.environ.get("WRITER_QUEUE_SIZE", "1000"))
+WRITER_BATCH_WINDOW = float(os.environ.get("WRITER_BATCH_WINDOW", "0.002"))
+WRITER_MAX_BATCH = int(os.environ.get("WRITER_MAX_BATCH", "200"))
+WRITER_SUBMIT_TIMEOUT = float(os.environ.get("WRITER_SUBMIT_TIMEOUT", "5"))
+
+
+# workers / cache
+WORKERS = int(os.environ.get("WEB_CONCURRENCY", "1"))
+# directory of the cache tier shared between workers (process local cache if unset)
+SHARED_CACHE_DIR = os.environ.get("SHARED_CACHE_DIR")
+# the one python -m app.serve and python -m app.utils.jobs share when it is unset
+DEFAULT_SHARED_CACHE_DIR = "./.cache"
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", "10000"))
+
+
+# admission control
+ADMISSION_ENABLED = env_bool("ADMISSION_ENABLED")
+# header carrying the user id set by the auth proxy (requests without it are limited by address)
+RATE_LIMIT_KEY_HEADER = "X-User-Id"
+RATE_LIMIT_PER_SECOND = float(os.environ.get("RATE_LIMIT_PER_SECOND", "20"))
+RATE_LIMIT_BURST = float(os.environ.get("RATE_LIMIT_BURST", "40"))
+# requests allowed to wait for a worker thread before shedding load
+ADMISSION_MAX_QUEUE = int(os.environ.get("ADMISSION_MAX_QUEUE", "100"))
+ADMISSION_RETRY_AFTER = float(os.environ.get("ADMISSION_RETRY_AFTER", "1"))
+# default concurrency limit of each route of a GenericCRUDRouter (0: unlimited)
+ROUTE_MAX_CONCURRENCY = int(os.environ.get("ROUTE_MAX_CONCURRENCY", "16"))
+ROUTE_MAX_QUEUE = int(os.environ.get("ROUTE_MAX_QUEUE", "32"))
+SEARCH_MAX_CONCURRENCY = int(os.environ.get("SEARCH_MAX_CONCURRENCY", "4"))
+
+
+# batch reads
+# maximum number of ids of a batch get (GET /{entity}?ids=... or POST /{entity}/batch-get)
+BATCH_GET_MAX_IDS = int(os.environ.get("BATCH_GET_MAX_IDS", "1000"))
+
+
+# counts
+# seconds the counts of filters without a maintained counter are cached
+COUNT_ESTIMATE_TTL = float(os.environ.get("COUNT_ESTIMATE_TTL", "30"))
+
+
+# compression
+COMPRESSION_ENABLED = env_bool("COMPRESSION_ENABLED", True)
+COMPRESSION_MIN_SIZE = int(os.environ.get("COMPRESSION_MIN_SIZE", "1024"))
+GZIP_LEVEL = int(os.environ.get("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.environ.get("BROTLI_QUALITY", "5"))
+# memory used by the cache of compressed payloads (per worker)
+COMPRESSION_CACHE_MAX_BYTES = int(os.environ.get("COMPRESSION_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+
+# media uploads
+# content addressed store of the uploaded images (MEDIA_DIR/<sha256[:2]>/<sha256>.<ext>)
+MEDIA_DIR = os.environ.get("MEDIA_DIR", "./media")
+MEDIA_MAX_BYTES = int(os.environ.get("MEDIA_MAX_BYTES", str(10 * 1024 * 1024)))
+# longest side in pixels of the thumbnails made of every upload (needs Pillow, empty for none)
+MEDIA_THUMBNAIL_SIZES = tuple(int(size) for size in os.environ.get("MEDIA_THUMBNAIL_SIZES", "128,512").split(",") if size)
+MEDIA_THUMBNAIL_WORKERS = int(os.environ.get("MEDIA_THUMBNAIL_WORKERS", "2"))
+
+
+# admin
+# admin endpoints are disabled unless a token is configured
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+ADMIN_TOKEN_HEADER = "X-Admin-Token"
+
+
+# profiling
+PROFILING_ENABLED = env_bool("PROFILING_ENABLED")
+PROFILING_HEADER = "X-Profile"
+PROFILING_SAMPLE_RATE = float(os.environ.get("PROFILING_SAMPLE_RATE", "0"))
+PROFILING_INTERVAL = float(os.environ.get("PROFILING_INTERVAL", "0.001"))
+PROFILING_OUTPUT_DIR = os.environ.get("PROFILING_OUTPUT_DIR", "./profiles")
+PROFILING_MAX_RESULTS = int(os.environ.get("PROFILING_MAX_RESULTS", "50"))
+
+
+# memory profiling
+MEMORY_PROFILING_ENABLED = env_bool("MEMORY_PROFILING_ENABLED")
+MEMORY_PROFILING_HEADER = "X-Profile-Memory"
+MEMORY_SAMPLE_RATE = float(os.environ.get("MEMORY_SAMPLE_RATE", "0"))
+MEMORY_TRACE_FRAMES = int(os.environ.get("MEMORY_TRACE_FRAMES", "25"))
+MEMORY_MAX_SNAPSHOTS = int(os.environ.get("MEMORY_MAX_SNAPSHOTS", "5"))
+MEMORY_MAX_REQUEST_RECORDS = int(os.environ.get("MEMORY_MAX_REQUEST_RECORDS", "200"))
+
+
+# tutor availability
+# keep an in-memory interval index of the active availabilities for availability searches
+AVAILABILITY_INDEX_ENABLED = env_bool("AVAILABILITY_INDEX_ENABLED")
+
+
+# tutor ranking
+# tutor subjects kept ranked in memory per (subject, level): the most GET /tutor/tutor_subject_top returns
+RANKING_TOP_K = int(os.environ.get("RANKING_TOP_K", "100"))
+# seconds after which the ranking is rebuilt from the database (in the background)
+RANKING_REBUILD_INTERVAL = float(os.environ.get("RANKING_REBUILD_INTERVAL", "900"))
+
+
+# history
+HISTORY_RETENTION_DAYS = float(os.environ.get("HISTORY_RETENTION_DAYS", "90"))
+HISTORY_KEEP_LAST = int(os.environ.get("HISTORY_KEEP_LAST", "1"))
+HISTORY_COMPACTION_CHUNK_SIZE = int(os.environ.get("HISTORY_COMPACTION_CHUNK_SIZE", "500"))
+
+
+# background jobs
+JOBS_DB_PATH = os.environ.get("JOBS_DB_PATH", "./jobs.db")
+# job worker threads started by each API process on startup (0: run the jobs with python -m app.utils.jobs)
+JOBS_WORKERS = int(os.environ.get("JOBS_WORKERS", "0"))
+JOBS_POLL_INTERVAL = float(os.environ.get("JOBS_POLL_INTERVAL", "0.5"))
+JOBS_VISIBILITY_TIMEOUT = float(os.environ.get("JOBS_VISIBILITY_TIMEOUT", "300"))
+JOBS_MAX_ATTEMPTS = int(os.environ.get("JOBS_MAX_ATTEMPTS", "5"))
+JOBS_BACKOFF_BASE = float(os.environ.get("JOBS_BACKOFF_BASE", "2"))
+JOBS_BACKOFF_MAX = float(os.environ.get("JOBS_BACKOFF_MAX", "600"))
+JOBS_RETENTION_DAYS = float(os.environ.get("JOBS_RETENTION_DAYS", "7"))
+
+
+# message archive
+# whole months of messages sent more than MESSAGE_HOT_DAYS ago are moved out of the message
+# table to read-only yearly files in MESSAGE_ARCHIVE_DIR (python -m app.database.archive)
+MESSAGE_HOT_DAYS = float(os.environ.get("MESSAGE_HOT_DAYS", "60"))
+MESSAGE_ARCHIVE_DIR = os.environ.get("MESSAGE_ARCHIVE_DIR", "./archive")
+# zlib compress the message bodies in the archive
+MESSAGE_ARCHIVE_COMPRESS = env_bool("MESSAGE_ARCHIVE_COMPRESS", True)
+MESSAGE_ARCHIVE_CHUNK_SIZE = int(os.environ.get("MESSAGE_ARCHIVE_CHUNK_SIZE", "1000"))
+
+
+# backups
+# online snapshots of the database (python -m app.database.backup)
+BACKUP_DIR = os.environ.get("BACKUP_DIR", "./backups")
+# pages copied per step of the backup API, with a pause between the steps for the writers
+BACKUP_PAGES_PER_STEP = int(os.environ.get("BACKUP_PAGES_PER_STEP", "1024"))
+BACKUP_STEP_PAUSE = float(os.environ.get("BACKUP_STEP_PAUSE", "0.005"))
+# restarts of a stepped copy (by concurrent writes) before the rest is copied in a single step
+BACKUP_MAX_RESTARTS = int(os.environ.get("BACKUP_MAX_RESTARTS", "3"))
+BACKUP_COMPRESS = env_bool("BACKUP_COMPRESS", True)
+# PRAGMA integrity_check on every copy before it is stored
+BACKUP_VERIFY = env_bool("BACKUP_VERIFY", True)
+# seconds between the scheduled snapshots taken by the job workers (0: on demand only)
+BACKUP_INTERVAL = float(os.environ.get("BACKUP_INTERVAL", "0"))
+# snapshots are incremental (the changed pages), with a full snapshot every BACKUP_FULL_EVERY
+BACKUP_FULL_EVERY = int(os.environ.get("BACKUP_FULL_EVERY", "24"))
+# full snapshots kept, each with its incremental snapshots
+BACKUP_KEEP_FULL = int(os.environ.get("BACKUP_KEEP_FULL", "3"))
+
+
+# online migrations
+# large tables rewritten by Alembic revisions through a shadow table (app.database.online_migration)
+ONLINE_MIGRATION_CHUNK_SIZE = int(os.environ.get("ONLINE_MIGRATION_CHUNK_SIZE", "2000"))
+# seconds between two chunks, for the writers
+ONLINE_MIGRATION_PAUSE = float(os.environ.get("ONLINE_MIGRATION_PAUSE", "0.05"))
+# only estimate the time of the online migrations (the revisions stop before being recorded)
+ONLINE_MIGRATION_DRY_RUN = env_bool("ONLINE_MIGRATION_DRY_RUN")
@@ -0,0 +1,406 @@
+"""
+Time partitioned message storage
+
+The message table is the hot partition: the messages of the last MESSAGE_HOT_DAYS (and any
+not archived yet). Whole months older than that are moved by the archive job to monthly
+partitions, tables message_YYYY_MM in one SQLite file per year in MESSAGE_ARCHIVE_DIR:
+
+    archive/message_2025.db: message_2025_01, message_2025_02, ...
+
+The archive files are only written by the archive job and are read through read-only
+connections. They are compacted (VACUUM) after each run, and the message bodies are zlib
+compressed when MESSAGE_ARCHIVE_COMPRESS is set (the bodies are the bulk of a message; the
+rest of the row stays queryable and indexed as in the hot table).
+
+Every chunk is moved in one write transaction of the hot database: the write lock is taken
+before the rows are read, so no update can land between their copy and their delete. The
+partition of every archived id is recorded in the archived_message table of the hot
+database in the same transaction.
+
+Reads are routed by CRUDMessage (app.database.crud.message): the reads without a date_sent
+range only touch the hot table; a range reaching archived months also reads those months,
+and the ids not found in the hot table are looked up in archived_message, then read from
+their partitions only. Archived messages are read-only: their versions stay in
+message_version, and updates and deletes only see the hot table.
+
+Run the archive job from the command line with:
+    python -m app.database.archive --older-than-days 60
+or enqueue it with POST /admin/messages/archive.
+"""
+
+import argparse
+import os
+import re
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import Column, Index, MetaData, String, Table, create_engine, delete, distinct, func, select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.types import TypeDecorator
+
+from app import config
+from app.database import counts
+from app.database.crud.base import MAX_IN_PARAMETERS
+from app.database.database import Base, engine as default_engine
+from app.database.filters import SEPARATOR, compile_filter
+from app.database.schemas.message_schema import Message
+from app.database.types import IdType
+from app.utils import metrics
+from app.utils.cache import cache
+from app.utils.jobs import job
+
+
+PARTITION_PREFIX = "message_"
+YEAR_FILE = re.compile(r"message_(\d{4})\.db")
+
+partition_reads = metrics.Counter("message_partition_reads_total", "Message partitions read by tier (hot, archive)")
+
+# partition of every archived message (in the hot database)
+archived_message = Table(
+    "archived_message",
+    Base.metadata,
+    Column("message_id", IdType(), primary_key=True),
+    Column("month", String, nullable=False),
+    Index("ix_archived_message_month", "month"),
+)
+
+
+class CompressedText(TypeDecorator):
+    """Text stored zlib compressed when MESSAGE_ARCHIVE_COMPRESS is set (both kinds are read)"""
+
+    impl = String
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None or not config.MESSAGE_ARCHIVE_COMPRESS:
+            return value
+        return zlib.compress(value.encode(), 9)
+
+    def process_result_value(self, value, dialect):
+        if isinstance(value, bytes):
+            return zlib.decompress(value).decode()
+        return value
+
+
+def month_of(moment: datetime) -> str:
+    """The partition of a date: YYYY_MM"""
+    return f"{moment:%Y_%m}"
+
+
+def month_range(month: str) -> Tuple[datetime, datetime]:
+    """[start, end) of a partition"""
+    year, number = int(month[:4]), int(month[5:])
+    start = datetime(year, number, 1)
+    end = datetime(year + number // 12, number % 12 + 1, 1)
+    return start, end
+
+
+@lru_cache(maxsize=None)
+def partition_table(month: str) -> Table:
+    """The table of a monthly partition: the columns of message, indexed like the hot reads"""
+    name = f"{PARTITION_PREFIX}{month}"
+    columns = [
+        Column(column.name, CompressedText() if column.name == "message" else column.type, primary_key=column.primary_key)
+        for column in Message.__table__.columns
+    ]
+    return Table(
+        name,
+        MetaData(),
+        *columns,
+        Index(f"ix_{name}_sender_id", "sender_id", "receiver_id"),
+        Index(f"ix_{name}_receiver_id", "receiver_id"),
+        Index(f"ix_{name}_date_sent", "date_sent"),
+    )
+
+
+def year_path(year: str) -> str:
+    return os.path.join(config.MESSAGE_ARCHIVE_DIR, f"message_{year}.db")
+
+
+_read_engines: Dict[str, Engine] = {}
+_catalog: Dict[str, Tuple[int, List[str]]] = {}
+_lock = threading.Lock()
+
+
+def _read_engine(path: str) -> Engine:
+    """Read-only connections to an archive file"""
+    with _lock:
+        engine = _read_engines.get(path)
+        if engine is None:
+            engine = _read_engines[path] = create_engine(
+                f"sqlite:///file:{os.path.abspath(path)}?mode=ro&uri=true",
+                connect_args={"check_same_thread": False},
+            )
+        return engine
+
+
+def partitions() -> List[str]:
+    """The archived months, most recent first"""
+    if not os.path.isdir(config.MESSAGE_ARCHIVE_DIR):
+        return []
+    months = []
+    for entry in os.scandir(config.MESSAGE_ARCHIVE_DIR):
+        if not YEAR_FILE.fullmatch(entry.name):
+            continue
+        # the tables of a file only change when the archive job writes it
+        modified = entry.stat().st_mtime_ns
+        cached = _catalog.get(entry.path)
+        if cached is None or cached[0] != modified:
+            with _read_engine(entry.path).connect() as connection:
+                names = connection.execute(
+                    text("SELECT name FROM sqlite_master WHERE type = 'table' AND name GLOB 'message_[0-9]*'")
+                ).scalars().all()
+            cached = _catalog[entry.path] = (modified, [name[len(PARTITION_PREFIX):] for name in names])
+        months += cached[1]
+    return sorted(months, reverse=True)
+
+
+def _as_datetime(value: Any) -> datetime:
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+
+def date_range(filter: Dict[str, Any]) -> Optional[Tuple[Optional[datetime], Optional[datetime]]]:
+    """The (low, high) bounds of date_sent in a filter (None when open), None if it has none"""
+    low = high = None
+    bounded = False
+    for key, value in filter.items():
+        name, _, operator = key.partition(SEPARATOR)
+        if name != "date_sent" or value is None:
+            continue
+        operator = operator or ("in" if isinstance(value, list) else "eq")
+        if operator == "eq":
+            low = high = _as_datetime(value)
+        elif operator in ("gt", "gte"):
+            low = _as_datetime(value)
+        elif operator in ("lt", "lte"):
+            high = _as_datetime(value)
+        elif operator == "between":
+            low, high = (_as_datetime(item) for item in value)
+        elif operator == "in" and value:
+            values = [_as_datetime(item) for item in value]
+            low, high = min(values), max(values)
+        else:
+            continue
+        bounded = True
+    return (low, high) if bounded else None
+
+
+def months_of_filter(filter: Dict[str, Any]) -> List[str]:
+    """The archived months a filter can match (none without a date_sent range), most recent first"""
+    bounds = date_range(filter or {})
+    if bounds is None:
+        return []
+    low, high = bounds
+    return [
+        month
+        for month in partitions()
+        if (low is None or month_range(month)[1] > low) and (high is None or month_range(month)[0] <= high)
+    ]
+
+
+def _read_month(month: str, ids: List[str], found: Dict[str, Dict[str, Any]]):
+    table = partition_table(month)
+    with _read_engine(year_path(month[:4])).connect() as connection:
+        for start in range(0, len(ids), MAX_IN_PARAMETERS):
+            chunk = ids[start : start + MAX_IN_PARAMETERS]
+            rows = connection.execute(select(table).where(table.c.message_id.in_(chunk))).mappings()
+            found.update((row["message_id"], dict(row)) for row in rows)
+    partition_reads.inc(tier="archive")
+
+
+def read_ids(connection, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    id -> values of the archived messages with the given ids, read from the partitions their
+    ids are indexed in (connection: a connection or session of the hot database)
+    """
+    by_month: Dict[str, List[str]] = {}
+    for start in range(0, len(ids), MAX_IN_PARAMETERS):
+        chunk = ids[start : start + MAX_IN_PARAMETERS]
+        rows = connection.execute(
+            select(archived_message.c.message_id, archived_message.c.month).where(
+                archived_message.c.message_id.in_(chunk)
+            )
+        )
+        for id, month in rows:
+            by_month.setdefault(month, []).append(id)
+    found: Dict[str, Dict[str, Any]] = {}
+    for month, month_ids in by_month.items():
+        _read_month(month, month_ids, found)
+    return found
+
+
+def last_archived(connection) -> Optional[int]:
+    """rowid of the last message indexed in archived_message: grows with every archived chunk"""
+    return connection.execute(text("SELECT max(rowid) FROM archived_message")).scalar()
+
+
+def _statement(month: str, filter: Dict[str, Any], count: bool = False):
+    table = partition_table(month)
+    clauses, params = compile_filter(table, filter)
+    statement = select(func.count()).select_from(table) if count else select(table).order_by(table.c.date_sent.desc())
+    return statement.where(*clauses), params
+
+
+def read(months: List[str], filter: Dict[str, Any], skip: int = 0, limit: int = None) -> List[Dict[str, Any]]:
+    """
+    The values of the archived messages matching a filter, in the given months (most recent
+    month first, each month by descending date_sent).
+
+    Raises:
+        ValueError: if the filter is invalid.
+    """
+    rows: List[Dict[str, Any]] = []
+    skip = skip or 0
+    for month in months:
+        if limit is not None and len(rows) >= limit:
+            break
+        with _read_engine(year_path(month[:4])).connect() as connection:
+            statement, params = _statement(month, filter)
+            if skip or limit is not None:
+                statement = statement.offset(skip).limit(None if limit is None else limit - len(rows))
+            found = connection.execute(statement, params).mappings().all()
+            if not found and skip:
+                # the whole month is skipped
+                statement, params = _statement(month, filter, count=True)
+                skip = max(skip - connection.execute(statement, params).scalar(), 0)
+            else:
+                skip = 0
+        partition_reads.inc(tier="archive")
+        rows += [dict(row) for row in found]
+    return rows
+
+
+def count(months: List[str], filter: Dict[str, Any]) -> int:
+    """The number of archived messages matching a filter in the given months"""
+    total = 0
+    for month in months:
+        with _read_engine(year_path(month[:4])).connect() as connection:
+            statement, params = _statement(month, filter, count=True)
+            total += connection.execute(statement, params).scalar()
+        partition_reads.inc(tier="archive")
+    return total
+
+
+def archive_month(month: str, chunk_size: int = None, pause: float = 0, engine: Engine = None) -> int:
+    """
+    Move the messages of a month from the message table to its partition, in chunks. Each
+    chunk is moved in a single write transaction of the hot database, which takes the write
+    lock before reading the rows: they are written (insert or replace) to the archive, then
+    indexed in archived_message and deleted from the hot table before it commits. An
+    interrupted run loses nothing and the next run moves the rest.
+
+    Returns:
+        int: The number of messages moved.
+    """
+    engine = engine or default_engine
+    chunk_size = chunk_size or config.MESSAGE_ARCHIVE_CHUNK_SIZE
+    start, end = month_range(month)
+    hot = Message.__table__
+    table = partition_table(month)
+    os.makedirs(config.MESSAGE_ARCHIVE_DIR, exist_ok=True)
+    archive_engine = create_engine(f"sqlite:///{year_path(month[:4])}")
+    moved = 0
+    try:
+        table.metadata.create_all(archive_engine)
+        while True:
+            with engine.begin() as connection:
+                # take the write lock first: no write can land between the copy and the delete
+                connection.execute(text("DELETE FROM message WHERE 0"))
+                rows = connection.execute(
+                    select(hot).where(hot.c.date_sent >= start, hot.c.date_sent < end).limit(chunk_size)
+                ).mappings().all()
+                if not rows:
+                    break
+                with archive_engine.begin() as archive_connection:
+                    archive_connection.execute(
+                        table.insert().prefix_with("OR REPLACE"), [dict(row) for row in rows]
+                    )
+                ids = [row["message_id"] for row in rows]
+                connection.execute(
+                    archived_message.insert().prefix_with("OR REPLACE"),
+                    [{"message_id": id, "month": month} for id in ids],
+                )
+                # a move, not a delete: bypasses the ORM, so no version or change feed entry
+                connection.execute(delete(hot).where(hot.c.message_id.in_(ids)))
+                counts.invalidate(connection, "message")
+            cache.invalidate_table("message")
+            moved += len(rows)
+            if pause:
+                time.sleep(pause)
+        if moved:
+            with archive_engine.connect() as connection:
+                connection.exec_driver_sql("VACUUM")
+    finally:
+        archive_engine.dispose()
+    return moved
+
+
+def index_partitions(engine: Engine = None) -> int:
+    """
+    Index the ids of the partitions archived before archived_message (the months without any
+    indexed id). Returns the number of ids indexed.
+    """
+    engine = engine or default_engine
+    indexed = 0
+    for month in partitions():
+        with engine.begin() as connection:
+            indexed_month = select(archived_message.c.month).where(archived_message.c.month == month)
+            if connection.execute(indexed_month.limit(1)).first() is not None:
+                continue
+            table = partition_table(month)
+            with _read_engine(year_path(month[:4])).connect() as archive_connection:
+                ids = archive_connection.execute(select(table.c.message_id)).scalars().all()
+            if ids:
+                connection.execute(
+                    archived_message.insert().prefix_with("OR IGNORE"),
+                    [{"message_id": id, "month": month} for id in ids],
+                )
+            indexed += len(ids)
+    return indexed
+
+
+def archive_messages(
+    older_than: timedelta = None, chunk_size: int = None, pause: float = 0, engine: Engine = None
+) -> Dict[str, int]:
+    """
+    Archive the whole months of messages sent before now - older_than.
+
+    Args:
+        older_than (timedelta, optional): Defaults to MESSAGE_HOT_DAYS.
+        chunk_size (int, optional): Messages moved per transaction. Defaults to MESSAGE_ARCHIVE_CHUNK_SIZE.
+        pause (float, optional): Seconds to sleep between chunks to leave room for writers. Defaults to 0.
+
+    Returns:
+        Dict[str, int]: number of messages moved per month.
+    """
+    engine = engine or default_engine
+    index_partitions(engine)
+    older_than = older_than if older_than is not None else timedelta(days=config.MESSAGE_HOT_DAYS)
+    cutoff = month_range(month_of(datetime.utcnow() - older_than))[0]
+    hot = Message.__table__
+    with engine.connect() as connection:
+        months = connection.execute(
+            select(distinct(func.strftime("%Y_%m", hot.c.date_sent))).where(hot.c.date_sent < cutoff)
+        ).scalars().all()
+    return {month: archive_month(month, chunk_size, pause, engine) for month in sorted(months)}
+
+
+@job("archive_messages")
+def archive_messages_job(db, older_than_days: float = config.MESSAGE_HOT_DAYS):
+    """archive_messages run by a job worker (POST /admin/messages/archive)"""
+    return archive_messages(timedelta(days=older_than_days))
+
+
+if __name__ == "__main__":
+    import app.database.crud  # noqa: F401 - registers the models and their version classes
+
+    parser = argparse.ArgumentParser(description="Move the old months of messages to the archive")
+    parser.add_argument("--older-than-days", type=float, default=config.MESSAGE_HOT_DAYS)
+    parser.add_argument("--chunk-size", type=int, default=config.MESSAGE_ARCHIVE_CHUNK_SIZE)
+    parser.add_argument("--pause", type=float, default=0)
+    args = parser.parse_args()
+    print(archive_messages(timedelta(days=args.older_than_days), args.chunk_size, args.pause))
@@ -0,0 +1,446 @@
+"""
+Online backups of the database
+
+A snapshot is copied with SQLite's online backup API from a separate read-only connection,
+BACKUP_PAGES_PER_STEP pages at a time with BACKUP_STEP_PAUSE seconds between the steps: each
+step is a short read transaction, so the writers are never held up for the whole copy (with
+WAL they are not held up at all) and the copy is consistent, unlike a copy of the file under
+load. A write from another connection restarts the copy; after BACKUP_MAX_RESTARTS restarts the
+rest is copied in a single step.
+
+The copy is checked (PRAGMA integrity_check) and stored in BACKUP_DIR as:
+  - a full snapshot, <name>.db (.db.gz with BACKUP_COMPRESS);
+  - or an incremental snapshot, <name>.delta(.gz): the pages that changed since the previous
+    snapshot (kept uncompressed as current.db to diff against), after which a full snapshot
+    is taken every BACKUP_FULL_EVERY snapshots. A current.db that no longer matches the
+    SHA-256 of the previous snapshot (altered, or left by an interrupted snapshot) is not
+    diffed against: a full snapshot is taken instead.
+manifest.json lists the snapshots with their parent and the SHA-256 of the database they
+restore to; the chains of the last BACKUP_KEEP_FULL full snapshots are kept.
+
+Snapshots are taken every BACKUP_INTERVAL seconds by the job workers, or on demand:
+
+    python -m app.database.backup snapshot [--full]
+    python -m app.database.backup list
+    python -m app.database.backup verify <name>
+    python -m app.database.backup restore <name> --to restored.db
+"""
+
+import argparse
+import fcntl
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import struct
+import tempfile
+import time
+import warnings
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, List
+
+from sqlalchemy.orm import Session
+
+from app import config
+from app.database.database import engine
+from app.utils import metrics
+from app.utils.jobs import QUEUED, enqueue, job, job_queue
+
+
+MANIFEST = "manifest.json"
+CURRENT = "current.db"
+# pages compared at once when diffing two snapshots
+DIFF_BLOCK_PAGES = 256
+PAGE_NUMBER = struct.Struct(">I")
+
+snapshots_taken = metrics.Counter("backup_snapshots_total", "Backup snapshots by kind (full, delta) and result (done, failed)")
+snapshot_duration = metrics.Histogram(
+    "backup_duration_seconds", "Time taken by a backup snapshot", buckets=metrics.DEFAULT_BUCKETS + (300, 900)
+)
+
+
+class BackupError(Exception):
+    """A snapshot that could not be taken, stored or restored"""
+
+
+class BackupInProgress(BackupError):
+    """Another snapshot or restore is running"""
+
+
+class _Restarted(Exception):
+    """raised from the progress callback to stop a stepped copy that keeps restarting"""
+
+
+def database_path() -> str:
+    return os.path.abspath(engine.url.database)
+
+
+def _path(name: str) -> str:
+    return os.path.join(config.BACKUP_DIR, name)
+
+
+@contextmanager
+def _exclusive():
+    """hold the backup lock of BACKUP_DIR (one snapshot at a time across workers)"""
+    os.makedirs(config.BACKUP_DIR, exist_ok=True)
+    with open(_path(".lock"), "w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise BackupInProgress("another snapshot or restore is running")
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def read_manifest() -> List[Dict[str, Any]]:
+    """The snapshots, oldest first"""
+    try:
+        with open(_path(MANIFEST)) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return []
+
+
+def _write_manifest(snapshots: List[Dict[str, Any]]):
+    partial = _path(MANIFEST + ".tmp")
+    with open(partial, "w") as file:
+        json.dump(snapshots, file, indent=1)
+    os.replace(partial, _path(MANIFEST))
+
+
+def copy_database(
+    target: str,
+    source: str = None,
+    pages: int = None,
+    pause: float = None,
+    max_restarts: int = None,
+) -> Dict[str, Any]:
+    """
+    Copy the database to target with the online backup API.
+
+    Args:
+        target (str): Path of the copy (overwritten).
+        source (str, optional): Path of the database to copy. Defaults to the application database.
+        pages (int, optional): Pages per step, -1 for a single step. Defaults to BACKUP_PAGES_PER_STEP.
+        pause (float, optional): Seconds between the steps. Defaults to BACKUP_STEP_PAUSE.
+        max_restarts (int, optional): Restarts before the rest is copied in a single step.
+            Defaults to BACKUP_MAX_RESTARTS.
+
+    Returns:
+        Dict: The number of steps and restarts, and the page count and size of the copy.
+    """
+    pages = config.BACKUP_PAGES_PER_STEP if pages is None else pages
+    pause = config.BACKUP_STEP_PAUSE if pause is None else pause
+    max_restarts = config.BACKUP_MAX_RESTARTS if max_restarts is None else max_restarts
+    stats = {"steps": 0, "restarts": 0}
+    remaining_before = [None]
+
+    def progress(status, remaining, total):
+        stats["steps"] += 1
+        if remaining_before[0] is not None and remaining > remaining_before[0]:
+            # written to by another connection: the copy started over
+            stats["restarts"] += 1
+            if stats["restarts"] > max_restarts:
+                raise _Restarted()
+        remaining_before[0] = remaining
+        if remaining and pause:
+            # between two steps: no read transaction open on the database
+            time.sleep(pause)
+
+    connection = sqlite3.connect(
+        f"file:{source or database_path()}?mode=ro", uri=True, timeout=config.SQLITE_BUSY_TIMEOUT
+    )
+    destination = sqlite3.connect(target)
+    try:
+        try:
+            connection.backup(destination, pages=pages, progress=progress)
+        except _Restarted:
+            connection.backup(destination, pages=-1)
+            stats["steps"] += 1
+        stats["page_size"] = destination.execute("PRAGMA page_size").fetchone()[0]
+        stats["page_count"] = destination.execute("PRAGMA page_count").fetchone()[0]
+        # a standalone file: no WAL to carry along
+        destination.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        destination.close()
+        connection.close()
+    return stats
+
+
+def integrity_check(path: str) -> str:
+    """The result of PRAGMA integrity_check on a database file ("ok" if it is sound)"""
+    connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        rows = connection.execute("PRAGMA integrity_check").fetchall()
+    finally:
+        connection.close()
+    return "\n".join(row[0] for row in rows)
+
+
+def _digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _open_output(path: str, compress: bool):
+    return gzip.open(path, "wb", compresslevel=6) if compress else open(path, "wb")
+
+
+def _open_input(path: str):
+    return gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")
+
+
+def _write_delta(previous: str, copy: str, page_size: int, page_count: int, path: str, compress: bool) -> int:
+    """write the pages of copy differing from previous, returns their number"""
+    block_size = page_size * DIFF_BLOCK_PAGES
+    changed = 0
+    with open(previous, "rb") as old, open(copy, "rb") as new, _open_output(path, compress) as output:
+        output.write(json.dumps({"page_size": page_size, "page_count": page_count}).encode() + b"\n")
+        for block_number in range((page_count + DIFF_BLOCK_PAGES - 1) // DIFF_BLOCK_PAGES):
+            new_block = new.read(block_size)
+            old_block = old.read(block_size)
+            if new_block == old_block:
+                continue
+            for offset in range(0, len(new_block), page_size):
+                page = new_block[offset : offset + page_size]
+                if page != old_block[offset : offset + page_size]:
+                    output.write(PAGE_NUMBER.pack(block_number * DIFF_BLOCK_PAGES + offset // page_size))
+                    output.write(page)
+                    changed += 1
+    return changed
+
+
+def _apply_delta(path: str, target: str):
+    """write the pages of a delta over the database file target"""
+    with _open_input(path) as delta, open(target, "r+b") as database:
+        header = json.loads(delta.readline())
+        page_size = header["page_size"]
+        while True:
+            number = delta.read(PAGE_NUMBER.size)
+            if not number:
+                break
+            database.seek(PAGE_NUMBER.unpack(number)[0] * page_size)
+            database.write(delta.read(page_size))
+        database.truncate(header["page_count"] * page_size)
+
+
+def snapshot(full: bool = False, compress: bool = None, verify: bool = None) -> Dict[str, Any]:
+    """
+    Take a snapshot of the database: a full one, or the pages changed since the previous one.
+
+    Args:
+        full (bool, optional): Take a full snapshot even if an incremental one would do. Defaults to False.
+        compress (bool, optional): gzip the snapshot. Defaults to BACKUP_COMPRESS.
+        verify (bool, optional): Check the integrity of the copy before storing it. Defaults to BACKUP_VERIFY.
+
+    Raises:
+        BackupInProgress: if another snapshot is being taken.
+        BackupError: if the copy is corrupt.
+
+    Returns:
+        Dict: The manifest entry of the snapshot.
+    """
+    compress = config.BACKUP_COMPRESS if compress is None else compress
+    verify = config.BACKUP_VERIFY if verify is None else verify
+    started = time.perf_counter()
+    kind = "full" if full else "delta"
+    now = datetime.utcnow()
+    name = f"{now:%Y%m%dT%H%M%S}{now.microsecond // 1000:03d}"
+    copy = _path(f"{name}.partial")
+    with _exclusive():
+        try:
+            snapshots = read_manifest()
+            stats = copy_database(copy)
+            if verify:
+                result = integrity_check(copy)
+                if result != "ok":
+                    raise BackupError(f"the copy failed the integrity check: {result[:200]}")
+            previous = snapshots[-1] if snapshots else None
+            since_full = 0
+            for entry in reversed(snapshots):
+                if entry["kind"] == "full":
+                    break
+                since_full += 1
+            if (
+                previous is None
+                or not os.path.exists(_path(CURRENT))
+                or previous["page_size"] != stats["page_size"]
+                or since_full + 1 >= config.BACKUP_FULL_EVERY
+            ):
+                kind = "full"
+            elif _digest(_path(CURRENT)) != previous["sha256"]:
+                # a delta from it would not restore to this copy
+                warnings.warn(f"{CURRENT} does not match snapshot {previous['name']}: taking a full snapshot")
+                kind = "full"
+            entry = {
+                "name": name,
+                "kind": kind,
+                "parent": None if kind == "full" else previous["name"],
+                "created_on": now.isoformat(),
+                "sha256": _digest(copy),
+                "size": stats["page_size"] * stats["page_count"],
+                **stats,
+            }
+            if kind == "full":
+                entry["file"] = f"{name}.db.gz" if compress else f"{name}.db"
+                with open(copy, "rb") as source, _open_output(_path(entry["file"]), compress) as output:
+                    shutil.copyfileobj(source, output, 1 << 20)
+            else:
+                entry["file"] = f"{name}.delta.gz" if compress else f"{name}.delta"
+                entry["changed_pages"] = _write_delta(
+                    _path(CURRENT), copy, stats["page_size"], stats["page_count"], _path(entry["file"]), compress
+                )
+            entry["stored_bytes"] = os.path.getsize(_path(entry["file"]))
+            os.replace(copy, _path(CURRENT))
+            entry["duration"] = round(time.perf_counter() - started, 3)
+            snapshots.append(entry)
+            _write_manifest(_prune(snapshots))
+        except BackupInProgress:
+            raise
+        except Exception:
+            snapshots_taken.inc(kind=kind, result="failed")
+            raise
+        finally:
+            for leftover in (f"{name}.partial", f"{name}.partial-journal"):
+                if os.path.exists(_path(leftover)):
+                    os.remove(_path(leftover))
+    snapshots_taken.inc(kind=kind, result="done")
+    snapshot_duration.observe(entry["duration"], kind=kind)
+    return entry
+
+
+def _prune(snapshots: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """drop the snapshots older than the last BACKUP_KEEP_FULL full snapshots (and their files)"""
+    fulls = [index for index, entry in enumerate(snapshots) if entry["kind"] == "full"]
+    if len(fulls) <= config.BACKUP_KEEP_FULL:
+        return snapshots
+    first_kept = fulls[-config.BACKUP_KEEP_FULL]
+    for entry in snapshots[:first_kept]:
+        if os.path.exists(_path(entry["file"])):
+            os.remove(_path(entry["file"]))
+    return snapshots[first_kept:]
+
+
+def _chain(name: str) -> List[Dict[str, Any]]:
+    """the snapshots to restore name from: its full snapshot, then the deltas up to it"""
+    by_name = {entry["name"]: entry for entry in read_manifest()}
+    if name not in by_name:
+        raise BackupError(f"no snapshot {name}")
+    chain = [by_name[name]]
+    while chain[-1]["parent"] is not None:
+        parent = by_name.get(chain[-1]["parent"])
+        if parent is None:
+            raise BackupError(f"snapshot {chain[-1]['parent']} (a parent of {name}) was pruned")
+        chain.append(parent)
+    return chain[::-1]
+
+
+def restore(name: str, target: str) -> Dict[str, Any]:
+    """
+    Restore a snapshot to a new database file, checked against the SHA-256 of the copy it
+    was taken from and for integrity. Never restore over the live database.
+
+    Raises:
+        BackupError: if the snapshot cannot be found or the restored database does not match.
+    """
+    if os.path.abspath(target) == database_path():
+        raise BackupError("restore to another file and swap it in with the application stopped")
+    with _exclusive():
+        chain = _chain(name)
+        _rebuild(chain, target)
+    return {"name": name, "restored_from": [entry["name"] for entry in chain], "path": target}
+
+
+def _rebuild(chain: List[Dict[str, Any]], target: str):
+    """write the database of the last snapshot of a chain to target, once it is checked"""
+    partial = f"{target}.partial"
+    try:
+        with _open_input(_path(chain[0]["file"])) as source, open(partial, "wb") as output:
+            shutil.copyfileobj(source, output, 1 << 20)
+        for entry in chain[1:]:
+            _apply_delta(_path(entry["file"]), partial)
+        if _digest(partial) != chain[-1]["sha256"]:
+            raise BackupError(f"the restored database does not match snapshot {chain[-1]['name']}")
+        result = integrity_check(partial)
+        if result != "ok":
+            raise BackupError(f"the restored database failed the integrity check: {result[:200]}")
+        os.replace(partial, target)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+
+
+def verify(name: str) -> Dict[str, Any]:
+    """Restore a snapshot to a scratch file and check it (see restore)"""
+    scratch = tempfile.mkdtemp(dir=config.BACKUP_DIR)
+    try:
+        report = restore(name, os.path.join(scratch, "verify.db"))
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    del report["path"]
+    return {**report, "ok": True}
+
+
+@job("backup_snapshot")
+def scheduled_snapshot(db: Session, reschedule: bool = True, full: bool = False):
+    """take a snapshot, then schedule the next one BACKUP_INTERVAL seconds later"""
+    try:
+        snapshot(full=full)
+    except BackupInProgress:
+        pass
+    finally:
+        if reschedule and config.BACKUP_INTERVAL > 0 and not _scheduled():
+            enqueue("backup_snapshot", payload={"reschedule": True}, delay=config.BACKUP_INTERVAL)
+
+
+def _scheduled() -> bool:
+    return any(
+        job["name"] == "backup_snapshot" and job["payload"].get("reschedule")
+        for job in job_queue.list(QUEUED, limit=1000)
+    )
+
+
+def schedule():
+    """Start the scheduled snapshots (every BACKUP_INTERVAL seconds, no-op if already scheduled)"""
+    if config.BACKUP_INTERVAL > 0 and not _scheduled():
+        enqueue("backup_snapshot", payload={"reschedule": True}, delay=config.BACKUP_INTERVAL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Online backups of the database")
+    commands = parser.add_subparsers(dest="command", required=True)
+    take = commands.add_parser("snapshot", help="take a snapshot (incremental unless --full)")
+    take.add_argument("--full", action="store_true")
+    commands.add_parser("list", help="list the snapshots")
+    check = commands.add_parser("verify", help="restore a snapshot to a scratch file and check it")
+    check.add_argument("name")
+    restoring = commands.add_parser("restore", help="restore a snapshot to a new database file")
+    restoring.add_argument("name")
+    restoring.add_argument("--to", required=True)
+    args = parser.parse_args()
+
+    if args.command == "snapshot":
+        entry = snapshot(full=args.full)
+        print(
+            f"{entry['name']}: {entry['kind']} {entry['file']} {entry['stored_bytes']} bytes in {entry['duration']}s "
+            f"({entry['steps']} steps, {entry['restarts']} restarts)"
+        )
+    elif args.command == "list":
+        for entry in read_manifest():
+            print(f"{entry['name']} {entry['kind']:<5} {entry['stored_bytes']:>12} {entry['file']}")
+    elif args.command == "verify":
+        print(verify(args.name))
+    else:
+        print(restore(args.name, args.to))
+
+
+if __name__ == "__main__":
+    main()
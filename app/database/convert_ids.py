@@ -0,0 +1,98 @@
+"""
+Convert the stored ids of an existing database between text and 16 byte blobs:
+
+    python -m app.database.convert_ids --to blob
+    python -m app.database.convert_ids --to text
+
+Rewrites every primary and foreign key id column of the tables and of their version
+tables, in batches of rowids (one short transaction per batch, so a running writer is only
+held up for one batch at a time). Only canonical UUID text converts to a blob: other ids stay
+text, and running it again converts nothing twice. No schema change is needed, SQLite keeps
+blobs and text in any column.
+
+Run it with the application stopped and restart it with the matching ID_STORAGE: the ids
+bound by the application are converted to the configured storage, so rows still in the other
+storage are not found by their id until they are converted.
+"""
+
+import argparse
+from typing import Dict, List
+from uuid import UUID
+
+from sqlalchemy import Table, text
+from sqlalchemy.orm import configure_mappers
+
+from app.database import crud  # noqa: F401 - registers the models
+from app.database.database import Base, engine
+from app.database.types import compact_id
+
+
+BATCH_SIZE = 5_000
+
+
+def id_columns() -> Dict[Table, List[str]]:
+    """table -> its id columns: the primary and foreign keys (the same names in the version tables)"""
+    configure_mappers()
+    tables = {}
+    for table in Base.metadata.sorted_tables:
+        if table.name.endswith("_version") or table.name == "row_count":
+            continue
+        names = [
+            column.name
+            for column in table.columns
+            if (column.primary_key or column.foreign_keys) and column.type.python_type is str
+        ]
+        if names:
+            tables[table] = names
+            version = Base.metadata.tables.get(f"{table.name}_version")
+            if version is not None:
+                tables[version] = [name for name in names if name in version.c]
+    return tables
+
+
+def _convert(value, to: str):
+    if to == "blob":
+        return compact_id(value) if isinstance(value, str) else value
+    if isinstance(value, bytes) and len(value) == 16:
+        return str(UUID(bytes=value))
+    return value
+
+
+def convert_table(table: Table, columns: List[str], to: str, batch_size: int = BATCH_SIZE) -> int:
+    """Convert the id columns of a table, returns the number of rows changed"""
+    quoted = ", ".join(f'"{column}"' for column in columns)
+    assignments = ", ".join(f'"{column}" = :c{index}' for index, column in enumerate(columns))
+    last, changed = -1, 0
+    while True:
+        with engine.begin() as connection:
+            rows = connection.execute(
+                text(f'SELECT rowid, {quoted} FROM "{table.name}" WHERE rowid > :last ORDER BY rowid LIMIT :limit'),
+                {"last": last, "limit": batch_size},
+            ).all()
+            if not rows:
+                return changed
+            updates = []
+            for rowid, *values in rows:
+                converted = [_convert(value, to) for value in values]
+                if converted != list(values):
+                    updates.append({"rowid": rowid, **{f"c{index}": value for index, value in enumerate(converted)}})
+            if updates:
+                connection.execute(text(f'UPDATE "{table.name}" SET {assignments} WHERE rowid = :rowid'), updates)
+            changed += len(updates)
+            last = rows[-1][0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert the stored ids between text and 16 byte blobs")
+    parser.add_argument("--to", choices=("blob", "text"), required=True)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    for table, columns in id_columns().items():
+        changed = convert_table(table, columns, args.to, args.batch_size)
+        print(f"{table.name}: {changed} rows converted ({', '.join(columns)})")
+    print(f"done: run the application with ID_STORAGE={args.to}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,354 @@
+"""
+Maintained row counts
+
+Counters of the active rows of a table, as a whole or grouped by some columns (e.g. the
+subjects of each tutor), kept in the row_count table. Every flush adds the inserted,
+deleted and updated rows to the counters in the same transaction, so a counter is exactly
+as committed as the rows it counts (savepoints and rollbacks included) and a total count is
+a primary key lookup instead of a COUNT(*) over the table.
+
+Writes that do not go through a flush (Core statements and raw SQL on the engine, e.g. the
+message archive) drop the counters of the table they write in their own transaction, as
+does a flush that does not know the previous value of a counted column (the attribute was
+never loaded). Code writing with another engine (e.g. an online migration under Alembic)
+calls invalidate itself.
+
+A dropped counter is rebuilt with a GROUP BY outside of the requests: by ensure_counters at
+startup, or by the "rebuild_counter" job its next count enqueues. Until then, and for the
+filters without a counter, counts are counted and cached for COUNT_ESTIMATE_TTL seconds and
+reported as estimates.
+"""
+
+import re
+import threading
+import time
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import Column, Integer, String, Table, event, inspect, text
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import get_history
+
+from app import config
+from app.database.database import Base, engine
+from app.database.filters import SEPARATOR as FILTER_SEPARATOR
+from app.database.types import id_text_sql
+from app.utils.cache import cache
+from app.utils.jobs import enqueue, job
+
+
+row_count = Table(
+    "row_count",
+    Base.metadata,
+    Column("name", String, primary_key=True),
+    Column("key", String, primary_key=True),
+    Column("count", Integer, nullable=False),
+)
+
+# key of the row marking a counter as backfilled
+READY = "\x00"
+# separator of the values of a grouped counter key
+SEPARATOR = "\x1f"
+
+
+class Counter(NamedTuple):
+    """Count of the active rows of a table grouped by columns (the whole table without columns)"""
+
+    tablename: str
+    columns: Tuple[str, ...] = ()
+
+    @property
+    def name(self) -> str:
+        return ":".join((self.tablename,) + self.columns)
+
+    def key(self, values: Dict[str, Any]) -> str:
+        return SEPARATOR.join("" if values[column] is None else str(values[column]) for column in self.columns)
+
+
+_counters: Dict[str, List[Counter]] = {}
+
+
+def counter(tablename: str, *columns: str) -> Counter:
+    """Register a maintained counter"""
+    registered = Counter(tablename, tuple(columns))
+    _counters.setdefault(tablename, []).append(registered)
+    return registered
+
+
+# the totals of the paginated lists
+for _tablename in ("user", "message", "tutor_profile", "tutor_availability", "tutor_qualification", "tutor_subject", "tutor_review"):
+    counter(_tablename)
+# rows per parent
+for _tablename in ("tutor_availability", "tutor_qualification", "tutor_subject", "tutor_review"):
+    counter(_tablename, "tutor_profile_id")
+# messages per conversation (one counter per direction) and per inbox
+counter("message", "sender_id", "receiver_id")
+counter("message", "receiver_id")
+
+
+def _active(values: Dict[str, Any], has_is_active: bool) -> bool:
+    return not has_is_active or bool(values.get("is_active"))
+
+
+def _values(state, columns, previous: bool) -> Optional[Dict[str, Any]]:
+    """The current or previous values of columns of an instance, None if unknown"""
+    values = {}
+    for column in columns:
+        if not previous:
+            values[column] = state.dict.get(column)
+            continue
+        added, unchanged, deleted = get_history(state.obj(), column, passive=True)
+        if deleted:
+            values[column] = deleted[0]
+        elif unchanged:
+            values[column] = unchanged[0]
+        elif added:
+            # changed without the previous value ever being loaded
+            return None
+        else:
+            values[column] = state.dict.get(column)
+    return values
+
+
+# flush context of the session the thread is flushing: its writes are counted by _count_changes
+_flushing = threading.local()
+# table written by an INSERT, UPDATE or DELETE statement
+_WRITE = re.compile(
+    r'\s*(?:INSERT(?:\s+OR\s+\w+)?\s+INTO|REPLACE\s+INTO|UPDATE(?:\s+OR\s+\w+)?|DELETE\s+FROM)\s+["`\[]?(\w+)',
+    re.IGNORECASE,
+)
+
+
+@event.listens_for(Session, "before_flush")
+def _flush_started(session: Session, flush_context, instances):
+    _flushing.context = flush_context
+
+
+@event.listens_for(Session, "after_flush_postexec")
+def _flush_ended(session: Session, flush_context):
+    _flushing.context = None
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _flush_failed(session: Session, previous_transaction):
+    _flushing.context = None
+
+
+def _in_flush() -> bool:
+    # a flush without work returns before it begins its transaction (and without the events above)
+    context = getattr(_flushing, "context", None)
+    return context is not None and getattr(context, "transaction", None) is not None
+
+
+@event.listens_for(engine, "after_cursor_execute")
+def _invalidate_core_writes(connection, cursor, statement, parameters, context, executemany):
+    """drop the counters of a table written without a flush, in the transaction of the write"""
+    if _in_flush():
+        return
+    match = _WRITE.match(statement)
+    counters = _counters.get(match.group(1)) if match is not None else None
+    if not counters or cursor.rowcount == 0:
+        return
+    connection.exec_driver_sql(
+        f"DELETE FROM row_count WHERE key = ? AND name IN ({', '.join('?' * len(counters))})",
+        (READY, *[counter.name for counter in counters]),
+    )
+
+
+@event.listens_for(Session, "after_flush")
+def _count_changes(session: Session, flush_context):
+    deltas: Dict[Tuple[str, str], int] = {}
+    stale = set()
+
+    def add(counter: Counter, values: Dict[str, Any], delta: int):
+        key = (counter.name, counter.key(values))
+        deltas[key] = deltas.get(key, 0) + delta
+
+    for objects, operation in ((session.new, "insert"), (session.dirty, "update"), (session.deleted, "delete")):
+        for obj in objects:
+            state = inspect(obj)
+            counters = _counters.get(state.mapper.persist_selectable.name)
+            if not counters:
+                continue
+            has_is_active = "is_active" in state.mapper.column_attrs
+            for counter in counters:
+                columns = counter.columns + (("is_active",) if has_is_active else ())
+                before = after = None
+                if operation == "update":
+                    before = _values(state, columns, previous=True)
+                    if before is None:
+                        stale.add(counter.name)
+                        continue
+                elif operation == "delete":
+                    before = _values(state, columns, previous=True) or _values(state, columns, previous=False)
+                if operation != "delete":
+                    after = _values(state, columns, previous=False)
+                if before is not None and _active(before, has_is_active):
+                    add(counter, before, -1)
+                if after is not None and _active(after, has_is_active):
+                    add(counter, after, 1)
+
+    changes = [
+        {"name": name, "key": key, "count": delta}
+        for (name, key), delta in deltas.items()
+        if delta and name not in stale
+    ]
+    if not changes and not stale:
+        return
+    connection = session.connection()
+    if changes:
+        connection.execute(
+            text(
+                "INSERT INTO row_count (name, key, count) VALUES (:name, :key, :count) "
+                "ON CONFLICT (name, key) DO UPDATE SET count = count + excluded.count"
+            ),
+            changes,
+        )
+    if stale:
+        # rebuilt on the next count
+        connection.execute(
+            text("DELETE FROM row_count WHERE name = :name AND key = :key"),
+            [{"name": name, "key": READY} for name in stale],
+        )
+
+
+def _rebuild(connection, counter: Counter):
+    """Recount a counter from its table (in the transaction of connection)"""
+    table = Base.metadata.tables[counter.tablename]
+    columns = ", ".join(f'"{column}"' for column in counter.columns)
+    key = " || char(31) || ".join(
+        f"""coalesce({id_text_sql(table.c[column], f'"{column}"')}, '')""" for column in counter.columns
+    ) or "''"
+    where = "WHERE is_active" if "is_active" in table.c else ""
+    group_by = f"GROUP BY {columns}" if columns else ""
+    connection.execute(text("DELETE FROM row_count WHERE name = :name"), {"name": counter.name})
+    connection.execute(
+        text(
+            f'INSERT INTO row_count (name, key, count) SELECT :name, {key}, count(*) FROM "{counter.tablename}" '
+            f"{where} {group_by}"
+        ),
+        {"name": counter.name},
+    )
+    connection.execute(
+        text("INSERT INTO row_count (name, key, count) VALUES (:name, :key, 0)"),
+        {"name": counter.name, "key": READY},
+    )
+
+
+def invalidate(connection, tablename: str):
+    """
+    Drop the counters of a table after a write that bypasses the ORM with another engine
+    (rebuilt after their next use)
+    """
+    counters = _counters.get(tablename, ())
+    # databases migrated to a revision before the counters do not have them yet
+    if counters and inspect(connection).has_table("row_count"):
+        connection.execute(
+            text("DELETE FROM row_count WHERE name = :name AND key = :key"),
+            [{"name": counter.name, "key": READY} for counter in counters],
+        )
+
+
+def ensure_counters():
+    """Backfill the counters that are not ready"""
+    with engine.begin() as connection:
+        ready = {
+            name
+            for (name,) in connection.execute(
+                text("SELECT name FROM row_count WHERE key = :key"), {"key": READY}
+            )
+        }
+        for counters in _counters.values():
+            for counter in counters:
+                if counter.name not in ready:
+                    _rebuild(connection, counter)
+
+
+# counter name -> when its rebuild was last enqueued
+_rebuilds: Dict[str, float] = {}
+
+
+def _request_rebuild(counter: Counter):
+    """Enqueue the rebuild of a dropped counter (at most once per COUNT_ESTIMATE_TTL per process)"""
+    now = time.monotonic()
+    if now - _rebuilds.get(counter.name, float("-inf")) < config.COUNT_ESTIMATE_TTL:
+        return
+    _rebuilds[counter.name] = now
+    enqueue("rebuild_counter", payload={"name": counter.name})
+
+
+@job("rebuild_counter")
+def rebuild_counter(db: Session, name: str):
+    """Recount a dropped counter (no-op if it was rebuilt meanwhile)"""
+    for counters in _counters.values():
+        for counter in counters:
+            if counter.name != name:
+                continue
+            with engine.begin() as connection:
+                ready = connection.execute(
+                    text("SELECT 1 FROM row_count WHERE name = :name AND key = :key"),
+                    {"name": name, "key": READY},
+                ).first()
+                if ready is None:
+                    _rebuild(connection, counter)
+            return
+
+
+def _read(connection, counter: Counter, key: str) -> Dict[str, int]:
+    """The count of a key of a counter and its READY marker"""
+    return dict(
+        connection.execute(
+            text("SELECT key, count FROM row_count WHERE name = :name AND key IN (:key, :ready)"),
+            {"name": counter.name, "key": key, "ready": READY},
+        ).all()
+    )
+
+
+def _equalities(filter: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """column -> value of a filter made of equalities only, else None"""
+    equalities = {}
+    for key, value in filter.items():
+        column, _, operator = key.partition(FILTER_SEPARATOR)
+        if operator not in ("", "eq") or isinstance(value, list):
+            return None
+        equalities[column] = value
+    return equalities
+
+
+def _find(tablename: str, columns: Iterable[str]) -> Optional[Counter]:
+    columns = set(columns)
+    for counter in _counters.get(tablename, ()):
+        if set(counter.columns) == columns:
+            return counter
+    return None
+
+
+def count(db: Session, CRUD, filter: Dict[str, Any] = None) -> Tuple[int, bool]:
+    """
+    The number of active rows of a table matching a filter (see app.database.filters).
+
+    Args:
+        db (Session): The database session.
+        CRUD (CRUDBase): The CRUD object of the table (counts the filters without counter).
+        filter (Dict[str, Any], optional): The filter. Defaults to None (all the rows).
+
+    Returns:
+        Tuple[int, bool]: The count, and whether it is exact (maintained) or a cached estimate
+        (no counter, or a counter being rebuilt).
+    """
+    filter = filter or {}
+    tablename = CRUD.model.__tablename__
+    equalities = _equalities(filter)
+    counter = _find(tablename, equalities) if equalities is not None else None
+    if counter is not None:
+        key = counter.key(equalities)
+        counts = _read(db, counter, key)
+        if READY in counts:
+            return counts.get(key, 0), True
+        # not backfilled yet (or dropped by a write): rebuilt by a job, estimated meanwhile
+        _request_rebuild(counter)
+
+    cache_key = f"count:{tablename}:{sorted((column, str(value)) for column, value in filter.items())}"
+    return (
+        cache.get_or_set(cache_key, lambda: CRUD.count(db, filter), ttl=config.COUNT_ESTIMATE_TTL),
+        False,
+    )
@@ -1,4 +1,13 @@
+from sqlalchemy import Index
+from sqlalchemy.orm import configure_mappers
+from sqlalchemy_continuum import transaction_class
+from app.database import events  # noqa: F401 - registers the change feed
+from app.database import counts  # noqa: F401 - maintains the row counts
 from app.database.crud.base import CRUDBase
+from app.database.crud.message import CRUDMessage
+from app.database.crud.tutor_availability import CRUDTutorAvailability
+from app.database.crud.tutor_profile import CRUDTutorProfile
+from app.database import tutor_card  # noqa: F401 - maintains the tutor cards
 
 # users
 from app.database.schemas.user_schema import User
@@ -12,16 +21,21 @@ from app.models.message_model import MessageCreate, MessageUpdate
 from app.database.schemas.tutor_schema import TutorProfile, TutorAvailability, TutorQualification, TutorSubject, TutorReview
 from app.models.tutor_model import TutorProfileCreate, TutorProfileUpdate, TutorAvailabilityCreate, TutorAvailabilityUpdate, TutorQualificationCreate, TutorQualificationUpdate, TutorSubjectCreate, TutorSubjectUpdate, TutorReviewCreate, TutorReviewUpdate
 
+# build the version classes of the versioned models
+configure_mappers()
+# as-of reads resolve a timestamp to a transaction with a seek on issued_at
+Index("ix_transaction_issued_at", transaction_class(User).__table__.c.issued_at)
+
 
 # users
 user = CRUDBase[User, UserCreate, UserUpdate](User)
 
 # messages
-message = CRUDBase[Message, MessageCreate, MessageUpdate](Message)
+message = CRUDMessage[Message, MessageCreate, MessageUpdate](Message)
 
 # tutor
-tutor_profile = CRUDBase[TutorProfile, TutorProfileCreate, TutorProfileUpdate](TutorProfile)
-tutor_availability = CRUDBase[TutorAvailability, TutorAvailabilityCreate, TutorAvailabilityUpdate](TutorAvailability)
+tutor_profile = CRUDTutorProfile[TutorProfile, TutorProfileCreate, TutorProfileUpdate](TutorProfile)
+tutor_availability = CRUDTutorAvailability[TutorAvailability, TutorAvailabilityCreate, TutorAvailabilityUpdate](TutorAvailability)
 tutor_qualification = CRUDBase[TutorQualification, TutorQualificationCreate, TutorQualificationUpdate](TutorQualification)
 tutor_subject = CRUDBase[TutorSubject, TutorSubjectCreate, TutorSubjectUpdate](TutorSubject)
 tutor_review = CRUDBase[TutorReview, TutorReviewCreate, TutorReviewUpdate](TutorReview)
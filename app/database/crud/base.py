@@ -1,12 +1,21 @@
-from datetime import datetime
-from typing import Generic, List, Optional, Type, TypeVar, Dict, Any
-from uuid import UUID, uuid4
+from datetime import datetime, timezone
+from typing import Generic, List, Optional, Tuple, Type, TypeVar, Dict, Any
+from uuid import UUID
 from pydantic import BaseModel
-from app.database.database import Base
+from app.database.database import Base, read_only
 from sqlalchemy.orm import Session, class_mapper, noload
+from sqlalchemy.orm.interfaces import MANYTOONE
 from sqlalchemy.orm.dynamic import AppenderQuery
 from sqlalchemy.orm.session import make_transient
-from sqlalchemy import inspect, or_
+from sqlalchemy import bindparam, func, inspect, literal, or_, select, union_all
+from sqlalchemy_continuum import transaction_class, version_class
+from sqlalchemy_continuum.exc import ClassNotVersioned
+from sqlalchemy_continuum.operation import Operation
+from app.database.filters import compile_filter
+from app.database.history import history_page
+from app.utils.ids import new_id
+from functools import lru_cache
+import hashlib
 import warnings
 
 
@@ -14,6 +23,14 @@ ModelType = TypeVar("ModelType", bound=Base)
 CreateSchemaType = TypeVar("CreateSchemaType", bound=BaseModel)
 UpdateSchemaType = TypeVar("UpdateSchemaType", bound=BaseModel)
 
+# ids bound per IN query: below SQLite's historical SQLITE_MAX_VARIABLE_NUMBER (999)
+MAX_IN_PARAMETERS = 900
+
+
+
+def _primary_key(mapper, row) -> Any:
+    """value of the (single column) primary key of a row of a mapper"""
+    return getattr(row, mapper.get_property_by_column(mapper.primary_key[0]).key)
 
 
 def get_most_recent_timestamp(
@@ -60,6 +77,29 @@ def get_most_recent_timestamp(
     return most_recent
 
 
+class AsOfRecord:
+    """
+    A version read as of a time with its many-to-one relationships resolved as of the same
+    time. The relationships of the continuum version classes are properties querying on
+    every access, so the resolved entities shadow them here instead of being set on the version.
+    """
+
+    def __init__(self, version, related: Dict[str, Any]):
+        self._version = version
+        self._related = related
+
+    def __getattr__(self, name):
+        if name in self._related:
+            return self._related[name]
+        return getattr(self._version, name)
+
+
+@lru_cache(maxsize=None)
+def _cascade_relationships(model) -> Tuple[str, ...]:
+    """Names of the relationships of a model that soft deletes cascade to"""
+    return tuple(name for name, rel in inspect(model).relationships.items() if "delete" in rel.cascade)
+
+
 def is_pydantic(obj: object):
     """Checks whether an object is pydantic."""
     return type(obj).__class__.__name__ == "ModelMetaclass"
@@ -105,11 +145,51 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
 
     Attributes:
         model (Type[ModelType]): The database model associated with this CRUD object.
+        primary_key (str): Name of the primary key attribute.
+        primary_key_column: The primary key column attribute.
+        active_column: The is_active (soft delete) column attribute, None if the model has none.
+        order_column: The updated_on column attribute the reads are ordered by, None if the model has none.
+        relationships (Tuple[str, ...]): Names of the relationships of the model.
+        cascade_relationships (Tuple[str, ...]): Names of the relationships soft deletes cascade to.
+        noload_options (Tuple): Loader options leaving the relationships unloaded (children=False).
 
     """
 
     def __init__(self, model: Type[ModelType]):
         self.model = model
+        # model metadata looked up once instead of on every call
+        mapper = inspect(model)
+        self.primary_key = mapper.get_property_by_column(mapper.primary_key[0]).key
+        self.primary_key_column = getattr(model, self.primary_key)
+        self.active_column = model.is_active if "is_active" in mapper.column_attrs else None
+        self.order_column = model.updated_on if "updated_on" in mapper.column_attrs else None
+        self.relationships = tuple(mapper.relationships.keys())
+        self.cascade_relationships = _cascade_relationships(model)
+        # noload("*") would also set up the dynamic `versions` relationship of versioned
+        # models, which runs queries for every loaded row: only noload the others
+        self.noload_options = tuple(
+            noload(getattr(model, name))
+            for name, relationship in mapper.relationships.items()
+            if relationship.lazy != "dynamic"
+        )
+        # select() statements of the hot reads by shape: built once, values are bound
+        # parameters, so SQLAlchemy reuses their cache key and compiled form
+        self._statements: Dict[Tuple, Any] = {}
+
+    def _statement(self, key: Tuple, build) -> Any:
+        statement = self._statements.get(key)
+        if statement is None:
+            statement = self._statements[key] = build()
+        return statement
+
+    def _select(self, children: bool, is_active: bool):
+        """select() of the model with the common options"""
+        statement = select(self.model)
+        if not children:
+            statement = statement.options(*self.noload_options)
+        if is_active and self.active_column is not None:
+            statement = statement.where(self.active_column)
+        return statement
 
     def create(self, db: Session, input_object: CreateSchemaType) -> ModelType:
         """
@@ -139,8 +219,8 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
         ]
         # add the primary key to the objects (if not already present)
         for db_object in db_objects:
-            if self.model.__tablename__ + "_id" not in db_object.__dict__.keys():
-                db_object.__dict__[self.model.__tablename__ + "_id"] = uuid4()
+            if self.primary_key not in db_object.__dict__.keys():
+                db_object.__dict__[self.primary_key] = new_id()
         db.add_all(db_objects)
         db.commit()
         [db.refresh(db_object) for db_object in db_objects]
@@ -185,8 +265,8 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
         ]
         # add the primary key to the objects (if not already present)
         for db_object in db_objects:
-            if self.model.__tablename__ + "_id" not in db_object.__dict__.keys():
-                db_object.__dict__[self.model.__tablename__ + "_id"] = uuid4()
+            if self.primary_key not in db_object.__dict__.keys():
+                db_object.__dict__[self.primary_key] = new_id()
             db_object.__dict__[parent_table + "_id"] = parent_id
         db.add_all(db_objects)
         db.commit()
@@ -194,12 +274,14 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
         [db.refresh(db_object) for db_object in db_objects]
         return db_objects
 
+    @read_only
     def read(
         self,
         db: Session,
         id: UUID,
         children: bool = False,
         is_active: bool = True,
+        as_of: datetime = None,
     ) -> Optional[ModelType]:
         """
         Standard read by primary key (id)
@@ -208,82 +290,365 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
             - id: the UUID corresponding to the primary key field of the table
             - children (False): optionally return child entities of the read object
             - is_active (True): if True, return only data with is_active == True
+            - as_of (None): if given, return the version of the entry valid at that time
+              (read from the version table, children are not returned)
         """
-        # TODO: include date validity logic (query from history if data not present?)
+        if as_of is not None:
+            return self._read_as_of(db, id, as_of, is_active=is_active)
 
-        query = db.query(self.model)
+        def build():
+            statement = self._select(children, is_active).where(
+                self.primary_key_column == bindparam("id")
+            )
+            # if upddated_on column is present then sort by this column in descending order
+            if self.order_column is not None:
+                statement = statement.order_by(self.order_column.desc())
+            return statement.limit(1)
 
-        if not children:
-            query = query.options(noload("*"))
+        statement = self._statement(("read", children, is_active), build)
+        return db.scalars(statement, {"id": id}).first()
 
-        # if upddated_on column is present then sort by this column in descending order
-        if "updated_on" in self.model.__dict__.keys():
-            query = query.order_by(self.model.__dict__["updated_on"].desc())
+    def _as_of_transaction(self, db: Session, as_of: datetime) -> Optional[int]:
+        """
+        The last transaction issued at or before as_of: a single seek on ix_transaction_issued_at.
 
-        # if is_active column is present then make sure we only select active data
-        if "is_active" in self.model.__dict__.keys() and is_active:
-            query = query.filter(self.model.__dict__["is_active"])
+        Transactions are stamped by continuum with the clock of the process that wrote them,
+        and this assumes the stamps increase with the transaction ids (a single writer, a clock
+        that does not step back): the transaction returned is the last one by issued_at, ties
+        broken by id.
+        """
+        if as_of.tzinfo is not None:
+            # transactions are stamped with naive UTC datetimes
+            as_of = as_of.astimezone(timezone.utc).replace(tzinfo=None)
+        Transaction = transaction_class(self.model)
+        return (
+            db.query(Transaction.id)
+            .filter(Transaction.issued_at <= as_of)
+            .order_by(Transaction.issued_at.desc(), Transaction.id.desc())
+            .limit(1)
+            .scalar()
+        )
 
-        query = query.filter(
-            self.model.__dict__[self.model.__tablename__ + "_id"] == id
+    def _read_as_of(
+        self, db: Session, id: UUID, as_of: datetime, is_active: bool = True
+    ):
+        """
+        Read the version of an entry valid at as_of.
+        Resolved with two index seeks whatever the length of the history: the transaction
+        (ix_transaction_issued_at) then the last version of the entry up to that transaction
+        (version primary key (id, transaction_id)).
+        """
+        transaction_id = self._as_of_transaction(db, as_of)
+        if transaction_id is None:
+            return None
+
+        Version = version_class(self.model)
+        version = (
+            db.query(Version)
+            .filter(getattr(Version, self.primary_key) == id)
+            .filter(Version.transaction_id <= transaction_id)
+            .order_by(Version.transaction_id.desc())
+            .limit(1)
+            .first()
         )
-        return query.first()
+        if version is None or version.operation_type == Operation.DELETE:
+            return None
+        if is_active and not getattr(version, "is_active", True):
+            return None
+        return version
+
+    @read_only
+    def resolve_as_of(self, db: Session, versions: List[Any], relationships: List[str], as_of: datetime) -> List[Any]:
+        """
+        Resolve the many-to-one relationships of versions read as of a time, as of the same
+        time, in one query per relationship (instead of a query per version and access).
+
+        Args:
+            db (Session): The database session.
+            versions (List): Versions of this model read with as_of.
+            relationships (List[str]): Names of the relationships to resolve (of the model).
+            as_of (datetime): The time the versions were read at.
 
+        Returns:
+            List[AsOfRecord]: The versions with the relationships resolved (None when the
+                related entity did not exist at that time).
+        """
+        if not versions:
+            return []
+        transaction_id = self._as_of_transaction(db, as_of)
+        mapper = inspect(self.model)
+        resolved = [{} for _ in versions]
+        for name in relationships:
+            relationship = mapper.relationships.get(name)
+            if relationship is None or relationship.direction is not MANYTOONE or len(relationship.local_remote_pairs) != 1:
+                continue
+            local, remote = relationship.local_remote_pairs[0]
+            key_attribute = mapper.get_property_by_column(local).key
+            keys = {getattr(version, key_attribute) for version in versions} - {None}
+            related = self._read_related_as_of(db, relationship.mapper, remote, keys, transaction_id)
+            for values, version in zip(resolved, versions):
+                values[name] = related.get(getattr(version, key_attribute))
+        return [AsOfRecord(version, values) for version, values in zip(versions, resolved)]
+
+    def _read_related_as_of(self, db: Session, mapper, column, keys, transaction_id: Optional[int]) -> Dict[Any, Any]:
+        """key -> entity of a related model valid at a transaction (its current row if it is not versioned)"""
+        if not keys or transaction_id is None:
+            return {}
+        key_attribute = mapper.get_property_by_column(column).key
+        try:
+            model = version_class(mapper.class_)
+            conditions = [
+                model.transaction_id <= transaction_id,
+                or_(model.end_transaction_id.is_(None), model.end_transaction_id > transaction_id),
+                model.operation_type != Operation.DELETE,
+            ]
+        except ClassNotVersioned:
+            model, conditions = mapper.class_, []
+        keys = list(keys)
+        related = {}
+        for start in range(0, len(keys), MAX_IN_PARAMETERS):
+            chunk = keys[start : start + MAX_IN_PARAMETERS]
+            for entity in db.scalars(select(model).where(getattr(model, key_attribute).in_(chunk), *conditions)):
+                related[getattr(entity, key_attribute)] = entity
+        return related
+
+    @read_only
     def read_versions(self, db: Session, id: UUID) -> List[ModelType]:
         """
-        read all the versions of an entry with a given primary key
+        read all the versions of an entry with a given primary key, oldest first
         """
 
-        head = self.read(db, id, is_active=False)
-        if head is None:
-            return []
-        versions = head.versions
-        return [version.version_parent for version in versions.all()]
+        Version = version_class(self.model)
+        return (
+            db.query(Version)
+            .filter(getattr(Version, self.primary_key) == id)
+            .order_by(Version.transaction_id)
+            .all()
+        )
 
+    @read_only
     def count_versions(self, db: Session, id: UUID) -> int:
         """
         count the number of versions of an entry with a given primary key
         """
 
-        versions = self.read(db, id, is_active=False).versions.count()
-        return versions
+        Version = version_class(self.model)
+        return (
+            db.query(Version)
+            .filter(getattr(Version, self.primary_key) == id)
+            .count()
+        )
+
+    @read_only
+    def read_validators(
+        self, db: Session, record: ModelType, related: List[str] = ()
+    ) -> Tuple[str, Optional[datetime]]:
+        """
+        HTTP validators (ETag, Last-Modified) of a record and of the records of its `related`
+        relationships, derived from the last transaction that wrote each of them: read in one
+        query seeking the version primary keys, instead of hashing the serialized response.
+        Rows without a version (written before versioning) fall back to a hash of their columns.
+
+        Args:
+            db (Session): The database session.
+            record (ModelType): The record.
+            related (List[str], optional): Relationships included in the response.
+
+        Returns:
+            Tuple[str, Optional[datetime]]: The weak ETag and the time of the last transaction.
+        """
+        # rows keyed by the mapper of their relationship, so the keys come from the mapper metadata
+        mapper = inspect(self.model)
+        rows = [(mapper, record)]
+        for name in related:
+            related_mapper = mapper.relationships[name].mapper
+            value = getattr(record, name)
+            for row in value if isinstance(value, list) else [value]:
+                if row is not None:
+                    rows.append((related_mapper, row))
+
+        # the last transaction of every row in one query: a grouped seek per model, unioned
+        keys: Dict[Any, List] = {}
+        for row_mapper, row in rows:
+            keys.setdefault(row_mapper, []).append(_primary_key(row_mapper, row))
+        indexes = {row_mapper: index for index, row_mapper in enumerate(keys)}
+        selects = []
+        for row_mapper, values in keys.items():
+            Version = version_class(row_mapper.class_)
+            key = getattr(Version, row_mapper.get_property_by_column(row_mapper.primary_key[0]).key)
+            selects.append(
+                select(literal(indexes[row_mapper]), key, func.max(Version.transaction_id))
+                .where(key.in_(set(values)))
+                .group_by(key)
+            )
+        statement = selects[0] if len(selects) == 1 else union_all(*selects)
+        last = {(index, key): transaction for index, key, transaction in db.execute(statement)}
+        transactions = [
+            last.get((indexes[row_mapper], _primary_key(row_mapper, row))) for row_mapper, row in rows
+        ]
+        if None in transactions:
+            digest = hashlib.sha1()
+            for _, row in rows:
+                for attr in inspect(row).mapper.column_attrs:
+                    digest.update(repr(getattr(row, attr.key)).encode())
+            return f'W/"h{digest.hexdigest()[:20]}"', None
+
+        Transaction = transaction_class(self.model)
+        issued_at = (
+            db.query(Transaction.issued_at)
+            .filter(Transaction.id == max(transactions))
+            .scalar()
+        )
+        return 'W/"' + "-".join(map(str, transactions)) + '"', issued_at
+
+    @read_only
+    def read_list_validator(self, db: Session, related: List[str] = ()) -> str:
+        """
+        ETag of the lists of records (and of the records of their `related` relationships):
+        the last transaction that wrote each of their tables, read in one query seeking the
+        indexed transaction_id of the version tables.
+
+        Args:
+            db (Session): The database session.
+            related (List[str], optional): Relationships included in the lists.
+
+        Returns:
+            str: The weak ETag.
+        """
+        mapper = inspect(self.model)
+        models = [self.model] + [mapper.relationships[name].mapper.class_ for name in related]
+        selects = [
+            select(func.max(version_class(model).transaction_id)).scalar_subquery()
+            for model in dict.fromkeys(models)
+        ]
+        transactions = db.execute(select(*selects)).one()
+        return 'W/"t' + "-".join(str(transaction or 0) for transaction in transactions) + '"'
+
+    @read_only
+    def read_history(
+        self, db: Session, id: UUID, limit: int = 20, cursor: int = None
+    ) -> Dict:
+        """
+        Read a page of the history of an entry, most recent version first, with the field level
+        changes of every version. Pages are keyset paginated on the version primary key
+        (id, transaction_id), so only limit + 1 versions are read whatever the length of the history.
+
+        Args:
+            db (Session): The database session.
+            id (UUID): The primary key of the entry.
+            limit (int, optional): The maximum number of versions to return. Defaults to 20.
+            cursor (int, optional): The next_cursor of the previous page. Defaults to None.
+
+        Returns:
+            Dict: {"items": [...], "next_cursor": int or None}, None if there is no such entry
+                (no version and no row, deleted or not).
+        """
+        Version = version_class(self.model)
+        Transaction = transaction_class(self.model)
+
+        query = (
+            db.query(Version, Transaction.issued_at)
+            .join(Transaction, Transaction.id == Version.transaction_id)
+            .filter(getattr(Version, self.primary_key) == id)
+        )
+        if cursor is not None:
+            query = query.filter(Version.transaction_id < cursor)
+
+        rows = query.order_by(Version.transaction_id.desc()).limit(limit + 1).all()
+        if not rows and cursor is None and self.read(db, id, is_active=False) is None:
+            return None
+        return history_page(rows, limit)
 
+    @read_only
     def read_by_filter(
-        self, db: Session, filter: Dict, children: bool = False, is_active: bool = True
+        self,
+        db: Session,
+        filter: Dict,
+        children: bool = False,
+        is_active: bool = True,
+        as_of: datetime = None,
+        skip: int = None,
+        limit: int = None,
     ) -> List[ModelType]:
         """
         Reads a record by a given filter.
 
         Args:
             db (Session): The database session.
-            filter (Dict): A dictionary where the key is the column name and the value is the value or list of values to filter on.
+            filter (Dict): A dictionary where the key is the column name, optionally with an operator
+                (column__gte, see app.database.filters), and the value is the value or list of values to filter on.
             children (bool, optional): Whether to return child objects of the selected entities. Defaults to False.
             is_active (bool, optional): Whether to filter by the 'is_active' column. Defaults to True.
+            as_of (datetime, optional): If given, filter the versions valid at that time instead of the current data
+                (children are not returned). Defaults to None.
+            skip (int, optional): Number of records to skip initially. Defaults to None.
+            limit (int, optional): The maximum number of records to return. Defaults to None (all).
 
         Returns:
             List[ModelType]: The selected record(s) or None if no records match the filter.
         """
-        query = db.query(self.model)
+        if as_of is not None:
+            model = version_class(self.model)
+            transaction_id = self._as_of_transaction(db, as_of)
+            if transaction_id is None:
+                return []
+            # validity strategy: the version valid at a transaction is the one it falls within
+            statement = select(model).where(
+                model.transaction_id <= transaction_id,
+                or_(
+                    model.end_transaction_id.is_(None),
+                    model.end_transaction_id > transaction_id,
+                ),
+                model.operation_type != Operation.DELETE,
+            )
+            if is_active and self.active_column is not None:
+                statement = statement.where(model.is_active)
+        else:
+            model = self.model
+            statement = self._statement(
+                ("read_by_filter", children, is_active), lambda: self._select(children, is_active)
+            )
 
-        if not children:
-            query = query.options(noload("*"))
+        clauses, params = compile_filter(model, filter)
+        statement = statement.where(*clauses)
 
-        if "is_active" in self.model.__dict__.keys() and is_active:
-            query = query.filter(self.model.__dict__["is_active"])
+        if self.order_column is not None:
+            statement = statement.order_by(model.updated_on.desc())
 
-        for key, value in filter.items():
-            if type(value) is list:
-                query = query.filter(self.model.__dict__[key].in_(value))
-            else:
-                query = query.filter(self.model.__dict__[key] == value)
+        if skip is not None:
+            statement = statement.offset(skip)
+        if limit is not None:
+            statement = statement.limit(limit)
+
+        return db.scalars(statement, params).all()
+
+    @read_only
+    def count(self, db: Session, filter: Dict = None, is_active: bool = True) -> int:
+        """
+        Count the records matching a filter with COUNT(*).
 
-        if "updated_on" in self.model.__dict__.keys():
-            query = query.order_by(self.model.__dict__["updated_on"].desc())
+        Args:
+            db (Session): The database session.
+            filter (Dict, optional): column name (optionally with an operator, see app.database.filters)
+                -> value or list of values. Defaults to None (all records).
+            is_active (bool, optional): Only count active records. Defaults to True.
 
-        return query.all()
+        Returns:
+            int: The number of matching records.
+        """
+        statement = select(func.count()).select_from(self.model)
+        if is_active and self.active_column is not None:
+            statement = statement.where(self.active_column)
+        clauses, params = compile_filter(self.model, filter or {})
+        return db.scalar(statement.where(*clauses), params)
 
+    @read_only
     def read_all(
-        self, db: Session, children: bool = False, is_active: bool = True
+        self,
+        db: Session,
+        children: bool = False,
+        is_active: bool = True,
+        as_of: datetime = None,
     ) -> List[ModelType]:
         """
         Read all records in a given table.
@@ -292,25 +657,24 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
             db (Session): The database session.
             children (bool, optional): Optionally return child entities of the read data. Defaults to False.
             is_active (bool, optional): Filter records based on their active status. Defaults to True.
+            as_of (datetime, optional): If given, read the versions valid at that time. Defaults to None.
 
         Returns:
             List[ModelType]: A list of all records in the table.
         """
-        # TODO: include date validity logic (query from history if data not present?)
-
-        query = db.query(self.model)
-
-        if children is False:
-            query = query.options(noload("*"))
+        if as_of is not None:
+            return self.read_by_filter(db, {}, is_active=is_active, as_of=as_of)
 
-        if "is_active" in self.model.__dict__.keys() and is_active:
-            query = query.filter(self.model.is_active)
+        def build():
+            statement = self._select(children, is_active)
+            if self.order_column is not None:
+                statement = statement.order_by(self.order_column.desc())
+            return statement
 
-        if "updated_on" in self.model.__dict__.keys():
-            query = query.order_by(self.model.__dict__["updated_on"].desc())
-
-        return query.all()  # .all()
+        statement = self._statement(("read_all", children, is_active), build)
+        return db.scalars(statement).all()
 
+    @read_only
     def read_all_by_parent_id(
         self,
         db: Session,
@@ -336,21 +700,18 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
             read_all_by_parent_id(db, parent_id=1, parent_table="parent_table", children=True)
         """
 
-        query = db.query(self.model)
-
-        if not children:
-            query = query.options(noload("*"))
-
-        query = query.filter(self.model.__dict__[parent_table + "_id"] == parent_id)
-
-        if is_active and "is_active" in self.model.__dict__.keys():
-            query = query.filter(self.model.__dict__["is_active"])
-
-        if "updated_on" in self.model.__dict__.keys():
-            query = query.order_by(self.model.__dict__["updated_on"].desc())
+        def build():
+            statement = self._select(children, is_active).where(
+                getattr(self.model, parent_table + "_id") == bindparam("parent_id")
+            )
+            if self.order_column is not None:
+                statement = statement.order_by(self.order_column.desc())
+            return statement
 
-        return query.all()
+        statement = self._statement(("read_all_by_parent_id", parent_table, children, is_active), build)
+        return db.scalars(statement, {"parent_id": parent_id}).all()
 
+    @read_only
     def read_multi(
         self,
         db: Session,
@@ -358,6 +719,7 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
         limit: int = 100,
         children: bool = False,
         is_active: bool = True,
+        as_of: datetime = None,
     ) -> List[ModelType]:
         """
         Read paginated records from a table ordered by primary key.
@@ -367,34 +729,69 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
             skip (int, optional): Number of records to skip initially. Defaults to 0.
             limit (int, optional): The maximum number of records to return. Defaults to 100.
             children (bool, optional): Optionally return child entities of the selected data. Defaults to False.
+            as_of (datetime, optional): If given, read the versions valid at that time. Defaults to None.
 
         Returns:
             List[ModelType]: A list of model instances.
 
-        Todo:
-            - Include date validity logic (query from history if data not present?)
-
         Example:
             read_multi(db, skip=10, limit=20, children=True)
         """
+        if as_of is not None:
+            return self.read_by_filter(
+                db, {}, is_active=is_active, as_of=as_of, skip=skip, limit=limit
+            )
 
-        query = db.query(self.model)
+        def build():
+            statement = self._select(children, is_active)
+            if self.order_column is not None:
+                statement = statement.order_by(self.order_column)
+            return statement.offset(bindparam("skip")).limit(bindparam("limit"))
 
-        if children is False:
-            query = query.options(noload("*"))
+        statement = self._statement(("read_multi", children, is_active), build)
+        return db.scalars(statement, {"skip": skip, "limit": limit}).all()
 
-        if is_active and "is_active" in self.model.__dict__.keys():
-            query = query.filter(self.model.__dict__["is_active"])
+    @read_only
+    def read_many(
+        self,
+        db: Session,
+        ids: List[Any],
+        children: bool = False,
+        is_active: bool = True,
+    ) -> Tuple[List[ModelType], List[Any]]:
+        """
+        Read the records with the given primary keys in as few queries as possible: the ids are
+        read in chunks of MAX_IN_PARAMETERS to stay under SQLite's bound parameter limit.
 
-        if "updated_on" in self.model.__dict__.keys():
-            query = query.order_by(
-                self.model.__dict__["updated_on"],
-            )
+        Args:
+            db (Session): The database session.
+            ids (List[Any]): The primary keys (duplicates are read once but returned every time).
+            children (bool, optional): Optionally return child entities of the read data. Defaults to False.
+            is_active (bool, optional): Only return active records. Defaults to True.
 
-        query = query.offset(skip).limit(limit)
+        Returns:
+            Tuple[List[ModelType], List[Any]]: The records found, in the order of ids (repeated
+            for repeated ids), and the distinct ids that were not found (or are inactive).
+        """
+        unique_ids = list(dict.fromkeys(ids))
+        statement = self._statement(
+            ("read_many", children, is_active),
+            lambda: self._select(children, is_active).where(
+                self.primary_key_column.in_(bindparam("ids", expanding=True))
+            ),
+        )
+
+        found = {}
+        for start in range(0, len(unique_ids), MAX_IN_PARAMETERS):
+            chunk = unique_ids[start : start + MAX_IN_PARAMETERS]
+            for record in db.scalars(statement, {"ids": chunk}):
+                found[getattr(record, self.primary_key)] = record
 
-        return query.all()
+        records = [found[id] for id in ids if id in found]
+        missing = [id for id in unique_ids if id not in found]
+        return records, missing
 
+    @read_only
     def search(
         self,
         db: Session,
@@ -426,10 +823,10 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
         query = db.query(self.model)
 
         if children is None:
-            query = query.options(noload("*"))
+            query = query.options(*self.noload_options)
 
-        if is_active and "is_active" in self.model.__dict__.keys():
-            query = query.filter(self.model.__dict__["is_active"])
+        if is_active and self.active_column is not None:
+            query = query.filter(self.active_column)
 
         # if no columns are specified, search in all columns
         if search_string is not None:
@@ -457,9 +854,7 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
                 ]
 
             # apply the search conditions
-            query = query.filter(or_(*search_conditions)).order_by(
-                self.model.__dict__[self.model.__tablename__ + "_id"]
-            )
+            query = query.filter(or_(*search_conditions)).order_by(self.primary_key_column)
 
         results = query.offset(skip).limit(limit).all()
         return results
@@ -559,14 +954,7 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
             ModelType: The updated record.
         """
         try:
-            existing = (
-                db.query(self.model)
-                .filter(
-                    self.model.__dict__[self.model.__tablename__ + "_id"]
-                    == update_dict[self.model.__tablename__ + "_id"]
-                )
-                .first()
-            )
+            existing = db.get(self.model, update_dict[self.primary_key])
         except KeyError:
             # no primary key - create a new record
             existing = self.model()
@@ -580,14 +968,7 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
                     f"Record {existing} has been modified since {last_modified}. Aborting update."
                 )
             # db.merge(existing)
-            existing = (
-                db.query(self.model)
-                .filter(
-                    self.model.__dict__[self.model.__tablename__ + "_id"]
-                    == update_dict[self.model.__tablename__ + "_id"]
-                )
-                .first()
-            )
+            existing = db.get(self.model, update_dict[self.primary_key])
         # bring existing up to date
         existing = self._update_dict_fields(db, existing, update_dict)
         # update the record
@@ -619,7 +1000,7 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
                 if not update_dict["is_active"]:
                     record = self.soft_delete(
                         db,
-                        update_dict[self.model.__tablename__ + "_id"],
+                        update_dict[self.primary_key],
                         metadata=update_dict,
                     )
                     records.append(record)
@@ -660,12 +1041,12 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
         db_objects = []
         for input_object in input_object_list:
             if type(input_object) is dict:
-                id = input_object[self.model.__tablename__ + "_id"]
+                id = input_object[self.primary_key]
             elif is_pydantic(input_object):
-                id = input_object.__dict__[self.model.__tablename__ + "_id"]
+                id = input_object.__dict__[self.primary_key]
             else:
                 # SQLAlchemy object - coerce to dict
-                id = input_object.__dict__[self.model.__tablename__ + "_id"]
+                id = input_object.__dict__[self.primary_key]
             updated = self.update(db, id, input_object, upsert=True)
             db_objects.append(updated)
 
@@ -710,14 +1091,10 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
             db.add(db_object)
             db.commit()
             db.refresh(db_object)
-            id = db_object.__dict__[self.model.__tablename__ + "_id"]
+            id = getattr(db_object, self.primary_key)
         else:
             # else Fetch the record
-            record = (
-                db.query(self.model)
-                .filter(self.model.__dict__[self.model.__tablename__ + "_id"] == id)
-                .first()
-            )
+            record = db.get(self.model, id)
 
             # If record not found, return None
             if record is None and upsert:
@@ -753,11 +1130,7 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
             db.commit()
 
         # Return updated record
-        return (
-            db.query(self.model)
-            .filter(self.model.__dict__[self.model.__tablename__ + "_id"] == id)
-            .first()
-        )
+        return db.get(self.model, id)
 
     def _get_relationships(self, model):
         """
@@ -769,12 +1142,7 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
         Returns:
             List[str]: The names of the relationships.
         """
-        inspector = inspect(model)
-        relationships = inspector.relationships.items()
-        cascade_relationships = [
-            name for name, rel in relationships if "delete" in rel.cascade
-        ]
-        return cascade_relationships
+        return list(_cascade_relationships(model))
 
     def delete(self, db: Session, id: UUID, metadata=None) -> ModelType:
         """
@@ -838,7 +1206,7 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
         Returns:
             ModelType: The soft deleted record.
         """
-        record = db.query(self.model).get(id)
+        record = db.get(self.model, id)
         if record:
             if metadata:
                 for key, value in metadata.items():
@@ -862,11 +1230,7 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
         Returns:
             ModelType: The deleted object.
         """
-        object = (
-            db.query(self.model)
-            .filter(self.model.__dict__[self.model.__tablename__ + "_id"] == id)
-            .first()
-        )
+        object = db.get(self.model, id)
         db.delete(object)
         db.commit()
         return object
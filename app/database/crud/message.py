@@ -0,0 +1,107 @@
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.database import archive
+from app.database.crud.base import CRUDBase, ModelType, CreateSchemaType, UpdateSchemaType
+from app.database.database import read_only
+from app.database.loader import loader
+
+
+class CRUDMessage(CRUDBase[ModelType, CreateSchemaType, UpdateSchemaType]):
+    """
+    CRUD object for messages routing the reads between the message table (the hot partition)
+    and the archived months (see app.database.archive). Archived messages are returned as
+    transient instances: they are read-only.
+    """
+
+    def _archived(self, db: Session, rows: List[Dict[str, Any]], children: bool) -> List[ModelType]:
+        records = [self.model(**values) for values in rows]
+        if children:
+            # transient: their references are not lazy loaded
+            loader(db).resolve(records, self.relationships)
+        return records
+
+    @read_only
+    def read(
+        self,
+        db: Session,
+        id: Any,
+        children: bool = False,
+        is_active: bool = True,
+        as_of: datetime = None,
+    ) -> Optional[ModelType]:
+        """Read a message from the hot table, else from the archive"""
+        record = super().read(db, id, children=children, is_active=is_active, as_of=as_of)
+        archive.partition_reads.inc(tier="hot")
+        if record is None and as_of is None:
+            values = archive.read_ids(db, [id]).get(id)
+            if values is not None:
+                return self._archived(db, [values], children)[0]
+        return record
+
+    @read_only
+    def read_many(
+        self,
+        db: Session,
+        ids: List[Any],
+        children: bool = False,
+        is_active: bool = True,
+    ) -> Tuple[List[ModelType], List[Any]]:
+        """Read messages by id from the hot table, the ids not found there from the archive"""
+        records, missing = super().read_many(db, ids, children=children, is_active=is_active)
+        archive.partition_reads.inc(tier="hot")
+        if not missing:
+            return records, missing
+        archived = archive.read_ids(db, missing)
+        if not archived:
+            return records, missing
+        found = {record.message_id: record for record in records}
+        found.update(zip(archived, self._archived(db, list(archived.values()), children)))
+        unique_ids = list(dict.fromkeys(ids))
+        return [found[id] for id in ids if id in found], [id for id in unique_ids if id not in found]
+
+    @read_only
+    def read_by_filter(
+        self,
+        db: Session,
+        filter: Dict,
+        children: bool = False,
+        is_active: bool = True,
+        as_of: datetime = None,
+        skip: int = None,
+        limit: int = None,
+    ) -> List[ModelType]:
+        """
+        Read the messages matching a filter: from the hot table, then (for a date_sent range
+        reaching archived months) from those months, most recent first.
+        """
+        records = super().read_by_filter(
+            db, filter, children=children, is_active=is_active, as_of=as_of, skip=skip, limit=limit
+        )
+        archive.partition_reads.inc(tier="hot")
+        months = archive.months_of_filter(filter) if as_of is None else []
+        if not months or (limit is not None and len(records) >= limit):
+            return records
+        skip = skip or 0
+        if records or not skip:
+            skip = 0
+        else:
+            # the page starts past the hot rows
+            skip = max(skip - super().count(db, filter, is_active), 0)
+        remaining = None if limit is None else limit - len(records)
+        return records + self._archived(db, archive.read(months, filter, skip, remaining), children)
+
+    @read_only
+    def read_list_validator(self, db: Session, related: List[str] = ()) -> str:
+        """ETag of the lists of messages, which also change when messages are archived (without a version)"""
+        etag = super().read_list_validator(db, related)
+        return f'{etag[:-1]}-a{archive.last_archived(db) or 0}"'
+
+    @read_only
+    def count(self, db: Session, filter: Dict = None, is_active: bool = True) -> int:
+        """Count the messages matching a filter, in the archived months of its date_sent range too"""
+        total = super().count(db, filter, is_active)
+        months = archive.months_of_filter(filter or {})
+        return total + archive.count(months, filter) if months else total
@@ -0,0 +1,68 @@
+from typing import List
+
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+
+from app.database.crud.base import CRUDBase, ModelType, CreateSchemaType, UpdateSchemaType
+from app.database.database import read_only
+from app.utils.availability.minutes_of_week import MINUTES_PER_DAY, query_windows
+
+
+class CRUDTutorAvailability(CRUDBase[ModelType, CreateSchemaType, UpdateSchemaType]):
+    """
+    CRUD object for tutor availabilities with queries over the normalised
+    minutes-of-week range (start_minute, end_minute).
+    """
+
+    @read_only
+    def read_by_week_range(
+        self,
+        db: Session,
+        start: int,
+        end: int,
+        mode: str = "cover",
+        is_active: bool = True,
+    ) -> List[ModelType]:
+        """
+        Read the availabilities matching a minutes-of-week range.
+
+        Slots are at most a day long, so the start_minute range scanned on
+        ix_tutor_availability_week_range is bounded to a day before the query.
+
+        Args:
+            db (Session): The database session.
+            start (int): Start of the query range in minutes of week.
+            end (int): End of the query range in minutes of week.
+            mode (str, optional): "cover" for slots containing the whole range,
+                "overlap" for slots intersecting it. Defaults to "cover".
+            is_active (bool, optional): Filter records based on their active status. Defaults to True.
+
+        Returns:
+            List[ModelType]: The matching availabilities.
+        """
+        start_minute = self.model.start_minute
+        end_minute = self.model.end_minute
+
+        conditions = []
+        for window_start, window_end in query_windows(start, end):
+            if mode == "cover":
+                conditions.append(
+                    and_(
+                        start_minute.between(window_start - MINUTES_PER_DAY, window_start),
+                        end_minute >= window_end,
+                    )
+                )
+            else:
+                conditions.append(
+                    and_(
+                        start_minute.between(window_start - MINUTES_PER_DAY, window_end - 1),
+                        end_minute > window_start,
+                    )
+                )
+
+        query = db.query(self.model).options(*self.noload_options).filter(or_(*conditions))
+
+        if is_active:
+            query = query.filter(self.model.is_active)
+
+        return query.order_by(start_minute).all()
@@ -0,0 +1,122 @@
+import json
+from typing import Any, Dict, List, Optional, Type
+
+from pydantic import BaseModel
+from sqlalchemy import exists, func, select
+from sqlalchemy.orm import Session
+
+from app.database.crud.base import CRUDBase, ModelType, CreateSchemaType, UpdateSchemaType
+from app.database.database import read_only
+from app.database.tutor_card import tutor_card
+from app.database.types import id_text
+from app.utils.availability.minutes_of_week import DAYS
+
+
+# read model fields named differently from their column
+FIELD_COLUMNS = {"qualification_insitution": "qualification_institution"}
+
+
+class CRUDTutorProfile(CRUDBase[ModelType, CreateSchemaType, UpdateSchemaType]):
+    """
+    CRUD object for tutor profiles with a single query read of the whole profile aggregate,
+    and the listings read from the tutor cards.
+    """
+
+    @read_only
+    def read_full(
+        self,
+        db: Session,
+        id: str,
+        children: Dict[str, Type[BaseModel]],
+        is_active: bool = True,
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Read a profile and its child collections in one query: each collection is aggregated
+        to a JSON array by a correlated subquery (json_group_array) on the child foreign key.
+
+        Args:
+            db (Session): The database session.
+            id (str): The id of the profile.
+            children (Dict[str, Type[BaseModel]]): relationship name -> read model of the
+                children to embed (the model fields are the JSON keys).
+            is_active (bool, optional): Only read active profiles and children. Defaults to True.
+
+        Returns:
+            Optional[Dict[str, Any]]: The profile columns with a list of dicts per relationship,
+                children ordered by primary key, or None if the profile does not exist.
+        """
+        relationships = self.model.__mapper__.relationships
+        primary_key = self.model.__mapper__.primary_key[0]
+        collections = []
+        child_keys = {}
+        for name, read_model in children.items():
+            child = relationships[name].mapper.class_
+            foreign_key = relationships[name].remote_side
+            child_key = child.__mapper__.primary_key[0]
+            pairs = []
+            for field in read_model.model_fields:
+                # ids stored as blobs would be embedded as JSON null
+                pairs += [field, id_text(getattr(child, FIELD_COLUMNS.get(field, field)))]
+            query = select(func.json_group_array(func.json_object(*pairs))).where(
+                *[column == primary_key for column in foreign_key]
+            )
+            if is_active and hasattr(child, "is_active"):
+                query = query.where(child.is_active)
+            collections.append(query.scalar_subquery().label(name))
+            child_keys[name] = child_key.key
+
+        query = select(self.model.__table__, *collections).where(primary_key == id)
+        if is_active and hasattr(self.model, "is_active"):
+            query = query.where(self.model.is_active)
+        row = db.execute(query).mappings().first()
+        if row is None:
+            return None
+
+        document = {column.key: row[column.key] for column in self.model.__table__.columns}
+        for name in children:
+            items: List[Dict[str, Any]] = json.loads(row[name])
+            # json_group_array has no defined order: keep the document (and its ETag) stable
+            document[name] = sorted(items, key=lambda item: item.get(child_keys[name]) or "")
+        return document
+
+    @read_only
+    def read_cards(
+        self,
+        db: Session,
+        subject: str = None,
+        level: str = None,
+        day: int = None,
+        skip: int = 0,
+        limit: int = 100,
+    ) -> List[Dict[str, Any]]:
+        """
+        Read a page of tutor cards (see app.database.tutor_card), best rated first: a single
+        narrow row per tutor.
+
+        Args:
+            db (Session): The database session.
+            subject (str, optional): Only the tutors teaching a subject (case insensitive). Defaults to None.
+            level (str, optional): Only the tutors teaching at a level (of the subject if given). Defaults to None.
+            day (int, optional): Only the tutors available on a day of the week (monday = 0). Defaults to None.
+            skip (int, optional): Number of cards to skip. Defaults to 0.
+            limit (int, optional): Maximum number of cards. Defaults to 100.
+
+        Returns:
+            List[Dict[str, Any]]: The cards.
+        """
+        query = select(tutor_card)
+        if subject is not None or level is not None:
+            taught = func.json_each(tutor_card.c.subjects).table_valued("value")
+            conditions = [
+                func.lower(func.json_extract(taught.c.value, f"$.{field}")) == value.strip().lower()
+                for field, value in (("subject", subject), ("level", level))
+                if value is not None
+            ]
+            query = query.where(exists(select(1).select_from(taught).where(*conditions)))
+        if day is not None:
+            available = func.json_each(tutor_card.c.days).table_valued("value")
+            query = query.where(exists(select(1).select_from(available).where(available.c.value == DAYS[day])))
+        query = query.order_by(
+            tutor_card.c.rating.desc().nulls_last(), tutor_card.c.review_count.desc(), tutor_card.c.tutor_profile_id
+        )
+        return [dict(row) for row in db.execute(query.offset(skip).limit(limit)).mappings()]
@@ -1,15 +1,131 @@
 # This file contains the database connection and session creation logic.
 
-from sqlalchemy import create_engine
+import functools
+import os
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import Session
+from sqlalchemy_continuum import make_versioned
+from app import config
+from app.utils import metrics
 
 URL_DATABASE = "sqlite:///./database.db"
 
-engine = create_engine(URL_DATABASE, connect_args={"check_same_thread": False})
+engine = create_engine(
+    URL_DATABASE,
+    connect_args={"check_same_thread": False, "timeout": config.SQLITE_BUSY_TIMEOUT},
+)
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+@event.listens_for(engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets readers in other workers run alongside the single writer
+    if config.SQLITE_WAL:
+        dbapi_connection.execute("PRAGMA journal_mode=WAL")
+
+
+def create_read_engine():
+    """The engine of the routed reads: READ_DATABASE_URL, else read-only connections to the database file"""
+    url = config.READ_DATABASE_URL
+    if url is None:
+        path = os.path.abspath(URL_DATABASE[len("sqlite:///"):])
+        url = f"sqlite:///file:{path}?mode=ro&uri=true"
+    read_engine = create_engine(
+        url,
+        connect_args={"check_same_thread": False, "timeout": config.SQLITE_BUSY_TIMEOUT},
+        pool_size=config.READ_POOL_SIZE,
+    )
+
+    @event.listens_for(read_engine, "connect")
+    def set_query_only(dbapi_connection, connection_record):
+        # refuse writes even on a writable replica URL
+        dbapi_connection.execute("PRAGMA query_only = 1")
+
+    return read_engine
+
+
+read_engine = create_read_engine() if config.READ_ROUTING_ENABLED else None
+
+
+def dispose_engine_after_fork():
+    """
+    Pooled connections must not be shared with a forked worker (e.g. gunicorn --preload):
+    drop the child's references to the parent's connections without closing them.
+    """
+    engine.dispose(close=False)
+    if read_engine is not None:
+        read_engine.dispose(close=False)
+
+
+os.register_at_fork(after_in_child=dispose_engine_after_fork)
+
+
+# read/write routing
+READ_ONLY = "read_only"
+PINNED = "pinned_to_primary"
+
+routed_statements = metrics.Counter("db_routed_statements_total", "Statements by engine (primary, read)")
+pinned_sessions = metrics.Counter("db_pinned_sessions_total", "Sessions pinned to the primary by a write")
+
+
+class RoutingSession(Session):
+    """
+    Session running the SELECTs of read_only operations on the read engine (when
+    READ_ROUTING_ENABLED) and everything else on the primary. Once a session has flushed a
+    write, or had a write committed for it by the group commit writer, it is pinned to the
+    primary until it is closed, so it reads its own writes (the read connections do not see
+    an open transaction, and a replica may lag behind).
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if (
+            read_engine is not None
+            and self.info.get(READ_ONLY)
+            and not self.info.get(PINNED)
+            and not self._flushing
+            and clause is not None
+            and clause.is_select
+        ):
+            routed_statements.inc(engine="read")
+            return read_engine
+        routed_statements.inc(engine="primary")
+        return engine
+
+    def close(self):
+        super().close()
+        self.info.pop(PINNED, None)
+
+
+def pin_to_primary(session: Session):
+    """Run the reads of a session on the primary until it is closed (after a write)"""
+    if read_engine is not None and not session.info.get(PINNED):
+        session.info[PINNED] = True
+        pinned_sessions.inc()
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def _pin_to_primary(session, flush_context):
+    pin_to_primary(session)
+
+
+def read_only(method):
+    """Mark a CRUD method (self, db, ...) as read-only: its SELECTs may run on the read engine"""
+
+    @functools.wraps(method)
+    def wrapper(self, db, *args, **kwargs):
+        db.info[READ_ONLY] = db.info.get(READ_ONLY, 0) + 1
+        try:
+            return method(self, db, *args, **kwargs)
+        finally:
+            db.info[READ_ONLY] -= 1
+
+    return wrapper
+
+
+SessionLocal = sessionmaker(class_=RoutingSession, autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
-        
\ No newline at end of file
+
+# history of the models declaring __versioned__ is kept in <table>_version tables
+make_versioned(user_cls=None)
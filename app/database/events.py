@@ -0,0 +1,144 @@
+"""
+Change feed of committed ORM writes
+
+Objects inserted, updated or deleted by a flush are recorded on the session and
+handed to the registered listeners once the transaction commits (and dropped on
+rollback, or on the rollback of the savepoint they were flushed in), so in-memory structures can be refreshed incrementally from the writes
+that actually made it to the database.
+
+Every commit also bumps the cache generation of the tables and rows it wrote to, which
+invalidates the cached entries built from them in every worker.
+"""
+
+import warnings
+from typing import Any, Callable, Dict, List, NamedTuple
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from app.utils.cache import cache
+
+
+class Change(NamedTuple):
+    """A committed write to a single row"""
+
+    operation: str  # "insert", "update" or "delete"
+    tablename: str
+    primary_key: Any
+    values: Dict[str, Any]  # loaded column values after the write
+    previous: Dict[str, Any] = {}  # values before an update of the columns it changed
+
+
+_listeners: Dict[str, List[Callable[[List[Change]], None]]] = {}
+
+PENDING_CHANGES = "pending_changes"
+# number of pending changes when each open savepoint began
+SAVEPOINT_MARKS = "pending_changes_savepoints"
+
+
+def on_commit(*tablenames: str):
+    """
+    Register a listener called with the list of committed changes to the given tables.
+    Without table names the listener receives the changes to every table.
+
+    Example:
+        @on_commit("tutor_availability")
+        def refresh(changes): ...
+    """
+
+    def decorator(listener):
+        for tablename in tablenames or ("*",):
+            _listeners.setdefault(tablename, []).append(listener)
+        return listener
+
+    return decorator
+
+
+def _snapshot(obj, operation: str) -> Change:
+    state = inspect(obj)
+    mapper = state.mapper
+    values = {
+        attr.key: state.dict[attr.key]
+        for attr in mapper.column_attrs
+        if attr.key in state.dict
+    }
+    previous = {}
+    if operation == "update":
+        # the attribute history is only reset after the flush
+        for attr in mapper.column_attrs:
+            deleted = state.attrs[attr.key].history.deleted
+            if deleted:
+                previous[attr.key] = deleted[0]
+    identity = mapper.primary_key_from_instance(obj)
+    primary_key = identity[0] if len(identity) == 1 else tuple(identity)
+    return Change(operation, mapper.persist_selectable.name, primary_key, values, previous)
+
+
+@event.listens_for(Session, "after_flush")
+def _record_changes(session, flush_context):
+    pending = session.info.setdefault(PENDING_CHANGES, [])
+    for obj in session.new:
+        pending.append(_snapshot(obj, "insert"))
+    for obj in session.dirty:
+        if session.is_modified(obj, include_collections=False):
+            pending.append(_snapshot(obj, "update"))
+    for obj in session.deleted:
+        pending.append(_snapshot(obj, "delete"))
+
+
+@event.listens_for(Session, "after_commit")
+def _dispatch_changes(session):
+    changes = session.info.pop(PENDING_CHANGES, None)
+    if not changes:
+        return
+    dispatch(changes)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_changes(session):
+    session.info.pop(PENDING_CHANGES, None)
+    session.info.pop(SAVEPOINT_MARKS, None)
+
+
+@event.listens_for(Session, "after_transaction_create")
+def _mark_savepoint(session, transaction):
+    if transaction.nested:
+        marks = session.info.setdefault(SAVEPOINT_MARKS, {})
+        marks[transaction] = len(session.info.get(PENDING_CHANGES, ()))
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_savepoint_changes(session, previous_transaction):
+    mark = session.info.get(SAVEPOINT_MARKS, {}).pop(previous_transaction, None)
+    if mark is not None and PENDING_CHANGES in session.info:
+        del session.info[PENDING_CHANGES][mark:]
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _release_savepoint(session, transaction):
+    if transaction.nested:
+        session.info.get(SAVEPOINT_MARKS, {}).pop(transaction, None)
+
+
+def dispatch(changes: List[Change]):
+    """Hand committed changes to the listeners of their tables"""
+    by_table: Dict[str, List[Change]] = {}
+    for change in changes:
+        by_table.setdefault(change.tablename, []).append(change)
+    for tablename in by_table:
+        cache.invalidate_table(tablename)
+    for change in changes:
+        cache.invalidate_entity(change.tablename, change.primary_key)
+    for tablename, table_changes in by_table.items():
+        for listener in _listeners.get(tablename, []):
+            _call(listener, table_changes)
+    for listener in _listeners.get("*", []):
+        _call(listener, changes)
+
+
+def _call(listener, changes: List[Change]):
+    try:
+        listener(changes)
+    except Exception as e:
+        # listeners maintain derived state - never fail the committed request because of them
+        warnings.warn(f"Change listener {listener.__name__} failed: {e}")
@@ -0,0 +1,191 @@
+"""
+Filter language of the list endpoints
+
+A filter is a dict of `column__operator` -> value (a plain `column` is `column__eq`, and a
+plain `column` with a list value is `column__in`, as read_by_filter always accepted):
+
+    {"tutor_profile_id": "x", "start_minute__gte": 600, "subject__in": ["maths", "physics"]}
+
+On the query string the values are strings, converted to the type of the column
+(`in` and `between` take comma separated values, `is_null` true or false):
+
+    ?start_minute__between=600,720&subject__prefix=math&date_read__is_null=true
+
+A repeated `column` or `column__in` matches any of the values (?subject=maths&subject=physics);
+the other operators cannot be repeated.
+
+Every operator compiles to a comparison on the bare column, so the column indexes are
+usable: `prefix` is the range [prefix, next prefix) rather than a LIKE. The compiled
+clauses only depend on the shape of the filter (its columns and operators), values are bound
+parameters, so each shape is compiled once and SQLAlchemy's statement cache is hit for
+every query of the same shape.
+"""
+
+import sys
+from datetime import date, datetime
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import and_, bindparam, inspect
+
+
+OPERATORS = ("eq", "ne", "lt", "lte", "gt", "gte", "between", "in", "prefix", "is_null")
+SEPARATOR = "__"
+
+
+def _column(model, name: str):
+    columns = inspect(model).columns
+    if name not in columns:
+        raise ValueError(f"unknown field {name}")
+    return columns[name]
+
+
+def _convert(column, value: Any) -> Any:
+    """A query string value as the python type of a column"""
+    if not isinstance(value, str):
+        return value
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return value
+    try:
+        if python_type is bool:
+            if value.lower() not in ("true", "false", "1", "0"):
+                raise ValueError(value)
+            return value.lower() in ("true", "1")
+        if python_type is datetime:
+            return datetime.fromisoformat(value)
+        if python_type is date:
+            return date.fromisoformat(value)
+        return python_type(value)
+    except (ValueError, TypeError, ArithmeticError) as e:
+        # ArithmeticError: decimal.InvalidOperation, OverflowError
+        raise ValueError(f"invalid value {value!r} for {column.key}") from e
+
+
+def _split(key: str) -> Tuple[str, str]:
+    name, _, operator = key.partition(SEPARATOR)
+    if not operator:
+        return name, "eq"
+    if operator not in OPERATORS:
+        raise ValueError(f"unknown operator {operator}")
+    return name, operator
+
+
+def _next_prefix(prefix: str) -> Optional[str]:
+    """The smallest string greater than every string starting with prefix (None if there is none)"""
+    # the last code point cannot be incremented: increment the one before it
+    prefix = prefix.rstrip(chr(sys.maxunicode))
+    if not prefix:
+        return None
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def parse(model, items: Iterable[Tuple[str, str]]) -> Dict[str, Any]:
+    """
+    A filter from query string items, validated against the columns of a model.
+
+    Raises:
+        ValueError: if a field, an operator or a value is invalid.
+    """
+    filter = {}
+    for key, value in items:
+        name, operator = _split(key)
+        column = _column(model, name)
+        if key in filter and key != name and operator != "in":
+            raise ValueError(f"repeated filter {key}")
+        if key in filter and key == name:
+            # a repeated column matches any of its values (a list value is an `in`)
+            previous = filter[key]
+            filter[key] = (previous if isinstance(previous, list) else [previous]) + [_convert(column, value)]
+        elif operator == "in" and key in filter:
+            filter[key] += [_convert(column, item) for item in value.split(",") if item != ""]
+        elif operator in ("in", "between"):
+            values = [_convert(column, item) for item in value.split(",") if item != ""]
+            if operator == "between" and len(values) != 2:
+                raise ValueError(f"between takes two values: {key}")
+            filter[key] = values
+        elif operator == "is_null":
+            if value.lower() not in ("true", "false", "1", "0"):
+                raise ValueError(f"is_null takes true or false: {key}")
+            filter[key] = value.lower() in ("true", "1")
+        elif operator == "prefix":
+            if not value:
+                raise ValueError(f"empty prefix: {key}")
+            filter[key] = value
+        else:
+            filter[key] = _convert(column, value)
+    return filter
+
+
+def compile_filter(model, filter: Dict[str, Any]) -> Tuple[Tuple, Dict[str, Any]]:
+    """
+    The clauses and bound parameters of a filter on a model.
+
+    Returns:
+        Tuple: (clauses, params) to use as query.filter(*clauses).params(**params).
+
+    Raises:
+        ValueError: if a field, an operator or a value is invalid.
+    """
+    shape = []
+    params = {}
+    for index, (key, value) in enumerate(filter.items()):
+        name, operator = _split(key)
+        if operator == "eq" and isinstance(value, list) and SEPARATOR not in key:
+            operator = "in"
+        name_param = f"f{index}"
+        if operator == "between":
+            if len(value) != 2:
+                raise ValueError(f"between takes two values: {key}")
+            params[name_param], params[name_param + "_hi"] = value
+        elif operator == "prefix":
+            if not value:
+                raise ValueError(f"empty prefix: {key}")
+            upper = _next_prefix(value)
+            if upper is None:
+                # only made of the last code point: no upper bound
+                operator = "gte"
+                params[name_param] = value
+            else:
+                params[name_param], params[name_param + "_hi"] = value, upper
+        elif operator == "is_null":
+            # a different clause for true and false: part of the shape, not a parameter
+            operator = "is_null" if value else "is_not_null"
+        elif operator == "in":
+            params[name_param] = list(value)
+        else:
+            params[name_param] = value
+        shape.append((name, operator))
+    return _compile(model, tuple(shape)), params
+
+
+@lru_cache(maxsize=1024)
+def _compile(model, shape: Tuple[Tuple[str, str], ...]) -> Tuple:
+    clauses: List = []
+    for index, (name, operator) in enumerate(shape):
+        column = _column(model, name)
+        param = f"f{index}"
+        if operator == "eq":
+            clauses.append(column == bindparam(param))
+        elif operator == "ne":
+            clauses.append(column != bindparam(param))
+        elif operator == "lt":
+            clauses.append(column < bindparam(param))
+        elif operator == "lte":
+            clauses.append(column <= bindparam(param))
+        elif operator == "gt":
+            clauses.append(column > bindparam(param))
+        elif operator == "gte":
+            clauses.append(column >= bindparam(param))
+        elif operator in ("between", "prefix"):
+            upper = column <= bindparam(param + "_hi") if operator == "between" else column < bindparam(param + "_hi")
+            clauses.append(and_(column >= bindparam(param), upper))
+        elif operator == "in":
+            # expanding: the number of values is not part of the shape
+            clauses.append(column.in_(bindparam(param, expanding=True)))
+        elif operator == "is_null":
+            clauses.append(column.is_(None))
+        elif operator == "is_not_null":
+            clauses.append(column.is_not(None))
+    return tuple(clauses)
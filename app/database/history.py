@@ -0,0 +1,229 @@
+"""
+Version history on top of sqlalchemy-continuum
+
+- field level diffs between consecutive versions
+- history compaction: versions superseded before the retention cutoff are deleted in
+  chunked transactions (the version that replaced them is kept, so the state of every
+  entity at any time after the cutoff can still be reconstructed), followed by the
+  transactions no version refers to any more.
+
+Run the compaction from the command line with:
+    python -m app.database.history --older-than-days 90
+"""
+
+import argparse
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import delete, exists, func, select, tuple_
+from sqlalchemy.engine import Engine
+from sqlalchemy_continuum import transaction_class, version_class
+from sqlalchemy_continuum.utils import is_versioned
+
+from app import config
+from app.database.database import Base, engine as default_engine
+
+
+OPERATIONS = {0: "insert", 1: "update", 2: "delete"}
+VERSION_COLUMNS = {"transaction_id", "end_transaction_id", "operation_type"}
+
+
+def versioned_models() -> List[type]:
+    """The mapped classes with a version table"""
+    return [
+        mapper.class_
+        for mapper in Base.registry.mappers
+        if is_versioned(mapper.class_)
+    ]
+
+
+def version_values(version) -> Dict[str, Any]:
+    """The column values stored in a version row, without continuum's own columns"""
+    return {
+        column.key: getattr(version, column.key)
+        for column in version.__table__.columns
+        if column.key not in VERSION_COLUMNS
+    }
+
+
+def diff_values(previous: Optional[Dict[str, Any]], current: Dict[str, Any]) -> Dict[str, Dict]:
+    """Field level changes between two versions (previous is None for the first version)"""
+    previous = previous or {}
+    return {
+        key: {"old": previous.get(key), "new": value}
+        for key, value in current.items()
+        if key not in previous or previous[key] != value
+    }
+
+
+def history_page(rows: List, limit: int) -> Dict:
+    """
+    Build a page of the history from version rows ordered by descending transaction id.
+
+    Args:
+        rows (List): up to limit + 1 (version, issued_at) rows; the extra row is only used
+            as the base of the diff of the oldest version in the page.
+        limit (int): page size.
+
+    Returns:
+        Dict: {"items": [...], "next_cursor": transaction id to pass to get the next page or None}
+    """
+    values = [version_values(version) for version, _ in rows]
+    items = []
+    for index, (version, issued_at) in enumerate(rows[:limit]):
+        previous = values[index + 1] if index + 1 < len(values) else None
+        items.append(
+            {
+                "transaction_id": version.transaction_id,
+                "issued_at": issued_at,
+                "operation": OPERATIONS.get(version.operation_type, str(version.operation_type)),
+                "changes": diff_values(previous, values[index]),
+            }
+        )
+    next_cursor = items[-1]["transaction_id"] if len(rows) > limit else None
+    return {"items": items, "next_cursor": next_cursor}
+
+
+def cutoff_transaction_id(connection, older_than: timedelta) -> Optional[int]:
+    """The last transaction issued before now - older_than"""
+    Transaction = transaction_class(versioned_models()[0])
+    cutoff = datetime.utcnow() - older_than
+    return connection.execute(
+        select(func.max(Transaction.id)).where(Transaction.issued_at < cutoff)
+    ).scalar()
+
+
+def compact_model_history(
+    model: type,
+    cutoff_transaction: int,
+    keep_last: int = 1,
+    chunk_size: int = None,
+    pause: float = 0,
+    engine: Engine = None,
+) -> int:
+    """
+    Delete the versions of a model that were superseded at or before cutoff_transaction,
+    keeping at least the last keep_last versions of every entity. Each chunk is deleted in its own
+    transaction so writers are only blocked for the duration of a chunk.
+
+    Returns:
+        int: The number of deleted versions.
+    """
+    engine = engine or default_engine
+    chunk_size = chunk_size or config.HISTORY_COMPACTION_CHUNK_SIZE
+    Version = version_class(model).__table__
+    primary_key = [column for column in Version.primary_key.columns if column.key != "transaction_id"]
+    newer = Version.alias("newer")
+
+    condition = (Version.c.end_transaction_id.isnot(None)) & (
+        Version.c.end_transaction_id <= cutoff_transaction
+    )
+    if keep_last > 1:
+        newer_versions = (
+            select(func.count())
+            .select_from(newer)
+            .where(*[newer.c[column.key] == column for column in primary_key])
+            .where(newer.c.transaction_id > Version.c.transaction_id)
+            .scalar_subquery()
+        )
+        condition = condition & (newer_versions >= keep_last)
+
+    key_columns = primary_key + [Version.c.transaction_id]
+    deleted = 0
+    while True:
+        with engine.begin() as connection:
+            keys = connection.execute(
+                select(*key_columns).where(condition).limit(chunk_size)
+            ).fetchall()
+            if keys:
+                connection.execute(
+                    delete(Version).where(tuple_(*key_columns).in_([tuple(key) for key in keys]))
+                )
+        deleted += len(keys)
+        if len(keys) < chunk_size:
+            return deleted
+        if pause:
+            time.sleep(pause)
+
+
+def prune_transactions(
+    cutoff_transaction: int, chunk_size: int = None, pause: float = 0, engine: Engine = None
+) -> int:
+    """Delete, in chunks, the transactions up to cutoff_transaction that no version refers to"""
+    engine = engine or default_engine
+    chunk_size = chunk_size or config.HISTORY_COMPACTION_CHUNK_SIZE
+    models = versioned_models()
+    Transaction = transaction_class(models[0]).__table__
+    condition = Transaction.c.id <= cutoff_transaction
+    for model in models:
+        Version = version_class(model).__table__
+        condition = condition & ~exists().where(Version.c.transaction_id == Transaction.c.id)
+
+    deleted = 0
+    while True:
+        with engine.begin() as connection:
+            ids = connection.execute(
+                select(Transaction.c.id).where(condition).limit(chunk_size)
+            ).scalars().all()
+            if ids:
+                connection.execute(delete(Transaction).where(Transaction.c.id.in_(ids)))
+        deleted += len(ids)
+        if len(ids) < chunk_size:
+            return deleted
+        if pause:
+            time.sleep(pause)
+
+
+def compact_history(
+    older_than: timedelta = None,
+    keep_last: int = None,
+    chunk_size: int = None,
+    pause: float = 0,
+    engine: Engine = None,
+) -> Dict[str, int]:
+    """
+    Compact the history of every versioned model according to the retention policy.
+
+    Args:
+        older_than (timedelta, optional): Versions superseded before now - older_than are collapsed.
+            Defaults to HISTORY_RETENTION_DAYS.
+        keep_last (int, optional): Minimum number of versions kept per entity. Defaults to HISTORY_KEEP_LAST.
+        chunk_size (int, optional): Rows deleted per transaction. Defaults to HISTORY_COMPACTION_CHUNK_SIZE.
+        pause (float, optional): Seconds to sleep between chunks to leave room for writers. Defaults to 0.
+
+    Returns:
+        Dict[str, int]: number of deleted rows per version table (and "transaction").
+    """
+    engine = engine or default_engine
+    older_than = older_than if older_than is not None else timedelta(days=config.HISTORY_RETENTION_DAYS)
+    keep_last = keep_last if keep_last is not None else config.HISTORY_KEEP_LAST
+
+    with engine.connect() as connection:
+        cutoff_transaction = cutoff_transaction_id(connection, older_than)
+    if cutoff_transaction is None:
+        return {}
+
+    results = {}
+    for model in versioned_models():
+        results[version_class(model).__table__.name] = compact_model_history(
+            model, cutoff_transaction, keep_last, chunk_size, pause, engine
+        )
+    results["transaction"] = prune_transactions(cutoff_transaction, chunk_size, pause, engine)
+    return results
+
+
+if __name__ == "__main__":
+    import app.database.crud  # noqa: F401 - registers the models and their version classes
+
+    parser = argparse.ArgumentParser(description="Compact the version history")
+    parser.add_argument("--older-than-days", type=float, default=config.HISTORY_RETENTION_DAYS)
+    parser.add_argument("--keep-last", type=int, default=config.HISTORY_KEEP_LAST)
+    parser.add_argument("--chunk-size", type=int, default=config.HISTORY_COMPACTION_CHUNK_SIZE)
+    parser.add_argument("--pause", type=float, default=0)
+    args = parser.parse_args()
+    print(
+        compact_history(
+            timedelta(days=args.older_than_days), args.keep_last, args.chunk_size, args.pause
+        )
+    )
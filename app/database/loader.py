@@ -0,0 +1,140 @@
+"""
+Request scoped batch loading of related entities
+
+Serializing a page of records touches their many-to-one relationships one record at a time
+(e.g. Message.sender / Message.receiver), each unloaded one costing a query. A DataLoader
+collects the referenced keys across all the records, drops duplicates and the entities
+already in the session, reads the rest in chunked IN queries and sets the relationships as
+loaded, so a page costs one query per related model.
+
+The loader lives in the session info: it is shared by everything running with the request
+session and remembers the keys it has resolved (including missing ones) until the session
+commits or rolls back.
+
+    loader(db).resolve(messages, ["sender", "receiver"])
+    users = loader(db).load_many(User, [profile.user_id for profile in profiles])
+"""
+
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Type
+
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.interfaces import MANYTOONE
+
+from app.database.crud.base import MAX_IN_PARAMETERS
+
+
+class DataLoader:
+    """
+    Args:
+        db (Session): Session the entities are loaded with.
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+        self.queries = 0
+        # model -> key -> entity (None when it does not exist)
+        self._loaded: Dict[type, Dict[Any, Any]] = {}
+
+    def load_many(self, model: Type, keys: Iterable[Any]) -> Dict[Any, Any]:
+        """
+        The entities of a model with the given primary keys, in as few queries as possible.
+
+        Returns:
+            Dict: key -> entity for the keys that exist.
+        """
+        keys = list(keys)
+        loaded = self._loaded.setdefault(model, {})
+        mapper = inspect(model)
+        wanted = []
+        for key in dict.fromkeys(keys):
+            if key is None or key in loaded:
+                continue
+            # already in the session: no query
+            instance = self.db.identity_map.get(mapper.identity_key_from_primary_key([key]))
+            if instance is not None and not inspect(instance).expired:
+                loaded[key] = instance
+            else:
+                wanted.append(key)
+
+        primary_key = mapper.primary_key[0]
+        key_attribute = mapper.get_property_by_column(primary_key).key
+        for start in range(0, len(wanted), MAX_IN_PARAMETERS):
+            chunk = wanted[start:start + MAX_IN_PARAMETERS]
+            for instance in self.db.scalars(select(model).where(primary_key.in_(chunk))):
+                loaded[getattr(instance, key_attribute)] = instance
+            self.queries += 1
+            for key in chunk:
+                loaded.setdefault(key, None)
+
+        return {key: loaded[key] for key in keys if loaded.get(key) is not None}
+
+    def load(self, model: Type, key: Any) -> Optional[Any]:
+        """The entity of a model with a primary key, or None"""
+        return self.load_many(model, [key]).get(key)
+
+    def resolve(self, records: List[Any], relationships: Iterable[str]) -> List[Any]:
+        """
+        Load the named many-to-one relationships of records (all of one model) in one query
+        per related model. Relationships that are already loaded, or that are not a simple
+        many-to-one reference, are left alone (and lazy loaded as before).
+        """
+        if not records:
+            return records
+        mapper = inspect(type(records[0]))
+        # relationships to the same model (e.g. sender and receiver) share one query
+        references: Dict[Type, List[Tuple[str, str, List[Any]]]] = {}
+        for name in relationships:
+            reference = self._reference(mapper, name)
+            if reference is None:
+                continue
+            model, key_attribute = reference
+            pending = [record for record in records if name in inspect(record).unloaded]
+            if pending:
+                references.setdefault(model, []).append((name, key_attribute, pending))
+        for model, pending_references in references.items():
+            entities = self.load_many(
+                model,
+                [
+                    getattr(record, key_attribute)
+                    for _, key_attribute, pending in pending_references
+                    for record in pending
+                ],
+            )
+            for name, key_attribute, pending in pending_references:
+                for record in pending:
+                    set_committed_value(record, name, entities.get(getattr(record, key_attribute)))
+        return records
+
+    @staticmethod
+    def _reference(mapper, name: str) -> Optional[Tuple[Type, str]]:
+        """(related model, foreign key attribute) of a single column many-to-one relationship"""
+        relationship = mapper.relationships.get(name)
+        if (
+            relationship is None
+            or relationship.direction is not MANYTOONE
+            or relationship.secondary is not None
+            or len(relationship.local_remote_pairs) != 1
+        ):
+            return None
+        local, remote = relationship.local_remote_pairs[0]
+        target = relationship.mapper
+        if len(target.primary_key) != 1 or target.primary_key[0] is not remote:
+            return None
+        return target.class_, mapper.get_property_by_column(local).key
+
+
+def loader(db: Session) -> DataLoader:
+    """The DataLoader of a session"""
+    data_loader = db.info.get("data_loader")
+    if data_loader is None:
+        data_loader = db.info["data_loader"] = DataLoader(db)
+    return data_loader
+
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_rollback")
+def _forget_loaded(session: Session):
+    # committed or rolled back entities may have changed: resolve them again
+    session.info.pop("data_loader", None)
@@ -0,0 +1,448 @@
+"""
+Online migrations of large tables
+
+Changing the type or format of a column (e.g. the text prices and ratings to numbers, or the
+ids to another format) means rewriting the table; done in an Alembic revision with a plain
+UPDATE or a batch_alter_table copy, the whole table is rewritten in one transaction holding
+the write lock, so every writer waits until it is done.
+
+OnlineMigration rewrites a table into a shadow table instead, while the application keeps
+reading and writing the original:
+  1. the shadow table is created with the new definition (its indexes under temporary
+     names), with triggers logging the primary key of every row written to the original in
+     a change table;
+  2. the rows are copied (through a Python transform) in chunks of rowids, one short
+     transaction per chunk with a checkpoint in online_migration: an interrupted migration
+     resumes from its last chunk when it is run again (alembic upgrade head);
+  3. the rows written meanwhile are copied again from the change table, in chunks, until a
+     chunk's worth is left;
+  4. the swap, a single short write transaction: the last changes are copied, the triggers
+     dropped and the shadow table renamed over the original (kept as _<table>_old until
+     the end), and the indexes of the shadow, built along with the copy, given their final
+     names (the original's take a suffix). SQLite cannot rename an index: the entries of
+     sqlite_master are renamed with writable_schema, as SQLite documents for schema changes
+     that leave the stored content unchanged, so no index is built once the table is swapped.
+With dry_run (or ONLINE_MIGRATION_DRY_RUN=1) nothing is changed: a few chunks are copied
+into a temporary table to estimate the time of the copy on the current data, reported, and
+the revision is stopped before Alembic records it.
+
+In a revision:
+
+    from app.database.online_migration import OnlineMigration
+
+    def upgrade():
+        target = sa.Table(
+            "tutor_subject", sa.MetaData(),
+            sa.Column("tutor_subject_id", sa.String(), primary_key=True),
+            ...
+            sa.Column("price", sa.Float()),
+            sa.Index("ix_tutor_subject_tutor_profile_id", "tutor_profile_id"),
+        )
+        OnlineMigration("tutor_subject_price_number", target, transform=price_to_number).run()
+
+The transform gets and returns the stored values of a row by column name (ids stored as
+blobs stay bytes). The version table of a versioned model is a table of its own: migrate it
+with a second OnlineMigration if its columns change too.
+"""
+
+import logging
+import re
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import Column, DateTime, Index, Integer, MetaData, String, Table, create_engine, event, text
+from sqlalchemy.engine import Connection, Engine
+
+from app import config
+from app.database import counts
+
+
+logger = logging.getLogger("alembic.online_migration")
+
+# chunks copied by a dry run to estimate the rate
+DRY_RUN_CHUNKS = 3
+SHADOW_SUFFIX = "__shadow"
+OLD_SUFFIX = "__old"
+# the name of the index in its CREATE INDEX statement
+INDEX_NAME = re.compile(r'^(\s*CREATE\s+(?:UNIQUE\s+)?INDEX\s+(?:IF\s+NOT\s+EXISTS\s+)?)("(?:[^"]|"")*"|\S+)', re.IGNORECASE)
+
+checkpoints = Table(
+    "online_migration",
+    MetaData(),
+    Column("name", String, primary_key=True),
+    Column("tablename", String, nullable=False),
+    # backfill, catchup, swapped, done
+    Column("phase", String, nullable=False),
+    Column("last_rowid", Integer, nullable=False),
+    Column("rows_copied", Integer, nullable=False),
+    Column("changes_applied", Integer, nullable=False),
+    Column("started_on", DateTime, nullable=False),
+    Column("updated_on", DateTime, nullable=False),
+)
+
+
+class DryRun(Exception):
+    """Raised at the end of a dry run so that Alembic does not record the revision"""
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+class OnlineMigration:
+    """
+    Rewrite a table to a new definition in chunks, with the application still writing to it.
+
+    Args:
+        name (str): Name of the migration (its checkpoint), unique across revisions.
+        target (Table): The new definition of the table (same name, on its own MetaData),
+            with its indexes.
+        transform (Callable, optional): Row of the table -> row of the new definition (stored
+            values by column name). Defaults to copying the columns of the same name.
+        chunk_size (int, optional): Rows per transaction. Defaults to ONLINE_MIGRATION_CHUNK_SIZE.
+        pause (float, optional): Seconds between two chunks. Defaults to ONLINE_MIGRATION_PAUSE.
+        dry_run (bool, optional): Only estimate the time. Defaults to ONLINE_MIGRATION_DRY_RUN.
+        keep_old (bool, optional): Keep the original table as _<table>_old. Defaults to False.
+        url (str, optional): Database URL. Defaults to that of the Alembic connection.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        target: Table,
+        transform: Callable[[Dict[str, Any]], Dict[str, Any]] = None,
+        chunk_size: int = None,
+        pause: float = None,
+        dry_run: bool = None,
+        keep_old: bool = False,
+        url: str = None,
+    ):
+        primary_key = list(target.primary_key.columns)
+        if len(primary_key) != 1:
+            raise ValueError(f"{target.name}: online migrations need a single column primary key")
+        self.name = name
+        self.target = target
+        self.tablename = target.name
+        self.primary_key = primary_key[0].name
+        self.transform = transform
+        self.chunk_size = chunk_size or config.ONLINE_MIGRATION_CHUNK_SIZE
+        self.pause = config.ONLINE_MIGRATION_PAUSE if pause is None else pause
+        self.dry_run = config.ONLINE_MIGRATION_DRY_RUN if dry_run is None else dry_run
+        self.keep_old = keep_old
+        self.url = url
+        self.shadow = f"_{self.tablename}_new"
+        self.old = f"_{self.tablename}_old"
+        self.changes = f"_{self.tablename}_changes"
+        self.columns = [column.name for column in target.columns]
+
+    # connections
+
+    def _engine(self) -> Engine:
+        url = self.url
+        if url is None:
+            from alembic import op
+
+            url = op.get_bind().engine.url
+        engine = create_engine(url, connect_args={"timeout": config.SQLITE_BUSY_TIMEOUT})
+
+        @event.listens_for(engine, "connect")
+        def set_pragmas(dbapi_connection, connection_record):
+            # the original table is renamed away and dropped: leave the foreign keys of the
+            # other tables (and the views and triggers) pointing at its name
+            dbapi_connection.execute("PRAGMA foreign_keys = OFF")
+            dbapi_connection.execute("PRAGMA legacy_alter_table = ON")
+
+        return engine
+
+    def run(self) -> Dict[str, Any]:
+        """
+        Run (or resume) the migration, from Alembic's upgrade() unless url is given.
+
+        Raises:
+            DryRun: at the end of a dry run, with the estimate.
+
+        Returns:
+            Dict: The checkpoint of the finished migration.
+        """
+        if self.url is not None:
+            return self._run(self._engine())
+        from alembic import op
+
+        # the chunks are committed one by one, outside of the transaction of the revision
+        with op.get_context().autocommit_block():
+            return self._run(self._engine())
+
+    def _run(self, engine: Engine) -> Dict[str, Any]:
+        try:
+            if self.dry_run:
+                estimate = self.estimate(engine)
+                logger.info(f"{self.name}: dry run {estimate}")
+                raise DryRun(f"{self.name}: dry run, nothing changed: {estimate}")
+            checkpoint = self._prepare(engine)
+            if checkpoint["phase"] == "backfill":
+                self._backfill(engine, checkpoint)
+            if checkpoint["phase"] == "catchup":
+                self._catch_up(engine)
+                self._swap(engine)
+            if checkpoint["phase"] in ("catchup", "swapped"):
+                self._finish(engine)
+            return self._checkpoint(engine)
+        finally:
+            engine.dispose()
+
+    # steps
+
+    def _checkpoint(self, connectable) -> Optional[Dict[str, Any]]:
+        def read(connection):
+            row = connection.execute(checkpoints.select().where(checkpoints.c.name == self.name)).mappings().first()
+            return None if row is None else dict(row)
+
+        if isinstance(connectable, Connection):
+            return read(connectable)
+        with connectable.connect() as connection:
+            return read(connection)
+
+    def _update_checkpoint(self, connection: Connection, **values):
+        connection.execute(
+            checkpoints.update().where(checkpoints.c.name == self.name),
+            {**values, "updated_on": datetime.utcnow()},
+        )
+
+    def _prepare(self, engine: Engine) -> Dict[str, Any]:
+        """create the checkpoint, the shadow table, the change table and the triggers (once)"""
+        checkpoints.create(engine, checkfirst=True)
+        checkpoint = self._checkpoint(engine)
+        if checkpoint is not None:
+            logger.info(f"{self.name}: resuming ({checkpoint['phase']}, {checkpoint['rows_copied']} rows copied)")
+            return checkpoint
+        table, shadow, changes, key = (
+            _quote(self.tablename), _quote(self.shadow), _quote(self.changes), _quote(self.primary_key),
+        )
+        with engine.begin() as connection:
+            self._shadow_table(self.shadow).create(connection)
+            connection.execute(text(f"CREATE TABLE {changes} (seq INTEGER PRIMARY KEY AUTOINCREMENT, pk)"))
+            for operation, keys in (
+                ("INSERT", ["NEW"]),
+                ("UPDATE", ["OLD", "NEW"]),
+                ("DELETE", ["OLD"]),
+            ):
+                values = ", ".join(f"({row}.{key})" for row in keys)
+                connection.execute(
+                    text(
+                        f"CREATE TRIGGER {_quote(f'{self.changes}_{operation.lower()}')} AFTER {operation} ON {table} "
+                        f"BEGIN INSERT INTO {changes} (pk) VALUES {values}; END"
+                    )
+                )
+            now = datetime.utcnow()
+            checkpoint = {
+                "name": self.name,
+                "tablename": self.tablename,
+                "phase": "backfill",
+                "last_rowid": 0,
+                "rows_copied": 0,
+                "changes_applied": 0,
+                "started_on": now,
+                "updated_on": now,
+            }
+            connection.execute(checkpoints.insert(), checkpoint)
+        logger.info(f"{self.name}: created {self.shadow}, logging the writes to {self.tablename}")
+        return checkpoint
+
+    def _shadow_table(self, name: str) -> Table:
+        """the target definition as a table of another name, its indexes under temporary names"""
+        shadow = Table(name, MetaData(), *[column._copy() for column in self.target.columns])
+        for index in self.target.indexes:
+            Index(
+                f"{index.name}{SHADOW_SUFFIX}",
+                *[shadow.c[column.name] for column in index.columns],
+                unique=index.unique,
+            )
+        return shadow
+
+    def _rows(self, connection: Connection, where: str, parameters: Dict[str, Any]) -> List[Dict[str, Any]]:
+        result = connection.execute(
+            text(f"SELECT rowid AS _rowid_, * FROM {_quote(self.tablename)} WHERE {where}"), parameters
+        )
+        return [dict(row) for row in result.mappings()]
+
+    def _convert(self, row: Dict[str, Any]) -> Dict[str, Any]:
+        values = {key: value for key, value in row.items() if key != "_rowid_"}
+        if self.transform is not None:
+            values = self.transform(values)
+        return {column: values.get(column) for column in self.columns}
+
+    def _insert(self, connection: Connection, tablename: str, rows: List[Dict[str, Any]]):
+        if not rows:
+            return
+        columns = ", ".join(_quote(column) for column in self.columns)
+        parameters = ", ".join(f":c{index}" for index in range(len(self.columns)))
+        connection.execute(
+            text(f"INSERT OR REPLACE INTO {_quote(tablename)} ({columns}) VALUES ({parameters})"),
+            [{f"c{index}": row[column] for index, column in enumerate(self.columns)} for row in rows],
+        )
+
+    def _copy_chunk(self, connection: Connection, tablename: str, last_rowid: int) -> List[Dict[str, Any]]:
+        rows = self._rows(connection, "rowid > :last ORDER BY rowid LIMIT :limit", {"last": last_rowid, "limit": self.chunk_size})
+        self._insert(connection, tablename, [self._convert(row) for row in rows])
+        return rows
+
+    def _backfill(self, engine: Engine, checkpoint: Dict[str, Any]):
+        """copy the rows in chunks of rowids, each with its checkpoint"""
+        with engine.connect() as connection:
+            total = connection.execute(text(f"SELECT max(rowid) FROM {_quote(self.tablename)}")).scalar() or 0
+        last_rowid, copied = checkpoint["last_rowid"], checkpoint["rows_copied"]
+        started, logged = time.monotonic(), time.monotonic()
+        while True:
+            with engine.begin() as connection:
+                rows = self._copy_chunk(connection, self.shadow, last_rowid)
+                if rows:
+                    last_rowid = rows[-1]["_rowid_"]
+                    copied += len(rows)
+                    self._update_checkpoint(connection, last_rowid=last_rowid, rows_copied=copied)
+                else:
+                    self._update_checkpoint(connection, phase="catchup")
+                    checkpoint["phase"] = "catchup"
+            if not rows:
+                break
+            if time.monotonic() - logged > 5:
+                logged = time.monotonic()
+                rate = copied / max(logged - started, 1e-9)
+                logger.info(f"{self.name}: {copied} rows copied (rowid {last_rowid}/{total}, {rate:.0f} rows/s)")
+            time.sleep(self.pause)
+        logger.info(f"{self.name}: backfill done, {copied} rows in {time.monotonic() - started:.1f}s")
+
+    def _apply_changes(self, connection: Connection, limit: Optional[int]) -> int:
+        """copy again the rows logged in the change table (up to limit changes), returns the number applied"""
+        query = f"SELECT seq, pk FROM {_quote(self.changes)} ORDER BY seq"
+        changes = connection.execute(text(query + (" LIMIT :limit" if limit else "")), {"limit": limit}).all()
+        if not changes:
+            return 0
+        keys = list(dict.fromkeys(pk for _, pk in changes))
+        key = _quote(self.primary_key)
+        for start in range(0, len(keys), 500):
+            chunk = keys[start : start + 500]
+            parameters = {f"k{index}": value for index, value in enumerate(chunk)}
+            placeholders = ", ".join(f":{name}" for name in parameters)
+            rows = self._rows(connection, f"{key} IN ({placeholders})", parameters)
+            self._insert(connection, self.shadow, [self._convert(row) for row in rows])
+            found = {row[self.primary_key] for row in rows}
+            deleted = {name: value for name, value in parameters.items() if value not in found}
+            if deleted:
+                connection.execute(
+                    text(f"DELETE FROM {_quote(self.shadow)} WHERE {key} IN ({', '.join(f':{name}' for name in deleted)})"),
+                    deleted,
+                )
+        connection.execute(text(f"DELETE FROM {_quote(self.changes)} WHERE seq <= :last"), {"last": changes[-1][0]})
+        return len(changes)
+
+    def _catch_up(self, engine: Engine):
+        """apply the logged changes in chunks until less than a chunk is left"""
+        while True:
+            with engine.begin() as connection:
+                applied = self._apply_changes(connection, self.chunk_size)
+                if applied:
+                    checkpoint = self._checkpoint(connection)
+                    self._update_checkpoint(connection, changes_applied=checkpoint["changes_applied"] + applied)
+            if applied < self.chunk_size:
+                return
+            time.sleep(self.pause)
+
+    def _swap(self, engine: Engine):
+        """apply the last changes and rename the shadow table over the original, in one transaction"""
+        started = time.monotonic()
+        with engine.begin() as connection:
+            # take the write lock first: no write can land between the last change and the rename
+            connection.execute(text(f"DELETE FROM {_quote(self.changes)} WHERE 0"))
+            applied = self._apply_changes(connection, None)
+            for operation in ("insert", "update", "delete"):
+                connection.execute(text(f"DROP TRIGGER IF EXISTS {_quote(f'{self.changes}_{operation}')}"))
+            connection.execute(text(f"ALTER TABLE {_quote(self.tablename)} RENAME TO {_quote(self.old)}"))
+            connection.execute(text(f"ALTER TABLE {_quote(self.shadow)} RENAME TO {_quote(self.tablename)}"))
+            connection.execute(text(f"DROP TABLE {_quote(self.changes)}"))
+            self._rename_indexes(connection)
+            # the row counts are maintained by the flushes of the application, not by this engine
+            counts.invalidate(connection, self.tablename)
+            checkpoint = self._checkpoint(connection)
+            self._update_checkpoint(connection, phase="swapped", changes_applied=checkpoint["changes_applied"] + applied)
+        logger.info(f"{self.name}: swapped {self.tablename} in {(time.monotonic() - started) * 1000:.0f}ms")
+
+    def _rename_indexes(self, connection: Connection):
+        """
+        give the indexes of the shadow their final names, the original's of the same names
+        taking the OLD_SUFFIX: edits of sqlite_master only, in the swap transaction
+        """
+        names = {index.name for index in self.target.indexes}
+        renames = [
+            (name, f"{name}{OLD_SUFFIX}")
+            for (name,) in connection.execute(
+                text("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :table"), {"table": self.old}
+            )
+            if name in names
+        ] + [(f"{name}{SHADOW_SUFFIX}", name) for name in names]
+        if not renames:
+            return
+        version = connection.execute(text("PRAGMA schema_version")).scalar()
+        connection.execute(text("PRAGMA writable_schema = ON"))
+        try:
+            for name, new_name in renames:
+                sql = connection.execute(
+                    text("SELECT sql FROM sqlite_master WHERE type = 'index' AND name = :name"), {"name": name}
+                ).scalar()
+                sql = INDEX_NAME.sub(lambda match: match.group(1) + _quote(new_name), sql, count=1)
+                connection.execute(
+                    text("UPDATE sqlite_master SET name = :new_name, sql = :sql WHERE type = 'index' AND name = :name"),
+                    {"name": name, "new_name": new_name, "sql": sql},
+                )
+            # the other connections reload the schema
+            connection.execute(text(f"PRAGMA schema_version = {version + 1}"))
+        finally:
+            connection.execute(text("PRAGMA writable_schema = OFF"))
+
+    def _finish(self, engine: Engine):
+        """drop (or keep) the original table"""
+        with engine.begin() as connection:
+            if not self.keep_old:
+                connection.execute(text(f"DROP TABLE IF EXISTS {_quote(self.old)}"))
+            self._update_checkpoint(connection, phase="done")
+        logger.info(f"{self.name}: done")
+
+    # dry run
+
+    def estimate(self, engine: Engine) -> Dict[str, Any]:
+        """
+        Estimate the time of the migration on the current data: a few chunks are copied into a
+        temporary table (through the transform) and the rate extrapolated to the whole table.
+        """
+        sample = f"_{self.tablename}_estimate"
+        with engine.connect() as connection:
+            rows = connection.execute(text(f"SELECT count(*) FROM {_quote(self.tablename)}")).scalar()
+            self._shadow_table(sample).create(connection)
+            connection.commit()
+            try:
+                copied, last_rowid, elapsed = 0, 0, 0.0
+                for _ in range(DRY_RUN_CHUNKS):
+                    started = time.perf_counter()
+                    chunk = self._copy_chunk(connection, sample, last_rowid)
+                    connection.commit()
+                    elapsed += time.perf_counter() - started
+                    if not chunk:
+                        break
+                    copied += len(chunk)
+                    last_rowid = chunk[-1]["_rowid_"]
+            finally:
+                connection.execute(text(f"DROP TABLE IF EXISTS {_quote(sample)}"))
+                connection.commit()
+        chunks = -(-rows // self.chunk_size)
+        rate = copied / elapsed if elapsed else None
+        copy_seconds = rows / rate if rate else 0.0
+        return {
+            "table": self.tablename,
+            "rows": rows,
+            "chunks": chunks,
+            "chunk_size": self.chunk_size,
+            "rows_per_second": round(rate) if rate else None,
+            "chunk_seconds": round(elapsed / max(-(-copied // self.chunk_size), 1), 4),
+            "estimated_seconds": round(copy_seconds + chunks * self.pause, 1),
+            "indexes": len(self.target.indexes),
+        }
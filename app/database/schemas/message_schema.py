@@ -1,20 +1,24 @@
-from sqlalchemy import Column, String, DateTime, ForeignKey
+from sqlalchemy import Column, String, DateTime, ForeignKey, Index
 from sqlalchemy.orm import relationship
-from sqlalchemy.dialects.postgresql import UUID
 from app.database.database import Base
-from uuid import uuid4
+from app.database.types import IdType
+from app.utils.ids import new_id
 
 class Message(Base):
     __tablename__ = 'message'
+    __versioned__ = {}
 
-    message_id = Column(String, primary_key=True, default=lambda: str(uuid4()))
-    sender_id = Column(String, ForeignKey('user.user_id'))
-    receiver_id = Column(String, ForeignKey('user.user_id'))
+    message_id = Column(IdType(), primary_key=True, default=new_id)
+    sender_id = Column(IdType(), ForeignKey('user.user_id'))
+    receiver_id = Column(IdType(), ForeignKey('user.user_id'))
     message = Column(String)
     sender = relationship("User", foreign_keys=[sender_id])
     receiver = relationship("User", foreign_keys=[receiver_id])
     date_sent = Column(DateTime)
     date_read = Column(DateTime, nullable=True)
+
+    # history ranges and the archive job select by date_sent
+    __table_args__ = (Index("ix_message_date_sent", "date_sent"),)
     
     
     def __repr__(self):
@@ -1,14 +1,18 @@
 from typing import List
-from sqlalchemy import Column, String, Date, ForeignKey, Boolean
+from sqlalchemy import Column, String, Date, ForeignKey, Boolean, Integer, Index, event
 from app.database.database import Base
-from uuid import uuid4
+from app.utils.availability.minutes_of_week import to_week_range
+from app.database.types import IdType
+from app.utils.ids import new_id
 from sqlalchemy.orm import relationship
+import warnings
 
 class TutorProfile(Base):
     __tablename__ = 'tutor_profile'
+    __versioned__ = {}
 
-    tutor_profile_id = Column(String, primary_key=True, default=str(uuid4()))
-    user_id = Column(String, ForeignKey('user.user_id'))
+    tutor_profile_id = Column(IdType(), primary_key=True, default=new_id)
+    user_id = Column(IdType(), ForeignKey('user.user_id'))
     profile_photo = Column(String)
     first_name = Column(String)
     last_name = Column(String)
@@ -23,6 +27,8 @@ class TutorProfile(Base):
     tutor_availability = relationship("TutorAvailability", back_populates="tutor_profile")
     tutor_qualification = relationship("TutorQualification", back_populates="tutor_profile")
     tutor_subject = relationship("TutorSubject", back_populates="tutor_profile")
+    # the other side of TutorReview.tutor_profile: mapper configuration fails without it
+    tutor_review = relationship("TutorReview", back_populates="tutor_profile")
 
     is_active = Column(Boolean, default=True)
     
@@ -31,23 +37,46 @@ class TutorProfile(Base):
 # TutorAvailability
 class TutorAvailability(Base):
     __tablename__ = 'tutor_availability'
+    __versioned__ = {}
 
-    tutor_availability_id = Column(String, primary_key=True, default=str(uuid4()))
-    tutor_profile_id = Column(String, ForeignKey('tutor_profile.tutor_profile_id'))
+    tutor_availability_id = Column(IdType(), primary_key=True, default=new_id)
+    tutor_profile_id = Column(IdType(), ForeignKey('tutor_profile.tutor_profile_id'))
     day = Column(String)
     start_time = Column(String)
     end_time = Column(String)
+    # normalised [start_minute, end_minute) range in minutes of week (monday 00:00 = 0), set on write
+    start_minute = Column(Integer, nullable=True)
+    end_minute = Column(Integer, nullable=True)
     is_active = Column(Boolean, default=True)
     
     tutor_profile = relationship("TutorProfile", back_populates="tutor_availability")
+
+    __table_args__ = (
+        Index("ix_tutor_availability_week_range", "start_minute", "end_minute"),
+        Index("ix_tutor_availability_tutor_profile_id", "tutor_profile_id"),
+    )
+
+
+@event.listens_for(TutorAvailability, "before_insert")
+@event.listens_for(TutorAvailability, "before_update")
+def set_week_range(mapper, connection, target):
+    """keep start_minute/end_minute in sync with the free-form day, start_time and end_time"""
+    try:
+        target.start_minute, target.end_minute = to_week_range(
+            target.day or "", target.start_time or "", target.end_time or ""
+        )
+    except ValueError as e:
+        warnings.warn(f"Could not normalise tutor availability {target.tutor_availability_id}: {e}")
+        target.start_minute, target.end_minute = None, None
     
     
 # TutorQualification
 class TutorQualification(Base):
     __tablename__ = 'tutor_qualification'
+    __versioned__ = {}
 
-    tutor_qualification_id = Column(String, primary_key=True, default=str(uuid4()))
-    tutor_profile_id = Column(String, ForeignKey('tutor_profile.tutor_profile_id'))
+    tutor_qualification_id = Column(IdType(), primary_key=True, default=new_id)
+    tutor_profile_id = Column(IdType(), ForeignKey('tutor_profile.tutor_profile_id'))
     qualification_institution = Column(String)
     qualification_subject = Column(String)
     qualification_type = Column(String)
@@ -61,9 +90,10 @@ class TutorQualification(Base):
 # TutorSubject
 class TutorSubject(Base):
     __tablename__ = 'tutor_subject'
+    __versioned__ = {}
 
-    tutor_subject_id = Column(String, primary_key=True, default=str(uuid4()))
-    tutor_profile_id = Column(String, ForeignKey('tutor_profile.tutor_profile_id'))
+    tutor_subject_id = Column(IdType(), primary_key=True, default=new_id)
+    tutor_profile_id = Column(IdType(), ForeignKey('tutor_profile.tutor_profile_id'))
     subject = Column(String)
     level = Column(String)
     price = Column(String)
@@ -71,15 +101,18 @@ class TutorSubject(Base):
     is_active = Column(Boolean, default=True)
     
     tutor_profile = relationship("TutorProfile", back_populates="tutor_subject")
+
+    __table_args__ = (Index("ix_tutor_subject_tutor_profile_id", "tutor_profile_id"),)
     
     
 # TutorReview
 class TutorReview(Base):
     __tablename__ = 'tutor_review'
+    __versioned__ = {}
 
-    tutor_review_id = Column(String, primary_key=True, default=str(uuid4()))
-    tutor_profile_id = Column(String, ForeignKey('tutor_profile.tutor_profile_id'))
-    user_id = Column(String, ForeignKey('user.user_id'))
+    tutor_review_id = Column(IdType(), primary_key=True, default=new_id)
+    tutor_profile_id = Column(IdType(), ForeignKey('tutor_profile.tutor_profile_id'))
+    user_id = Column(IdType(), ForeignKey('user.user_id'))
     review = Column(String)
     rating = Column(String)
     
@@ -87,4 +120,6 @@ class TutorReview(Base):
     
     tutor_profile = relationship("TutorProfile", back_populates="tutor_review")
     user = relationship("User", back_populates="tutor_review")
+
+    __table_args__ = (Index("ix_tutor_review_tutor_profile_id", "tutor_profile_id"),)
     
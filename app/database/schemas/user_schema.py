@@ -1,11 +1,14 @@
 from sqlalchemy import Column, String, Date, ForeignKey, CheckConstraint
+from sqlalchemy.orm import relationship
 from app.database.database import Base
-from uuid import uuid4
+from app.database.types import IdType
+from app.utils.ids import new_id
 
 class User(Base):
     __tablename__ = 'user'
+    __versioned__ = {}
 
-    user_id = Column(String, primary_key=True, default=lambda: str(uuid4()))
+    user_id = Column(IdType(), primary_key=True, default=new_id)
     role = Column(String, CheckConstraint("role IN ('admin','tutor','student','parent','guest')"))
     username = Column(String,nullable=True)
     first_name = Column(String)
@@ -15,6 +18,8 @@ class User(Base):
     email = Column(String)
     phone_number = Column(String,nullable=True)
     DOB = Column(Date,nullable=True)
+    # the other side of TutorReview.user: mapper configuration fails without it
+    tutor_review = relationship("TutorReview", back_populates="user")
     
 
 
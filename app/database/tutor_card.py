@@ -0,0 +1,267 @@
+"""
+Tutor cards: the denormalized read model of the tutor listings
+
+One narrow row per active tutor profile in the tutor_card table with what a listing shows:
+the headline columns of the profile, the subjects and levels taught and the lowest price,
+the days with an availability, and the number of reviews and mean rating. A listing page
+reads a page of cards instead of joining (or lazy loading) four tables per tutor.
+
+Every flush writing a profile or one of its subjects, availabilities or reviews rebuilds the
+cards of those profiles from their rows in the same transaction, so a card is exactly as
+committed as the rows it is built from (savepoints and rollbacks included). Writes that
+bypass the ORM are not seen: rebuild the cards, or check them for drift (cards that differ
+from their rows), with
+
+    python -m app.database.tutor_card --rebuild
+    python -m app.database.tutor_card --check [--repair]
+"""
+
+import argparse
+from datetime import datetime
+from itertools import chain
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import JSON, Column, DateTime, Float, Integer, String, Table, event, inspect, select
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import get_history
+
+from app.database.crud.base import MAX_IN_PARAMETERS
+from app.database.database import Base, engine
+from app.database.schemas.tutor_schema import TutorAvailability, TutorProfile, TutorReview, TutorSubject
+from app.database.types import IdType
+from app.utils import metrics
+from app.utils.availability.minutes_of_week import DAYS, MINUTES_PER_DAY
+from app.utils.ranking.tutor_ranking import parse_number
+
+
+# columns of the profile copied to its card
+PROFILE_COLUMNS = ("display_name", "tutor_title", "profile_photo", "short_bio", "average_response_time", "experience_years")
+
+tutor_card = Table(
+    "tutor_card",
+    Base.metadata,
+    Column("tutor_profile_id", IdType(), primary_key=True),
+    *[Column(name, String) for name in PROFILE_COLUMNS],
+    # [{"subject": ..., "level": ...}] sorted
+    Column("subjects", JSON, nullable=False),
+    Column("min_price", Float),
+    # days of the week with an availability, in week order
+    Column("days", JSON, nullable=False),
+    Column("review_count", Integer, nullable=False),
+    # mean of the numeric ratings, None without one
+    Column("rating", Float),
+    Column("refreshed_on", DateTime, nullable=False),
+)
+
+# columns compared by the consistency check
+CARD_COLUMNS = [column.name for column in tutor_card.columns if column.name != "refreshed_on"]
+
+# the tables a card is built from, by their profile foreign key
+SOURCES = {
+    TutorProfile.__tablename__: TutorProfile.tutor_profile_id,
+    TutorSubject.__tablename__: TutorSubject.tutor_profile_id,
+    TutorAvailability.__tablename__: TutorAvailability.tutor_profile_id,
+    TutorReview.__tablename__: TutorReview.tutor_profile_id,
+}
+
+drift = metrics.Counter("tutor_card_drift_total", "Tutor cards found out of date by the consistency check (missing, orphaned, stale)")
+
+
+def _chunks(profile_ids: Optional[Iterable[Any]]):
+    """the profile ids in chunks bound in IN (...), a single None for every profile"""
+    if profile_ids is None:
+        yield None
+        return
+    ids = list(profile_ids)
+    for start in range(0, len(ids), MAX_IN_PARAMETERS):
+        yield ids[start : start + MAX_IN_PARAMETERS]
+
+
+def build_cards(connection, profile_ids: Optional[Iterable[Any]] = None) -> Dict[Any, Dict[str, Any]]:
+    """
+    Build the cards of the active profiles from their rows.
+
+    Args:
+        connection: A connection (or session) to read the rows with.
+        profile_ids (Iterable, optional): The profiles to build the cards of. Defaults to every profile.
+
+    Returns:
+        Dict: profile id -> card (the tutor_card columns but refreshed_on).
+    """
+    cards = {}
+    for chunk in _chunks(profile_ids):
+
+        def rows(model, *columns):
+            query = select(model.tutor_profile_id, *columns).where(model.is_active)
+            if chunk is not None:
+                query = query.where(model.tutor_profile_id.in_(chunk))
+            return connection.execute(query)
+
+        for row in rows(TutorProfile, *[getattr(TutorProfile, name) for name in PROFILE_COLUMNS]):
+            cards[row.tutor_profile_id] = {
+                **row._mapping,
+                "subjects": set(),
+                "min_price": None,
+                "days": set(),
+                "review_count": 0,
+                "rating": [],
+            }
+        for profile_id, subject, level, price in rows(TutorSubject, TutorSubject.subject, TutorSubject.level, TutorSubject.price):
+            card = cards.get(profile_id)
+            if card is None:
+                continue
+            card["subjects"].add((subject or "", level or ""))
+            amount = parse_number(price)
+            if amount is not None and (card["min_price"] is None or amount < card["min_price"]):
+                card["min_price"] = amount
+        for profile_id, start_minute in rows(TutorAvailability, TutorAvailability.start_minute):
+            card = cards.get(profile_id)
+            if card is not None and start_minute is not None:
+                card["days"].add(start_minute // MINUTES_PER_DAY % len(DAYS))
+        for profile_id, rating in rows(TutorReview, TutorReview.rating):
+            card = cards.get(profile_id)
+            if card is None:
+                continue
+            card["review_count"] += 1
+            value = parse_number(rating)
+            if value is not None:
+                card["rating"].append(min(max(value, 1.0), 5.0))
+
+    for card in cards.values():
+        card["subjects"] = [{"subject": subject, "level": level} for subject, level in sorted(card["subjects"])]
+        card["days"] = [DAYS[day] for day in sorted(card["days"])]
+        ratings = card["rating"]
+        card["rating"] = round(sum(ratings) / len(ratings), 2) if ratings else None
+    return cards
+
+
+def refresh(connection, profile_ids: Optional[Iterable[Any]] = None) -> int:
+    """
+    Rebuild the cards of profiles (of every profile by default) in the transaction of
+    connection: the cards of inactive or deleted profiles are removed.
+
+    Returns:
+        int: The number of cards written.
+    """
+    if profile_ids is not None:
+        profile_ids = list(profile_ids)
+    cards = build_cards(connection, profile_ids)
+    for chunk in _chunks(profile_ids):
+        delete = tutor_card.delete()
+        if chunk is not None:
+            delete = delete.where(tutor_card.c.tutor_profile_id.in_(chunk))
+        connection.execute(delete)
+    if cards:
+        refreshed_on = datetime.utcnow()
+        connection.execute(tutor_card.insert(), [{**card, "refreshed_on": refreshed_on} for card in cards.values()])
+    return len(cards)
+
+
+@event.listens_for(Session, "after_flush")
+def _refresh_changed_cards(session: Session, flush_context):
+    profile_ids = set()
+    # source rows whose profile was not loaded: table -> primary keys
+    unknown: Dict[str, List[Any]] = {}
+    everything = False
+    for obj in chain(session.new, session.dirty, session.deleted):
+        state = inspect(obj)
+        tablename = state.mapper.persist_selectable.name
+        if tablename not in SOURCES:
+            continue
+        if tablename == TutorProfile.__tablename__:
+            profile_ids.add(state.mapper.primary_key_from_instance(obj)[0])
+            continue
+        added, unchanged, deleted = get_history(obj, "tutor_profile_id", passive=True)
+        if not (added or unchanged or deleted):
+            unknown.setdefault(tablename, []).append(state.mapper.primary_key_from_instance(obj)[0])
+        elif added and not (unchanged or deleted) and state.has_identity:
+            # moved to another profile without the previous one ever being loaded
+            everything = True
+        profile_ids.update(chain(added, unchanged, deleted))
+    if not profile_ids and not unknown:
+        return
+    connection = session.connection()
+    for tablename, ids in unknown.items():
+        model = SOURCES[tablename].class_
+        key = model.__mapper__.primary_key[0]
+        found = 0
+        for chunk in _chunks(ids):
+            for (profile_id,) in connection.execute(select(model.tutor_profile_id).where(key.in_(chunk))):
+                profile_ids.add(profile_id)
+                found += 1
+        # deleted rows are gone: their profile is unknown
+        everything = everything or found < len(ids)
+    profile_ids.discard(None)
+    refresh(connection, None if everything else profile_ids)
+
+
+def rebuild() -> int:
+    """Rebuild every card (in one transaction), returns the number of cards"""
+    with engine.begin() as connection:
+        return refresh(connection)
+
+
+def ensure_cards():
+    """Build the cards of an existing database (no-op once there are cards or no profiles)"""
+    with engine.begin() as connection:
+        if connection.execute(select(tutor_card.c.tutor_profile_id).limit(1)).first() is not None:
+            return
+        if connection.execute(select(TutorProfile.tutor_profile_id).limit(1)).first() is None:
+            return
+        refresh(connection)
+
+
+def check(repair: bool = False) -> Dict[str, Any]:
+    """
+    Compare the cards with the cards built from their rows.
+
+    Args:
+        repair (bool, optional): Rebuild the cards found out of date. Defaults to False.
+
+    Returns:
+        Dict: The number of cards checked and the profile ids of the missing cards (active
+            profiles without a card), orphaned cards (without an active profile) and stale
+            cards (differing from their rows).
+    """
+    with engine.begin() as connection:
+        expected = build_cards(connection)
+        stored = {
+            row.tutor_profile_id: {name: row._mapping[name] for name in CARD_COLUMNS}
+            for row in connection.execute(select(tutor_card))
+        }
+        report = {
+            "checked": len(stored),
+            "missing": [id for id in expected if id not in stored],
+            "orphaned": [id for id in stored if id not in expected],
+            "stale": [id for id, card in stored.items() if id in expected and card != expected[id]],
+        }
+        for kind in ("missing", "orphaned", "stale"):
+            if report[kind]:
+                drift.inc(len(report[kind]), kind=kind)
+        if repair:
+            out_of_date = report["missing"] + report["orphaned"] + report["stale"]
+            report["repaired"] = refresh(connection, out_of_date) if out_of_date else 0
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild or check the tutor cards")
+    action = parser.add_mutually_exclusive_group(required=True)
+    action.add_argument("--rebuild", action="store_true", help="rebuild every card")
+    action.add_argument("--check", action="store_true", help="report the cards differing from their rows")
+    parser.add_argument("--repair", action="store_true", help="with --check, rebuild the cards found out of date")
+    args = parser.parse_args()
+
+    if args.rebuild:
+        print(f"{rebuild()} tutor cards rebuilt")
+        return
+    report = check(args.repair)
+    print(f"{report['checked']} tutor cards checked")
+    for kind in ("missing", "orphaned", "stale"):
+        print(f"{kind}: {len(report[kind])} {' '.join(map(str, report[kind][:20]))}")
+    if args.repair:
+        print(f"{report['repaired']} tutor cards repaired")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Column types of the ids
+
+With ID_STORAGE = "blob" the UUID ids are stored as 16 byte BLOBs instead of 36 character
+text (less than half the size in the tables and in every index of an id column). The
+conversion happens at the column: the ORM, the pydantic models and the API only ever see the
+canonical text, and the ids bound in queries (==, IN, joins on bound values) are converted
+the same way, so nothing above the schemas changes.
+
+Ids that are not canonical UUIDs (older ids, test fixtures) are stored as they are, as text:
+SQLite stores any value in any column, so both kinds coexist in a column during a migration
+(see app.database.convert_ids).
+"""
+
+from functools import reduce
+from uuid import UUID
+
+from sqlalchemy import String, and_, case, func
+from sqlalchemy.types import TypeDecorator, UserDefinedType
+
+from app import config
+
+
+class _Blob(UserDefinedType):
+    """A BLOB column without the bytes coercion of LargeBinary (text ids pass through)"""
+
+    cache_ok = True
+
+    def get_col_spec(self, **kw):
+        return "BLOB"
+
+
+def compact_id(value: str):
+    """The 16 bytes of a canonical UUID text, other ids unchanged"""
+    if len(value) != 36 or value[8] != "-" or value[13] != "-" or value[18] != "-" or value[23] != "-":
+        return value
+    hexed = value.replace("-", "")
+    try:
+        raw = bytes.fromhex(hexed)
+    except ValueError:
+        return value
+    # only the canonical (lowercase) text converts back to the same string
+    return raw if len(raw) == 16 and raw.hex() == hexed else value
+
+
+class CompactUUID(TypeDecorator):
+    """A UUID id stored as 16 bytes, text at the python side"""
+
+    impl = _Blob
+    cache_ok = True
+
+    @property
+    def python_type(self):
+        return str
+
+    def process_bind_param(self, value, dialect):
+        if isinstance(value, UUID):
+            return value.bytes
+        if isinstance(value, str):
+            return compact_id(value)
+        return value
+
+    def process_result_value(self, value, dialect):
+        if isinstance(value, bytes) and len(value) == 16:
+            hexed = value.hex()
+            return f"{hexed[:8]}-{hexed[8:12]}-{hexed[12:16]}-{hexed[16:20]}-{hexed[20:]}"
+        return value
+
+
+def IdType():
+    """The column type of the primary and foreign keys (see ID_STORAGE)"""
+    return CompactUUID() if config.ID_STORAGE == "blob" else String()
+
+
+def id_text(column):
+    """A SQL expression of an id column as its text (for SQL building ids into strings)"""
+    if not isinstance(column.type, CompactUUID):
+        return column
+    hexed = func.lower(func.hex(column))
+    parts = [func.substr(hexed, start, length) for start, length in ((1, 8), (9, 4), (13, 4), (17, 4), (21, 12))]
+    canonical = reduce(lambda text, part: text.op("||")("-").op("||")(part), parts[1:], parts[0])
+    return case(
+        (and_(func.typeof(column) == "blob", func.length(column) == 16), canonical),
+        else_=column,
+    )
+
+
+def id_text_sql(column, name: str) -> str:
+    """id_text as raw SQL, for the column quoted as name in a text() statement"""
+    if not isinstance(column.type, CompactUUID):
+        return name
+    hexed = f"lower(hex({name}))"
+    canonical = " || '-' || ".join(
+        f"substr({hexed}, {start}, {length})" for start, length in ((1, 8), (9, 4), (13, 4), (17, 4), (21, 12))
+    )
+    return f"CASE WHEN typeof({name}) = 'blob' AND length({name}) = 16 THEN {canonical} ELSE {name} END"
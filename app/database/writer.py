@@ -0,0 +1,223 @@
+"""
+Single writer with group commit
+
+SQLite only has one write lock and every commit pays for its own fsync, so concurrent
+requests that each commit their own transaction are limited by the fsync rate. When
+WRITER_ENABLED is set, the services hand their writes to a dedicated writer thread instead:
+
+- requests submit write operations (callables taking a session) to a bounded queue and
+  wait on a future for the result; a full queue blocks the submitter for up to
+  WRITER_SUBMIT_TIMEOUT seconds and then raises WriterBusy (backpressure).
+- the writer takes the operations queued within WRITER_BATCH_WINDOW seconds (up to
+  WRITER_MAX_BATCH) and runs each one in its own savepoint of a single transaction, so a
+  failing operation is rolled back alone and only fails its own future. pysqlite does not
+  begin a transaction before a SAVEPOINT (the RELEASE would commit each operation on its
+  own): the batch transaction is begun explicitly, with BEGIN IMMEDIATE. The version
+  history (continuum) records a transaction per operation, as when it committed alone, and
+  it is rolled back with the operation.
+- the transaction is committed once for the whole batch and the futures are resolved.
+
+The CRUD methods commit their own work, so operations run with a GroupCommitSession whose
+commit() only flushes: the data is written to the batch transaction and the real commit
+is left to the writer.
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, List, Optional, Tuple
+
+from sqlalchemy import inspect
+from sqlalchemy.orm import Session
+from sqlalchemy_continuum import versioning_manager
+
+from app import config
+from app.database.database import engine
+
+
+class WriterBusy(Exception):
+    """The write queue stayed full for longer than the submit timeout"""
+
+
+class GroupCommitSession(Session):
+    """Session of a batch of writes: commit() flushes and the writer commits the batch"""
+
+    def commit(self):
+        self.flush()
+
+    def begin_batch(self):
+        # take the write lock first, and keep the savepoints of the operations in one transaction
+        self.connection().exec_driver_sql("BEGIN IMMEDIATE")
+
+    def commit_batch(self):
+        super().commit()
+
+
+Operation = Tuple[Callable[[Session], Any], Future]
+
+
+def _end_versioning(session: Session, commit: bool):
+    """
+    close continuum's unit of work of an operation before its savepoint ends: it writes the
+    versions in a savepoint of its own, and its transaction row would otherwise be shared
+    with the next operations of the batch (and lost with a rolled back operation)
+    """
+    connection = session.connection()
+    unit_of_work = versioning_manager.units_of_work.get(connection)
+    if unit_of_work is None:
+        return
+    if unit_of_work.version_session is not None:
+        if commit:
+            unit_of_work.version_session.commit()
+        else:
+            unit_of_work.version_session.close()
+    versioning_manager.clear_connection(connection)
+
+
+def _instances(result) -> List:
+    """The ORM instances in the result of an operation"""
+    items = result if isinstance(result, (list, tuple)) else [result]
+    return [item for item in items if hasattr(item, "_sa_instance_state")]
+
+
+class Writer:
+    """
+    Dedicated writer thread committing the submitted operations in groups.
+
+    Args:
+        queue_size (int, optional): Operations that can wait for the writer before submit blocks.
+        batch_window (float, optional): Seconds to wait for more operations after the first one.
+        max_batch (int, optional): Maximum operations per transaction.
+        submit_timeout (float, optional): Seconds submit waits for room in a full queue.
+    """
+
+    def __init__(
+        self,
+        queue_size: int = None,
+        batch_window: float = None,
+        max_batch: int = None,
+        submit_timeout: float = None,
+        bind=None,
+    ):
+        self.queue_size = queue_size or config.WRITER_QUEUE_SIZE
+        self.batch_window = config.WRITER_BATCH_WINDOW if batch_window is None else batch_window
+        self.max_batch = max_batch or config.WRITER_MAX_BATCH
+        self.submit_timeout = (
+            config.WRITER_SUBMIT_TIMEOUT if submit_timeout is None else submit_timeout
+        )
+        self.bind = bind or engine
+        self._reset()
+
+    def _reset(self):
+        self._queue: "queue.Queue[Optional[Operation]]" = queue.Queue(self.queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.operations = 0
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout: float = None):
+        """Commit the queued operations and stop the writer thread"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None and thread.is_alive():
+            self._queue.put(None)
+            thread.join(timeout)
+
+    def submit(self, operation: Callable[[Session], Any]) -> Future:
+        """
+        Queue a write operation. The operation is called with the batch session and can
+        commit as usual; its return value (or exception) is set on the returned future once
+        the batch is committed. ORM instances in the result are detached with their columns loaded.
+        """
+        self.start()
+        future = Future()
+        try:
+            self._queue.put((operation, future), timeout=self.submit_timeout)
+        except queue.Full:
+            raise WriterBusy(f"write queue full ({self.queue_size} operations waiting)")
+        return future
+
+    def execute(self, operation: Callable[[Session], Any]):
+        """Submit an operation and wait for its result"""
+        return self.submit(operation).result()
+
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def _next_batch(self) -> Tuple[List[Operation], bool]:
+        """Block for an operation then collect the ones arriving within the batch window"""
+        first = self._queue.get()
+        if first is None:
+            return [], True
+        batch = [first]
+        deadline = time.monotonic() + self.batch_window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                operation = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if operation is None:
+                return batch, True
+            batch.append(operation)
+        return batch, False
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch, stopping = self._next_batch()
+            if batch:
+                self._commit(batch)
+
+    def _commit(self, batch: List[Operation]):
+        session = GroupCommitSession(bind=self.bind, autoflush=False, expire_on_commit=False)
+        done = []
+        try:
+            session.begin_batch()
+            for operation, future in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                savepoint = session.begin_nested()
+                try:
+                    result = operation(session)
+                    session.flush()
+                except Exception as e:
+                    _end_versioning(session, commit=False)
+                    savepoint.rollback()
+                    future.set_exception(e)
+                    continue
+                _end_versioning(session, commit=True)
+                savepoint.commit()
+                done.append((future, result))
+            session.commit_batch()
+            # a rolled back savepoint expires every instance of the session: reload them
+            for _, result in done:
+                for instance in _instances(result):
+                    state = inspect(instance)
+                    if state.persistent and state.expired_attributes:
+                        session.refresh(instance)
+        except Exception as e:
+            session.rollback()
+            for future, _ in done:
+                future.set_exception(e)
+            return
+        finally:
+            session.close()
+        self.batches += 1
+        self.operations += len(done)
+        for future, result in done:
+            future.set_result(result)
+
+
+writer = Writer()
+
+# the writer thread does not survive a fork: the child starts its own on first submit
+os.register_at_fork(after_in_child=writer._reset)
@@ -4,9 +4,12 @@ Common dependencies
 
 from sqlalchemy.orm import Session
 from app.database.database import SessionLocal
+from app import config
+from app.utils.messages.error_message_constants import ErrorMessageConstants
 from fastapi.routing import APIRoute
 import copy
-from fastapi import APIRouter as FastAPIRouter
+import hmac
+from fastapi import APIRouter as FastAPIRouter, Header, HTTPException
 
 
 
@@ -21,10 +24,28 @@ class APIRouter(FastAPIRouter):
         super().add_api_route(path, route, include_in_schema=include, **kwargs)
         
 
+# callables run with the request session just before it is closed
+session_close_hooks = []
+
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
+        for hook in session_close_hooks:
+            hook(db)
         db.close()
-        
\ No newline at end of file
+
+
+def is_admin_token(token: str) -> bool:
+    """Check a token against the configured admin token"""
+    if not config.ADMIN_TOKEN or not token:
+        return False
+    return hmac.compare_digest(token, config.ADMIN_TOKEN)
+
+
+def require_admin(x_admin_token: str = Header(None)):
+    """Only allow requests carrying the configured admin token"""
+    if not is_admin_token(x_admin_token):
+        raise HTTPException(status_code=403, detail=ErrorMessageConstants.UNAUTHORISED_ACCESS)
@@ -2,13 +2,31 @@
 main.py
 """
 
-from fastapi import FastAPI
+import warnings
+
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from app.routers import user_router
 from app.routers import message_router
 from app.routers import tutor_router
+from app.routers import admin_router
+from app.routers import media_router
+from app.middleware.profiling import ProfilingMiddleware
+from app.middleware.memory import MemoryProfilingMiddleware
+from app.middleware.admission import AdmissionMiddleware
+from app.middleware.compression import CompressionMiddleware
+from app import config
 from app.dependencies import get_db
+from app.database import backup
+from app.database.counts import ensure_counters
 from app.database.database import Base, engine
+from app.database.tutor_card import ensure_cards
+from app.database.writer import WriterBusy, writer
+from app.utils import media
+from app.utils.cache import cache
+from app.utils.jobs import job_queue, runner
+from app.utils.messages.error_message_constants import ErrorMessageConstants
 
 
 app = FastAPI()
@@ -22,6 +40,10 @@ app.include_router(tutor_router.router3, tags=["Tutor Qualification"], prefix="/
 app.include_router(tutor_router.router4, tags=["Tutor Subject"], prefix="/tutor")
 app.include_router(tutor_router.router5, tags=["Tutor Review"], prefix="/tutor")
 
+app.include_router(media_router.router, tags=["Media"], prefix=media_router.PREFIX)
+
+app.include_router(admin_router.router, tags=["Admin"], prefix="/admin")
+
 
 origins = [
     "http://localhost",
@@ -33,6 +55,68 @@ app.add_middleware(
     allow_origins = origins
 )
 
+# the profiling middleware is only installed when enabled so it costs nothing otherwise
+if config.PROFILING_ENABLED:
+    app.add_middleware(ProfilingMiddleware)
+if config.MEMORY_PROFILING_ENABLED:
+    app.add_middleware(MemoryProfilingMiddleware)
+if config.COMPRESSION_ENABLED:
+    app.add_middleware(CompressionMiddleware)
+# added last so it runs first and rejects requests before any other work
+if config.ADMISSION_ENABLED:
+    app.add_middleware(AdmissionMiddleware)
+
+
+@app.exception_handler(WriterBusy)
+def writer_busy_handler(request: Request, exc: WriterBusy):
+    # the write queue is full: ask the client to back off instead of queueing more work
+    return JSONResponse(
+        status_code=503,
+        content={"detail": ErrorMessageConstants.SERVER_BUSY},
+        headers={"Retry-After": "1"},
+    )
+
+
+@app.on_event("startup")
+def check_media():
+    # thumbnails configured without Pillow: refuse to start rather than silently skip them
+    media.check()
+
+
+@app.on_event("startup")
+def backfill_counters():
+    # backfill the row counters added since the last start (no-op once they are maintained)
+    ensure_counters()
+
+
+@app.on_event("startup")
+def backfill_tutor_cards():
+    # build the tutor cards of a database created before them (no-op once they are maintained)
+    ensure_cards()
+
+
+@app.on_event("startup")
+def start_job_workers():
+    # only when configured: otherwise the jobs run in python -m app.utils.jobs
+    if config.JOBS_WORKERS > 0:
+        job_queue.purge(config.JOBS_RETENTION_DAYS * 86400)
+        runner.start()
+    elif not cache.shared:
+        warnings.warn(
+            "The jobs run in python -m app.utils.jobs but the cache is local to this process: "
+            "set SHARED_CACHE_DIR (python -m app.serve does) so that their writes invalidate it"
+        )
+    # scheduled snapshots are run by whichever job worker claims them
+    backup.schedule()
+
+
+@app.on_event("shutdown")
+def stop_background_workers():
+    # commit the writes still queued and let the running jobs finish before the worker exits
+    writer.stop()
+    runner.stop()
+    media.shutdown()
+
 
 Base.metadata.create_all(engine)
 
@@ -0,0 +1,252 @@
+"""
+Admission control
+
+Keeps bursts from saturating the threadpool and SQLite by rejecting work early, before it
+reaches a worker thread:
+
+- AdmissionMiddleware (whole app): a token bucket per client (the RATE_LIMIT_KEY_HEADER set
+  by the auth proxy, or the client address) answered with 429, and load shedding answered
+  with 503 once more than ADMISSION_MAX_QUEUE requests are waiting for a worker thread.
+- AdmissionPolicy (per GenericCRUDRouter): a token bucket per client for the routes of one
+  router, and a concurrency limit of each of its routes with a short bounded queue in front
+  of the limit (so a slow route does not take the slots of the others).
+
+Rejections carry a Retry-After header. Everything runs on the event loop without locks,
+so the cost per admitted request is a dict lookup and a few arithmetic operations.
+"""
+
+import asyncio
+import math
+import time
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional
+
+from anyio.to_thread import current_default_thread_limiter
+from fastapi.routing import APIRoute
+from starlette.responses import JSONResponse
+
+from app import config
+from app.utils import metrics
+from app.utils.messages.error_message_constants import ErrorMessageConstants
+
+
+rejected_requests = metrics.Counter("admission_rejected_total", "Requests rejected by admission control")
+
+
+class TokenBuckets:
+    """
+    A token bucket per key: `rate` tokens per second up to `burst`.
+    Idle (full) buckets are dropped once there are more than max_keys of them.
+    """
+
+    def __init__(self, rate: float, burst: float, max_keys: int = 100_000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets: Dict[str, List[float]] = {}
+
+    def take(self, key: str) -> float:
+        """Take a token: 0 if granted, else the seconds until one is available"""
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.max_keys:
+                self._prune(now)
+            self._buckets[key] = [self.burst - 1, now]
+            return 0
+        tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if tokens >= 1:
+            bucket[0] = tokens - 1
+            return 0
+        bucket[0] = tokens
+        return (1 - tokens) / self.rate
+
+    def _prune(self, now: float):
+        full = self.burst / self.rate
+        for key in [key for key, (_, last) in self._buckets.items() if now - last >= full]:
+            del self._buckets[key]
+
+
+class ConcurrencyLimit:
+    """
+    At most `limit` requests at a time; up to `max_queue` more wait (at most `timeout`
+    seconds) for a slot, the others are rejected immediately.
+    """
+
+    def __init__(self, limit: int, max_queue: int = 0, timeout: float = 1):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    async def acquire(self) -> bool:
+        if self.active < self.limit:
+            self.active += 1
+            return True
+        if len(self._waiters) >= self.max_queue:
+            return False
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        await asyncio.wait((waiter,), timeout=self.timeout)
+        if waiter.done() and not waiter.cancelled():
+            # the slot was handed over by release()
+            return True
+        waiter.cancel()
+        self._waiters.remove(waiter)
+        return False
+
+    def release(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+
+_KEY_HEADER = config.RATE_LIMIT_KEY_HEADER.lower().encode()
+
+
+def client_key(scope) -> str:
+    """The user the request is rate limited as: the key header, or the client address"""
+    for key, value in scope["headers"]:
+        if key == _KEY_HEADER:
+            return value.decode("latin-1")
+    client = scope.get("client")
+    return client[0] if client else "-"
+
+
+def rejection(status_code: int, retry_after: float, reason: str) -> JSONResponse:
+    rejected_requests.inc(reason=reason)
+    detail = ErrorMessageConstants.RATE_LIMITED if status_code == 429 else ErrorMessageConstants.SERVER_BUSY
+    return JSONResponse(
+        status_code=status_code,
+        content={"detail": detail},
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+
+class AdmissionPolicy:
+    """
+    Admission limits of the routes of a router.
+
+    Args:
+        rate (float, optional): Requests per second per client. Defaults to None (no rate limit).
+        burst (float, optional): Bucket size. Defaults to 2 * rate.
+        max_concurrency (int, optional): Requests of each route running at once. Defaults to None.
+        max_queue (int, optional): Requests waiting for a concurrency slot before shedding. Defaults to 0.
+        queue_timeout (float, optional): Seconds a request waits for a slot. Defaults to 1.
+    """
+
+    def __init__(
+        self,
+        rate: float = None,
+        burst: float = None,
+        max_concurrency: int = None,
+        max_queue: int = 0,
+        queue_timeout: float = 1,
+    ):
+        self.buckets = TokenBuckets(rate, burst or 2 * rate) if rate else None
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+
+    def concurrency_limit(self) -> Optional[ConcurrencyLimit]:
+        """The concurrency limit of a route (None if unlimited)"""
+        if not self.max_concurrency:
+            return None
+        return ConcurrencyLimit(self.max_concurrency, self.max_queue, self.queue_timeout)
+
+    def route_class(self) -> type:
+        """An APIRoute class applying this policy (kept by include_router for the included routes)"""
+        return type("AdmissionRoute", (AdmissionRoute,), {"policy": self})
+
+
+class AdmissionRoute(APIRoute):
+    policy: Optional[AdmissionPolicy] = None
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+        policy = self.policy
+        if policy is None:
+            return handler
+        concurrency = policy.concurrency_limit()
+
+        async def admitted_handler(request):
+            if policy.buckets is not None:
+                retry_after = policy.buckets.take(client_key(request.scope))
+                if retry_after:
+                    return rejection(429, retry_after, "route_rate")
+            if concurrency is None:
+                return await handler(request)
+            if not await concurrency.acquire():
+                return rejection(503, config.ADMISSION_RETRY_AFTER, "route_concurrency")
+            try:
+                return await handler(request)
+            finally:
+                concurrency.release()
+
+        return admitted_handler
+
+
+def default_policy() -> Optional[AdmissionPolicy]:
+    """The policy of routers created without one (None when admission control is disabled)"""
+    if not config.ADMISSION_ENABLED or not config.ROUTE_MAX_CONCURRENCY:
+        return None
+    return AdmissionPolicy(
+        max_concurrency=config.ROUTE_MAX_CONCURRENCY, max_queue=config.ROUTE_MAX_QUEUE
+    )
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware: per client rate limit and load shedding for the whole app.
+
+    Args:
+        rate (float, optional): Requests per second per client. Defaults to RATE_LIMIT_PER_SECOND.
+        burst (float, optional): Bucket size. Defaults to RATE_LIMIT_BURST.
+        max_queue (int, optional): Requests allowed to wait for a worker thread. Defaults to ADMISSION_MAX_QUEUE.
+        exempt (Iterable[str], optional): Path prefixes never limited. Defaults to ("/admin",).
+    """
+
+    def __init__(
+        self,
+        app,
+        rate: float = None,
+        burst: float = None,
+        max_queue: int = None,
+        exempt: Iterable[str] = ("/admin",),
+    ):
+        self.app = app
+        rate = config.RATE_LIMIT_PER_SECOND if rate is None else rate
+        self.buckets = TokenBuckets(rate, burst or config.RATE_LIMIT_BURST) if rate else None
+        self.max_queue = config.ADMISSION_MAX_QUEUE if max_queue is None else max_queue
+        self.exempt = tuple(exempt)
+        self.in_flight = 0
+        self._threads = None
+
+    def _max_in_flight(self) -> int:
+        # requests beyond the threadpool size are queued waiting for a thread
+        if self._threads is None:
+            self._threads = int(current_default_thread_limiter().total_tokens)
+        return self._threads + self.max_queue
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(self.exempt):
+            await self.app(scope, receive, send)
+            return
+        if self.buckets is not None:
+            retry_after = self.buckets.take(client_key(scope))
+            if retry_after:
+                await rejection(429, retry_after, "rate")(scope, receive, send)
+                return
+        if self.in_flight >= self._max_in_flight():
+            await rejection(503, config.ADMISSION_RETRY_AFTER, "shed")(scope, receive, send)
+            return
+        self.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.in_flight -= 1
@@ -0,0 +1,268 @@
+"""
+Response compression
+
+Negotiates brotli (when the optional `brotli` package is installed) or gzip from the
+Accept-Encoding header and compresses complete responses of a compressible type larger
+than COMPRESSION_MIN_SIZE. Streaming responses are passed through untouched.
+
+Compressed payloads are kept in a byte bounded LRU keyed by the encoding and a hash of the
+body (hashing is far cheaper than compressing), so a hot payload is compressed once whatever
+URL serves it, and stale entries age out. Large payloads are compressed in the threadpool to
+keep the event loop responsive.
+
+Every coding of a response is a different representation, so a compressed response carries
+the ETag of the application with a coding suffix ("abc" -> "abc-br") and Accept-Encoding is
+added to its Vary header. The suffix is removed from the If-None-Match / If-Match headers of
+the requests before they reach the application (and put back on its 304 responses), so the
+application validators are unchanged.
+"""
+
+import gzip
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from anyio.to_thread import run_sync
+
+from app import config
+from app.utils import metrics
+
+try:
+    import brotli
+except ImportError:  # optional dependency: gzip only
+    brotli = None
+
+
+COMPRESSIBLE_TYPES = (
+    b"application/json",
+    b"text/",
+    b"application/javascript",
+    b"application/xml",
+    b"image/svg+xml",
+)
+# compress in a worker thread above this size
+THREADPOOL_MIN_SIZE = 64 * 1024
+# coding suffix of the entity tags of compressed responses
+_CODING_SUFFIX = re.compile(rb'-(br|gzip)"')
+
+compressed_responses = metrics.Counter("compressed_responses_total", "Compressed responses by encoding and cache result")
+
+
+def accepted_encodings(header: str) -> Dict[str, float]:
+    """Codings of an Accept-Encoding header with their q-values"""
+    encodings = {}
+    for part in header.split(","):
+        coding, _, parameters = part.strip().partition(";")
+        quality = 1.0
+        parameters = parameters.strip()
+        if parameters.startswith("q="):
+            try:
+                quality = float(parameters[2:])
+            except ValueError:
+                quality = 0.0
+        if coding:
+            encodings[coding.strip().lower()] = quality
+    return encodings
+
+
+def choose_encoding(header: str) -> Optional[str]:
+    """The preferred supported encoding of an Accept-Encoding header (br over gzip on ties)"""
+    encodings = accepted_encodings(header)
+    wildcard = encodings.get("*", 0.0)
+    best, best_quality = None, 0.0
+    for coding in (("br", "gzip") if brotli is not None else ("gzip",)):
+        quality = encodings.get(coding, wildcard)
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=config.BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=config.GZIP_LEVEL, mtime=0)
+
+
+def tag_etag(etag: bytes, encoding: str) -> bytes:
+    """The ETag of the representation of a response in a content coding"""
+    if not etag.endswith(b'"'):
+        return etag
+    return etag[:-1] + b"-" + encoding.encode() + b'"'
+
+
+def untag_conditions(headers) -> Tuple[list, Optional[str]]:
+    """
+    Remove the coding suffixes from the If-None-Match / If-Match headers, returns the headers
+    and the (last) coding that was removed
+    """
+    coding = None
+    untagged = []
+    for key, value in headers:
+        if key in (b"if-none-match", b"if-match"):
+            codings = _CODING_SUFFIX.findall(value)
+            if codings:
+                coding = codings[-1].decode()
+                value = _CODING_SUFFIX.sub(b'"', value)
+        untagged.append((key, value))
+    return untagged, coding
+
+
+def add_vary(headers: list, field: bytes) -> list:
+    """Append a field to the Vary header of a response (or add the header)"""
+    values = [value for key, value in headers if key == b"vary"]
+    fields = [item.strip() for value in values for item in value.split(b",") if item.strip()]
+    if any(item == b"*" or item.lower() == field.lower() for item in fields):
+        return headers
+    return [(key, value) for key, value in headers if key != b"vary"] + [
+        (b"vary", b", ".join(fields + [field]))
+    ]
+
+
+class CompressedCache:
+    """LRU of compressed payloads bounded by their total size"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: "OrderedDict[Tuple, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple) -> Optional[bytes]:
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is not None:
+                self._entries.move_to_end(key)
+            return payload
+
+    def set(self, key: Tuple, payload: bytes):
+        if len(payload) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self._entries[key] = payload
+            self.size += len(payload)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+compressed_cache = CompressedCache(config.COMPRESSION_CACHE_MAX_BYTES)
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware compressing responses.
+
+    Args:
+        min_size (int, optional): Smallest body compressed. Defaults to COMPRESSION_MIN_SIZE.
+        cache (CompressedCache, optional): Cache of compressed payloads. Defaults to compressed_cache.
+    """
+
+    def __init__(self, app, min_size: int = None, cache: CompressedCache = None):
+        self.app = app
+        self.min_size = config.COMPRESSION_MIN_SIZE if min_size is None else min_size
+        self.cache = cache if cache is not None else compressed_cache
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = None
+        for key, value in scope["headers"]:
+            if key == b"accept-encoding":
+                encoding = choose_encoding(value.decode("latin-1"))
+                break
+        coding = None
+        if any(key in (b"if-none-match", b"if-match") for key, _ in scope["headers"]):
+            headers, coding = untag_conditions(scope["headers"])
+            if coding is not None:
+                scope = {**scope, "headers": headers}
+        if encoding is None and coding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start, passthrough
+            if passthrough:
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                if message["status"] == 304 and coding is not None:
+                    # validated against the representation in that coding
+                    message = {**message, "headers": self._tagged(message["headers"], coding)}
+                    passthrough = True
+                    await send(message)
+                    return
+                if encoding is None:
+                    passthrough = True
+                    await send(message)
+                    return
+                start = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+            body = message.get("body", b"")
+            if message.get("more_body", False) or not self._compressible(start, body):
+                # streaming or not worth compressing: forward as is
+                passthrough = True
+                await send(start)
+                await send(message)
+                return
+            payload = await self._compressed(scope, start, body, encoding)
+            headers = [
+                (key, value)
+                for key, value in self._tagged(start["headers"], encoding)
+                if key != b"content-length"
+            ]
+            headers += [
+                (b"content-encoding", encoding.encode()),
+                (b"content-length", str(len(payload)).encode()),
+            ]
+            await send({**start, "headers": add_vary(headers, b"Accept-Encoding")})
+            await send({"type": "http.response.body", "body": payload})
+
+        await self.app(scope, receive, send_compressed)
+
+    @staticmethod
+    def _tagged(headers, encoding: str) -> list:
+        return [(key, tag_etag(value, encoding) if key == b"etag" else value) for key, value in headers]
+
+    def _compressible(self, start, body: bytes) -> bool:
+        if len(body) < self.min_size or start["status"] in (204, 304):
+            return False
+        content_type = b""
+        for key, value in start["headers"]:
+            if key == b"content-encoding":
+                return False
+            if key == b"content-type":
+                content_type = value
+        return content_type.startswith(COMPRESSIBLE_TYPES)
+
+    async def _compressed(self, scope, start, body: bytes, encoding: str) -> bytes:
+        # keyed by the content: an ETag is only a validator of the URL that sent it (and is
+        # not unique across URLs), hashing is still far cheaper than compressing
+        key = (encoding, hashlib.blake2b(body, digest_size=16).digest())
+        payload = self.cache.get(key)
+        if payload is not None:
+            compressed_responses.inc(encoding=encoding, cache="hit")
+            return payload
+        if len(body) >= THREADPOOL_MIN_SIZE:
+            payload = await run_sync(compress, body, encoding)
+        else:
+            payload = compress(body, encoding)
+        self.cache.set(key, payload)
+        compressed_responses.inc(encoding=encoding, cache="miss")
+        return payload
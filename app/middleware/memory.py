@@ -0,0 +1,287 @@
+"""
+Memory and allocation profiling
+
+- tracemalloc can be started/stopped from the admin router; snapshots are kept in memory
+  and can be listed, inspected and diffed with allocation sites grouped by our own modules
+  (each allocation is attributed to the innermost frame inside the `app` package).
+- For sampled requests (`X-Profile-Memory: <admin token>` or MEMORY_SAMPLE_RATE) the middleware
+  records the peak traced allocation of the request and the ORM objects held in the identity
+  map of the request session per mapped class.
+- `live_orm_objects` counts every live instance of a mapped class in the process.
+
+tracemalloc peaks are process wide, so the per-request peak is only exact when the
+sampled request is not running concurrently with other allocation-heavy requests.
+"""
+
+import gc
+import os
+import random
+import threading
+import time
+import tracemalloc
+from collections import Counter, deque
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from app import config
+from app.database.database import Base
+from app.dependencies import is_admin_token, session_close_hooks
+
+
+APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROJECT_ROOT = os.path.dirname(APP_ROOT)
+OTHER = "<other>"
+
+_active_record: ContextVar[Optional[Dict]] = ContextVar("active_memory_record", default=None)
+
+
+# tracing
+def start_tracing(frames: int = None) -> Dict:
+    """Start tracemalloc (no-op if it is already tracing)"""
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames or config.MEMORY_TRACE_FRAMES)
+    return tracing_status()
+
+
+def stop_tracing() -> Dict:
+    """Stop tracemalloc; stored snapshots are kept"""
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+    return tracing_status()
+
+
+def tracing_status() -> Dict:
+    tracing = tracemalloc.is_tracing()
+    current, peak = tracemalloc.get_traced_memory() if tracing else (0, 0)
+    return {
+        "tracing": tracing,
+        "frames": tracemalloc.get_traceback_limit() if tracing else 0,
+        "current_kb": round(current / 1024, 1),
+        "peak_kb": round(peak / 1024, 1),
+        "tracemalloc_overhead_kb": round(tracemalloc.get_tracemalloc_memory() / 1024, 1),
+        "snapshots": [snapshot["snapshot_id"] for snapshot in list_snapshots()],
+    }
+
+
+# snapshots
+class SnapshotStore:
+    """Keeps the last `max_snapshots` tracemalloc snapshots"""
+
+    def __init__(self, max_snapshots: int):
+        self.max_snapshots = max_snapshots
+        self._snapshots: Dict[int, Dict] = {}
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def take(self, label: str = None) -> Dict:
+        if not tracemalloc.is_tracing():
+            raise ValueError("tracemalloc is not tracing - start tracing first")
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            (tracemalloc.Filter(False, tracemalloc.__file__),)
+        )
+        with self._lock:
+            entry = {
+                "snapshot_id": self._next_id,
+                "label": label,
+                "taken_on": datetime.utcnow().isoformat(),
+                "snapshot": snapshot,
+            }
+            self._snapshots[self._next_id] = entry
+            self._next_id += 1
+            while len(self._snapshots) > self.max_snapshots:
+                del self._snapshots[min(self._snapshots)]
+        return _describe(entry)
+
+    def get(self, snapshot_id: int) -> Optional[tracemalloc.Snapshot]:
+        entry = self._snapshots.get(snapshot_id)
+        return entry["snapshot"] if entry else None
+
+    def list(self) -> List[Dict]:
+        return [_describe(entry) for entry in list(self._snapshots.values())]
+
+    def clear(self):
+        with self._lock:
+            self._snapshots.clear()
+
+
+def _describe(entry: Dict) -> Dict:
+    return {
+        "snapshot_id": entry["snapshot_id"],
+        "label": entry["label"],
+        "taken_on": entry["taken_on"],
+        "total_kb": round(sum(trace.size for trace in entry["snapshot"].traces) / 1024, 1),
+    }
+
+
+snapshots = SnapshotStore(config.MEMORY_MAX_SNAPSHOTS)
+
+
+def take_snapshot(label: str = None) -> Dict:
+    return snapshots.take(label)
+
+
+def list_snapshots() -> List[Dict]:
+    return snapshots.list()
+
+
+def _site(traceback: tracemalloc.Traceback, group_by: str) -> str:
+    """
+    Allocation site of a traceback: the innermost frame inside the app package,
+    as a module ("module") or module:line ("line"). Falls back to OTHER.
+    """
+    for frame in reversed(traceback):
+        if frame.filename.startswith(APP_ROOT):
+            module = os.path.relpath(frame.filename, PROJECT_ROOT)[: -len(".py")]
+            module = module.replace(os.sep, ".")
+            if group_by == "line":
+                return f"{module}:{frame.lineno}"
+            return module
+    return OTHER
+
+
+def _group(snapshot: tracemalloc.Snapshot, group_by: str) -> Dict[str, List[int]]:
+    """Size and count of the traced allocations grouped by allocation site"""
+    groups: Dict[str, List[int]] = {}
+    for statistic in snapshot.statistics("traceback"):
+        site = _site(statistic.traceback, group_by)
+        group = groups.setdefault(site, [0, 0])
+        group[0] += statistic.size
+        group[1] += statistic.count
+    return groups
+
+
+def top_allocations(snapshot_id: int, group_by: str = "module", limit: int = 20) -> List[Dict]:
+    """
+    Largest allocation sites of a snapshot.
+
+    Args:
+        snapshot_id (int): The snapshot to inspect.
+        group_by (str, optional): "module" or "line". Defaults to "module".
+        limit (int, optional): Number of sites to return. Defaults to 20.
+    """
+    snapshot = snapshots.get(snapshot_id)
+    if snapshot is None:
+        raise KeyError(snapshot_id)
+    groups = _group(snapshot, group_by)
+    top = sorted(groups.items(), key=lambda item: item[1][0], reverse=True)[:limit]
+    return [
+        {"site": site, "size_kb": round(size / 1024, 1), "count": count}
+        for site, (size, count) in top
+    ]
+
+
+def diff_snapshots(
+    snapshot_id: int, base_snapshot_id: int, group_by: str = "module", limit: int = 20
+) -> List[Dict]:
+    """
+    Allocation sites that grew (or shrank) the most between two snapshots.
+
+    Args:
+        snapshot_id (int): The newer snapshot.
+        base_snapshot_id (int): The snapshot to compare against.
+        group_by (str, optional): "module" or "line". Defaults to "module".
+        limit (int, optional): Number of sites to return. Defaults to 20.
+    """
+    snapshot = snapshots.get(snapshot_id)
+    base = snapshots.get(base_snapshot_id)
+    if snapshot is None or base is None:
+        raise KeyError(snapshot_id if snapshot is None else base_snapshot_id)
+    new_groups = _group(snapshot, group_by)
+    old_groups = _group(base, group_by)
+    diffs = []
+    for site in set(new_groups) | set(old_groups):
+        new_size, new_count = new_groups.get(site, (0, 0))
+        old_size, old_count = old_groups.get(site, (0, 0))
+        diffs.append(
+            {
+                "site": site,
+                "size_kb": round(new_size / 1024, 1),
+                "size_diff_kb": round((new_size - old_size) / 1024, 1),
+                "count": new_count,
+                "count_diff": new_count - old_count,
+            }
+        )
+    diffs.sort(key=lambda diff: abs(diff["size_diff_kb"]), reverse=True)
+    return diffs[:limit]
+
+
+# ORM objects
+def _mapped_classes() -> tuple:
+    return tuple(mapper.class_ for mapper in Base.registry.mappers)
+
+
+def identity_map_counts(db) -> Dict[str, int]:
+    """Number of objects per mapped class held in the identity map of a session"""
+    counts = Counter(type(obj).__name__ for obj in db.identity_map.values())
+    return dict(counts)
+
+
+def live_orm_objects() -> Dict[str, int]:
+    """Number of live instances per mapped class in the whole process (walks the gc heap)"""
+    classes = _mapped_classes()
+    counts = Counter(type(obj).__name__ for obj in gc.get_objects() if isinstance(obj, classes))
+    return dict(counts.most_common())
+
+
+# per request records
+request_records: deque = deque(maxlen=config.MEMORY_MAX_REQUEST_RECORDS)
+
+
+def _record_session(db):
+    """session close hook: store the identity map of the request session in the active record"""
+    record = _active_record.get()
+    if record is None:
+        return
+    for name, count in identity_map_counts(db).items():
+        record["orm_objects"][name] = record["orm_objects"].get(name, 0) + count
+
+
+session_close_hooks.append(_record_session)
+
+
+class MemoryProfilingMiddleware:
+    """
+    ASGI middleware recording the peak allocation and the ORM objects loaded by sampled requests.
+    Records are kept in `request_records` and served by the admin router.
+    """
+
+    def __init__(self, app, sample_rate: float = None):
+        self.app = app
+        self.sample_rate = config.MEMORY_SAMPLE_RATE if sample_rate is None else sample_rate
+        self._header = config.MEMORY_PROFILING_HEADER.lower().encode()
+
+    def _should_sample(self, scope) -> bool:
+        for key, value in scope["headers"]:
+            if key == self._header:
+                return is_admin_token(value.decode("latin-1"))
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._should_sample(scope):
+            await self.app(scope, receive, send)
+            return
+
+        record = {
+            "method": scope["method"],
+            "path": scope["path"],
+            "recorded_on": datetime.utcnow().isoformat(),
+            "peak_kb": None,
+            "duration_ms": None,
+            "orm_objects": {},
+        }
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            start, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+        token = _active_record.set(record)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _active_record.reset(token)
+            record["duration_ms"] = round((time.perf_counter() - started) * 1000, 3)
+            if tracing and tracemalloc.is_tracing():
+                _, peak = tracemalloc.get_traced_memory()
+                record["peak_kb"] = round(max(peak - start, 0) / 1024, 1)
+            request_records.append(record)
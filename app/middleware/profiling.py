@@ -0,0 +1,321 @@
+"""
+On-demand request profiling
+
+A request is profiled when it carries the profiling header with the admin token
+(or is picked by PROFILING_SAMPLE_RATE). The whole request runs under cProfile while a
+sampling thread records its stacks: routing, dependency resolution, the endpoint and the
+response serialization, on the event loop and in the threadpool (sync endpoints and
+dependencies and the serialization of their responses run there). When the response
+completes a pstats dump and a collapsed-stack file (flamegraph.pl / speedscope input)
+are written to PROFILING_OUTPUT_DIR and can be fetched from the admin router.
+
+The event loop is shared: the coroutines of other requests running while a profiled one
+awaits show up in its profile, and only one request at a time profiles the event loop
+(the others profile their threadpool work only, "event_loop": false in their metadata).
+
+When PROFILING_ENABLED is off the middleware is not installed, so there is no overhead at all.
+"""
+
+import cProfile
+import functools
+import json
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, List, Optional
+from uuid import uuid4
+
+import anyio.to_thread
+from starlette.concurrency import run_in_threadpool
+
+from app import config
+from app.dependencies import is_admin_token
+
+
+PROFILE_ID_PATTERN = re.compile(r"^[0-9]{8}T[0-9]{6}-[0-9a-f]{8}$")
+
+_active_profile: ContextVar[Optional["RequestProfile"]] = ContextVar(
+    "active_profile", default=None
+)
+
+
+# the project root the frame file names are made relative to
+_ROOT = os.getcwd() + os.sep
+
+
+def _frame_label(frame) -> str:
+    """Label a frame as 'function (module/file.py:line)' relative to the project root"""
+    code = frame.f_code
+    filename = code.co_filename
+    if filename.startswith(_ROOT):
+        filename = filename[len(_ROOT) :]
+    else:
+        filename = os.path.basename(filename)
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+class RequestProfile:
+    """
+    Profiling state for a single request.
+
+    Attributes:
+        profile_id (str): identifier used for the output files.
+        samples (Counter): collapsed stack -> number of samples.
+        profiles (List[cProfile.Profile]): one profiler per thread that ran profiled code.
+    """
+
+    def __init__(self, method: str, path: str):
+        self.profile_id = f"{datetime.utcnow():%Y%m%dT%H%M%S}-{uuid4().hex[:8]}"
+        self.method = method
+        self.path = path
+        self.started = time.perf_counter()
+        self.duration = None
+        self.event_loop = False
+        self.samples: Counter = Counter()
+        self.profiles: List[cProfile.Profile] = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def in_thread(self):
+        """Profile the code executed in the current thread for the duration of the block"""
+        profile = cProfile.Profile()
+        with self._lock:
+            self.profiles.append(profile)
+        sampler.register(threading.get_ident(), self)
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            sampler.unregister(threading.get_ident())
+
+    def wrap(self, func):
+        """func run under this profile in whichever thread calls it"""
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self.in_thread():
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    def add_sample(self, stack: str):
+        self.samples[stack] += 1
+
+    def finish(self):
+        self.duration = time.perf_counter() - self.started
+
+    def save(self, output_dir: str):
+        """Write the pstats dump, the collapsed stacks and a small metadata file"""
+        os.makedirs(output_dir, exist_ok=True)
+        base = os.path.join(output_dir, self.profile_id)
+
+        if self.profiles:
+            stats = pstats.Stats(self.profiles[0])
+            for profile in self.profiles[1:]:
+                stats.add(profile)
+            stats.dump_stats(base + ".pstats")
+
+        with open(base + ".folded", "w") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+        with open(base + ".json", "w") as f:
+            json.dump(self.metadata(), f)
+
+    def metadata(self) -> Dict:
+        return {
+            "profile_id": self.profile_id,
+            "method": self.method,
+            "path": self.path,
+            "duration_ms": round((self.duration or 0) * 1000, 3),
+            "samples": sum(self.samples.values()),
+            "event_loop": self.event_loop,
+        }
+
+
+class StackSampler:
+    """
+    Background thread sampling the stacks of the threads registered by profiled requests.
+
+    The thread only runs while at least one thread is registered.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._threads: Dict[int, RequestProfile] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def register(self, thread_id: int, profile: RequestProfile):
+        with self._lock:
+            self._threads[thread_id] = profile
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="request-profiler", daemon=True
+                )
+                self._thread.start()
+
+    def unregister(self, thread_id: int):
+        with self._lock:
+            self._threads.pop(thread_id, None)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._threads:
+                    self._thread = None
+                    return
+                threads = dict(self._threads)
+            frames = sys._current_frames()
+            for thread_id, profile in threads.items():
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                profile.add_sample(";".join(reversed(stack)))
+            time.sleep(self.interval)
+
+
+sampler = StackSampler(config.PROFILING_INTERVAL)
+
+
+_run_sync = None
+
+
+def _profile_threadpool():
+    """
+    Run the threadpool work of profiled requests under their profile: Starlette and FastAPI
+    hand sync endpoints, dependencies and serialization to anyio.to_thread.run_sync, from
+    the context of the request.
+    """
+    global _run_sync
+    if _run_sync is not None:
+        return
+    _run_sync = anyio.to_thread.run_sync
+
+    @functools.wraps(_run_sync)
+    async def run_sync(func, *args, **kwargs):
+        profile = _active_profile.get()
+        if profile is not None:
+            func = profile.wrap(func)
+        return await _run_sync(func, *args, **kwargs)
+
+    anyio.to_thread.run_sync = run_sync
+
+
+def _prune_results(output_dir: str, keep: int):
+    """Only keep the most recent `keep` profiles"""
+    try:
+        names = sorted(
+            name[: -len(".json")]
+            for name in os.listdir(output_dir)
+            if name.endswith(".json")
+        )
+    except FileNotFoundError:
+        return
+    for profile_id in names[:-keep] if keep > 0 else names:
+        for extension in (".json", ".pstats", ".folded"):
+            try:
+                os.remove(os.path.join(output_dir, profile_id + extension))
+            except FileNotFoundError:
+                pass
+
+
+def list_profiles(output_dir: str = None) -> List[Dict]:
+    """Metadata of the stored profiles, most recent first"""
+    output_dir = output_dir or config.PROFILING_OUTPUT_DIR
+    results = []
+    try:
+        names = sorted(os.listdir(output_dir), reverse=True)
+    except FileNotFoundError:
+        return results
+    for name in names:
+        if name.endswith(".json"):
+            with open(os.path.join(output_dir, name)) as f:
+                results.append(json.load(f))
+    return results
+
+
+def profile_path(profile_id: str, extension: str, output_dir: str = None) -> Optional[str]:
+    """Path of a stored profile file, or None if the id is invalid or the file does not exist"""
+    if not PROFILE_ID_PATTERN.match(profile_id):
+        return None
+    path = os.path.join(output_dir or config.PROFILING_OUTPUT_DIR, profile_id + extension)
+    if not os.path.isfile(path):
+        return None
+    return path
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware that starts a RequestProfile for requests carrying
+    `X-Profile: <admin token>` or picked by the sampling rate.
+    The profile id is returned in the `X-Profile-Id` response header.
+    """
+
+    def __init__(
+        self,
+        app,
+        sample_rate: float = None,
+        output_dir: str = None,
+        max_results: int = None,
+    ):
+        self.app = app
+        self.sample_rate = config.PROFILING_SAMPLE_RATE if sample_rate is None else sample_rate
+        self.output_dir = output_dir or config.PROFILING_OUTPUT_DIR
+        self.max_results = config.PROFILING_MAX_RESULTS if max_results is None else max_results
+        self._header = config.PROFILING_HEADER.lower().encode()
+        # a thread runs under one profiler at a time: the request profiling the event loop
+        self._loop_profile: Optional[RequestProfile] = None
+        _profile_threadpool()
+
+    def _should_profile(self, scope) -> bool:
+        for key, value in scope["headers"]:
+            if key == self._header:
+                return is_admin_token(value.decode("latin-1"))
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._should_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(scope["method"], scope["path"])
+        token = _active_profile.set(profile)
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [
+                    (b"x-profile-id", profile.profile_id.encode())
+                ]
+            await send(message)
+
+        try:
+            if self._loop_profile is None:
+                self._loop_profile = profile
+                profile.event_loop = True
+                try:
+                    with profile.in_thread():
+                        await self.app(scope, receive, send_with_profile_id)
+                finally:
+                    self._loop_profile = None
+            else:
+                await self.app(scope, receive, send_with_profile_id)
+        finally:
+            _active_profile.reset(token)
+            profile.finish()
+            await run_in_threadpool(profile.save, self.output_dir)
+            await run_in_threadpool(_prune_results, self.output_dir, self.max_results)
@@ -0,0 +1,17 @@
+from pydantic import BaseModel, Field, create_model
+from typing import List, Type
+
+from app import config
+
+
+class BatchGetRequest(BaseModel):
+    ids: List[str] = Field(..., min_length=1, max_length=config.BATCH_GET_MAX_IDS)
+
+
+def batch_read_model(output_model: Type[BaseModel]) -> Type[BaseModel]:
+    """Response of a batch get: the items found in request order and the missing ids"""
+    return create_model(
+        f"{output_model.__name__}BatchRead",
+        items=(List[output_model], ...),
+        missing=(List[str], ...),
+    )
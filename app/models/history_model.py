@@ -0,0 +1,20 @@
+from pydantic import BaseModel
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+
+class FieldChange(BaseModel):
+    old: Any = None
+    new: Any = None
+
+
+class VersionRead(BaseModel):
+    transaction_id: int
+    issued_at: Optional[datetime]
+    operation: str
+    changes: Dict[str, FieldChange]
+
+
+class HistoryPage(BaseModel):
+    items: List[VersionRead]
+    next_cursor: Optional[int]
@@ -0,0 +1,11 @@
+from pydantic import BaseModel
+from typing import Dict
+
+
+class MediaRead(BaseModel):
+    name: str
+    url: str
+    size: int
+    content_type: str
+    # thumbnail size -> url
+    thumbnails: Dict[int, str]
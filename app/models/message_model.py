@@ -17,8 +17,9 @@ class MessageCreate(MessageBase):
 
 class MessageRead(MessageBase):
     message_id: str
-    sender: UserRead
-    receiver: UserRead
+    # optional: rows can reference users that no longer exist
+    sender: Optional[UserRead] = None
+    receiver: Optional[UserRead] = None
 
 class MessageUpdate(BaseModel):
     message: str
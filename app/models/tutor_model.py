@@ -1,6 +1,20 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_validator
 from datetime import date
-from uuid import UUID, uuid4
+from typing import List, Optional
+from uuid import UUID
+from app.utils.availability.minutes_of_week import parse_time
+from app.utils.ids import new_id
+
+
+def check_time_range(slot):
+    """Reject a slot ending at its start time (free-form times that do not parse are kept as is)"""
+    try:
+        start, end = parse_time(slot.start_time), parse_time(slot.end_time)
+    except ValueError:
+        return slot
+    if start == end:
+        raise ValueError(f"Empty time range '{slot.start_time}' to '{slot.end_time}'")
+    return slot
 
 
 class TutorProfileBase(BaseModel):
@@ -24,7 +38,7 @@ class TutorProfileCreate(TutorProfileBase):
 
 
 class TutorProfileRead(TutorProfileBase):
-    tutor_profile_id: str = str(uuid4())
+    tutor_profile_id: str = Field(default_factory=new_id)
     
 
 class TutorProfileUpdate(BaseModel):
@@ -54,11 +68,11 @@ class TutorAvailabilityBase(BaseModel):
     
 
 class TutorAvailabilityCreate(TutorAvailabilityBase):
-    pass
+    _check_time_range = model_validator(mode="after")(check_time_range)
 
 
 class TutorAvailabilityRead(TutorAvailabilityBase):
-    tutor_availability_id: str = str(uuid4())
+    tutor_availability_id: str = Field(default_factory=new_id)
     
 
 class TutorAvailabilityUpdate(BaseModel):
@@ -66,6 +80,8 @@ class TutorAvailabilityUpdate(BaseModel):
     start_time: str
     end_time: str
 
+    _check_time_range = model_validator(mode="after")(check_time_range)
+
     class Config:
         from_attributes = True
         
@@ -86,7 +102,7 @@ class TutorQualificationCreate(TutorQualificationBase):
 
 
 class TutorQualificationRead(TutorQualificationBase):
-    tutor_qualification_id: str = str(uuid4())
+    tutor_qualification_id: str = Field(default_factory=new_id)
     
     
 class TutorQualificationUpdate(BaseModel):
@@ -114,7 +130,11 @@ class TutorSubjectCreate(TutorSubjectBase):
 
 
 class TutorSubjectRead(TutorSubjectBase):
-    tutor_subject_id: str = str(uuid4())
+    tutor_subject_id: str = Field(default_factory=new_id)
+
+
+class TutorSubjectRanked(TutorSubjectRead):
+    score: float
     
     
 class TutorSubjectUpdate(BaseModel):
@@ -142,7 +162,7 @@ class TutorReviewCreate(TutorReviewBase):
 
 
 class TutorReviewRead(TutorReviewBase):
-    tutor_review_id: str = str(uuid4())
+    tutor_review_id: str = Field(default_factory=new_id)
     
     
 class TutorReviewUpdate(BaseModel):
@@ -150,4 +170,34 @@ class TutorReviewUpdate(BaseModel):
     rating: str
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+
+
+# listing card (app.database.tutor_card)
+class TutorCardSubject(BaseModel):
+    subject: str
+    level: str
+
+
+class TutorCard(BaseModel):
+    tutor_profile_id: str
+    display_name: Optional[str] = None
+    tutor_title: Optional[str] = None
+    profile_photo: Optional[str] = None
+    short_bio: Optional[str] = None
+    average_response_time: Optional[str] = None
+    experience_years: Optional[str] = None
+    subjects: List[TutorCardSubject]
+    min_price: Optional[float] = None
+    days: List[str]
+    review_count: int
+    rating: Optional[float] = None
+
+
+# the whole profile aggregate
+class TutorProfileFull(TutorProfileRead):
+    tutor_subject: List[TutorSubjectRead] = []
+    tutor_availability: List[TutorAvailabilityRead] = []
+    tutor_qualification: List[TutorQualificationRead] = []
+    tutor_review: List[TutorReviewRead] = []
@@ -1,6 +1,7 @@
 from pydantic import BaseModel, Field
 from datetime import date
-from uuid import UUID, uuid4
+from uuid import UUID
+from app.utils.ids import new_id
 from app.utils.enums.enums import RoleEnum
 
 class UserBase(BaseModel):
@@ -17,7 +18,7 @@ class UserCreate(UserBase):
     pass
 
 class UserRead(UserBase):
-    user_id: str = str(uuid4())
+    user_id: str = Field(default_factory=new_id)
 
 class UserUpdate(BaseModel):
     profile_picture: str 
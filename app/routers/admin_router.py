@@ -0,0 +1,209 @@
+"""
+Admin endpoints (require the X-Admin-Token header)
+"""
+
+from datetime import timedelta
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import FileResponse, PlainTextResponse
+
+from app.dependencies import require_admin
+from app import config
+from app.database import archive, backup, history, tutor_card
+from app.middleware import memory, profiling
+from app.utils import metrics
+from app.utils.jobs import enqueue, job_queue
+from app.utils.messages.error_message_constants import ErrorMessageConstants
+
+
+router = APIRouter(dependencies=[Depends(require_admin)])
+
+
+# profiling
+@router.get("/profiles")
+def list_profiles():
+    """List the stored request profiles, most recent first"""
+    return profiling.list_profiles()
+
+
+@router.get("/profiles/{profile_id}/pstats")
+def get_profile_pstats(profile_id: str):
+    """Download the pstats dump of a profiled request (load with pstats.Stats or snakeviz)"""
+    path = profiling.profile_path(profile_id, ".pstats")
+    if path is None:
+        raise HTTPException(status_code=404, detail=ErrorMessageConstants.RESOURCE_NOT_FOUND)
+    return FileResponse(path, media_type="application/octet-stream", filename=f"{profile_id}.pstats")
+
+
+@router.get("/profiles/{profile_id}/collapsed")
+def get_profile_collapsed(profile_id: str):
+    """Download the collapsed stacks of a profiled request (input for flamegraph.pl / speedscope)"""
+    path = profiling.profile_path(profile_id, ".folded")
+    if path is None:
+        raise HTTPException(status_code=404, detail=ErrorMessageConstants.RESOURCE_NOT_FOUND)
+    return FileResponse(path, media_type="text/plain", filename=f"{profile_id}.folded")
+
+
+# memory
+@router.get("/memory/tracing")
+def get_memory_tracing():
+    """tracemalloc status and traced memory"""
+    return memory.tracing_status()
+
+
+@router.post("/memory/tracing/start")
+def start_memory_tracing(frames: int = None):
+    """Start tracemalloc storing `frames` frames per allocation"""
+    return memory.start_tracing(frames)
+
+
+@router.post("/memory/tracing/stop")
+def stop_memory_tracing():
+    """Stop tracemalloc"""
+    return memory.stop_tracing()
+
+
+@router.get("/memory/snapshots")
+def list_memory_snapshots():
+    """List the stored tracemalloc snapshots"""
+    return memory.list_snapshots()
+
+
+@router.post("/memory/snapshots")
+def take_memory_snapshot(label: str = None):
+    """Take a tracemalloc snapshot"""
+    try:
+        return memory.take_snapshot(label)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@router.get("/memory/snapshots/{snapshot_id}/top")
+def get_memory_snapshot_top(snapshot_id: int, group_by: str = "module", limit: int = 20):
+    """Largest allocation sites of a snapshot grouped by module or line"""
+    try:
+        return memory.top_allocations(snapshot_id, group_by, limit)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=ErrorMessageConstants.RESOURCE_NOT_FOUND)
+
+
+@router.get("/memory/snapshots/{snapshot_id}/diff/{base_snapshot_id}")
+def get_memory_snapshot_diff(
+    snapshot_id: int, base_snapshot_id: int, group_by: str = "module", limit: int = 20
+):
+    """Allocation sites that changed the most between two snapshots"""
+    try:
+        return memory.diff_snapshots(snapshot_id, base_snapshot_id, group_by, limit)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=ErrorMessageConstants.RESOURCE_NOT_FOUND)
+
+
+@router.delete("/memory/snapshots")
+def clear_memory_snapshots():
+    """Drop all stored snapshots"""
+    memory.snapshots.clear()
+    return memory.list_snapshots()
+
+
+@router.get("/memory/requests")
+def list_memory_requests():
+    """Peak allocation and loaded ORM objects of the recently sampled requests"""
+    return list(memory.request_records)
+
+
+@router.get("/memory/orm")
+def get_live_orm_objects():
+    """Live instances per mapped class in this worker"""
+    return memory.live_orm_objects()
+
+
+# history
+@router.post("/history/compact")
+def compact_history(
+    older_than_days: float = config.HISTORY_RETENTION_DAYS,
+    keep_last: int = config.HISTORY_KEEP_LAST,
+):
+    """Collapse the versions superseded more than older_than_days ago"""
+    return history.compact_history(timedelta(days=older_than_days), keep_last)
+
+
+# message archive
+@router.post("/messages/archive")
+def archive_messages(older_than_days: float = config.MESSAGE_HOT_DAYS):
+    """Enqueue the move of the whole months of messages sent more than older_than_days ago to the archive"""
+    return {"job_id": enqueue("archive_messages", payload={"older_than_days": older_than_days})}
+
+
+@router.get("/messages/archive")
+def list_message_partitions():
+    """The archived months, most recent first"""
+    return archive.partitions()
+
+
+# tutor cards
+@router.post("/tutor_cards/rebuild")
+def rebuild_tutor_cards():
+    """Rebuild every tutor card from its rows"""
+    return {"cards": tutor_card.rebuild()}
+
+
+@router.get("/tutor_cards/check")
+def check_tutor_cards(repair: bool = False):
+    """The tutor cards missing, orphaned or differing from their rows (rebuilt with repair=true)"""
+    return tutor_card.check(repair)
+
+
+# backups
+@router.post("/backups")
+def take_backup(full: bool = False, background: bool = False):
+    """Take a snapshot of the database (incremental unless full), or enqueue it as a job"""
+    if background:
+        return {"job_id": enqueue("backup_snapshot", payload={"reschedule": False, "full": full})}
+    try:
+        return backup.snapshot(full=full)
+    except backup.BackupInProgress:
+        raise HTTPException(status_code=409, detail=ErrorMessageConstants.CONFLICT_ERROR)
+
+
+@router.get("/backups")
+def list_backups():
+    """The snapshots, oldest first"""
+    return backup.read_manifest()
+
+
+@router.post("/backups/{name}/verify")
+def verify_backup(name: str):
+    """Restore a snapshot to a scratch file and check it against the database it was taken from"""
+    try:
+        return backup.verify(name)
+    except backup.BackupInProgress:
+        raise HTTPException(status_code=409, detail=ErrorMessageConstants.CONFLICT_ERROR)
+    except backup.BackupError as e:
+        raise HTTPException(status_code=422, detail=ErrorMessageConstants.BACKUP_FAILED.format(e))
+
+
+# jobs
+@router.get("/jobs")
+def list_jobs(status: str = None, limit: int = 100):
+    """The most recent background jobs, optionally with a given status"""
+    return job_queue.list(status, limit)
+
+
+@router.get("/jobs/depth")
+def get_job_queue_depth():
+    """Number of jobs per status"""
+    return job_queue.depth()
+
+
+@router.post("/jobs/{job_id}/retry")
+def retry_job(job_id: int):
+    """Queue a failed job again"""
+    if not job_queue.retry(job_id):
+        raise HTTPException(status_code=404, detail=ErrorMessageConstants.RESOURCE_NOT_FOUND)
+    return {"job_id": job_id}
+
+
+# metrics
+@router.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Metrics of this worker in the Prometheus text format"""
+    return metrics.render()
@@ -0,0 +1,84 @@
+"""
+Media uploads (see app.utils.media)
+
+The body of an upload is the raw image (Content-Type image/...), streamed to storage as it
+arrives. Stored assets are served at /media/<sha256>.<ext>, or their thumbnail with ?size=.
+"""
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import FileResponse, RedirectResponse
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+
+from app import config
+from app.models.media_model import MediaRead
+from app.utils import http_cache, media
+from app.utils.messages.error_message_constants import ErrorMessageConstants
+
+
+router = APIRouter()
+
+PREFIX = "/media"
+
+
+def media_url(name: str, size: int = None) -> str:
+    return f"{PREFIX}/{name}" if size is None else f"{PREFIX}/{name}?size={size}"
+
+
+def media_read(asset: media.Asset) -> MediaRead:
+    return MediaRead(
+        name=asset.name,
+        url=media_url(asset.name),
+        size=asset.size,
+        content_type=asset.content_type,
+        thumbnails={size: media_url(asset.name, size) for size in asset.thumbnails},
+    )
+
+
+async def store_upload(request: Request) -> media.Asset:
+    """Store the body of a request, with the HTTP errors of invalid uploads"""
+    length = request.headers.get("content-length")
+    if length is not None and length.isdigit() and int(length) > config.MEDIA_MAX_BYTES:
+        # refused before reading the body
+        raise HTTPException(status_code=413, detail=ErrorMessageConstants.MEDIA_TOO_LARGE.format(config.MEDIA_MAX_BYTES))
+    try:
+        return await media.store(request.stream())
+    except media.MediaTooLarge:
+        raise HTTPException(status_code=413, detail=ErrorMessageConstants.MEDIA_TOO_LARGE.format(config.MEDIA_MAX_BYTES))
+    except media.MediaError as e:
+        raise HTTPException(status_code=415, detail=ErrorMessageConstants.UNSUPPORTED_MEDIA.format(e))
+
+
+async def upload_to_field(request: Request, db: Session, service, id: str, field: str):
+    """Store an upload and point a field of an entity at it, returns the updated entity"""
+    if await run_in_threadpool(service.read, db, id) is None:
+        raise HTTPException(status_code=404, detail=ErrorMessageConstants.RESOURCE_NOT_FOUND)
+    asset = await store_upload(request)
+    return await run_in_threadpool(service.update, db, id, {field: media_url(asset.name)})
+
+
+@router.post("", response_model=MediaRead, status_code=201)
+async def upload_media(request: Request):
+    """Upload an image (the raw body): stored once per content, with its thumbnails"""
+    return media_read(await store_upload(request))
+
+
+@router.get("/{name}")
+def read_media(name: str, request: Request, size: int = None):
+    """An uploaded image, or its thumbnail of a size (redirected to the original if there is none)"""
+    path = media.find(name, size)
+    if path is None and size is not None and media.find(name) is not None:
+        # not the thumbnail: its immutable URL must not cache the original, which is served
+        # under its own URL, and the thumbnail may still be made
+        response = RedirectResponse(media_url(name), status_code=302)
+        response.headers["Cache-Control"] = http_cache.CACHE_CONTROL
+        return response
+    if path is None:
+        raise HTTPException(status_code=404, detail=ErrorMessageConstants.RESOURCE_NOT_FOUND)
+    etag = f'"{name[:64]}-{size or 0}"'
+    if http_cache.is_not_modified(request, etag, None):
+        return http_cache.not_modified(etag, cache_control=http_cache.IMMUTABLE)
+    # streamed from the file (sendfile when the server supports it)
+    response = FileResponse(path, media_type=media.CONTENT_TYPES[name.rsplit(".", 1)[1]])
+    http_cache.set_validators(response, etag, cache_control=http_cache.IMMUTABLE)
+    return response
@@ -1,9 +1,17 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from sqlalchemy.orm import Session
-from typing import Type, List, Generic, TypeVar
+from typing import Type, List, Generic, Optional, TypeVar
+from datetime import datetime
 import re
 
+from app import config
+from app.database import filters
 from app.dependencies import get_db
+from app.middleware.admission import AdmissionPolicy, default_policy
+from app.models.batch_model import BatchGetRequest, batch_read_model
+from app.models.history_model import HistoryPage
+from app.utils import http_cache
+from app.utils.messages.error_message_constants import ErrorMessageConstants
 
 TCreateModel = TypeVar("TCreateModel")
 TReadModel = TypeVar("TReadModel")
@@ -24,23 +32,152 @@ class GenericCRUDRouter(Generic[TCreateModel, TReadModel, TUpdateModel, TService
         service: Type[TService],
         input_model: Type[TInputModel],
         output_model: Type[TOutputModel],
+        admission: AdmissionPolicy = None,
     ):
         self.router = router
         self.service = service
         self.input_model = input_model
         self.output_model = output_model
+        # rate and concurrency limits of the routes of this router (see app.middleware.admission)
+        self.admission = admission or default_policy()
+        if self.admission is not None:
+            self.router.route_class = self.admission.route_class()
 
         self._add_routes()
 
     
     def _add_routes(self):
         endpoint_name = snake_case(self.input_model.__name__)
+        entity_name = self.service._tablename
 
         @self.router.post(f"/{endpoint_name}", response_model=self.output_model)
         def create(input_object: self.input_model, db: Session = Depends(get_db)):
             """Create a new item"""
             return self.service.create(db, input_object)
 
+        # relationships serialized in the responses: their rows are part of the validators
+        related = [
+            name
+            for name in self.output_model.model_fields
+            if name in self.service.CRUD.model.__mapper__.relationships
+        ]
+
+        # query parameters of the list endpoint that are not filters
+        list_parameters = {"skip", "limit", "as_of", "ids"}
+
+        @self.router.get(f"/{entity_name}", response_model=List[self.output_model])
+        def read_all(
+            request: Request,
+            response: Response,
+            skip: int = Query(0, ge=0),
+            limit: int = Query(100, ge=1, le=1000),
+            as_of: datetime = None,
+            ids: Optional[List[str]] = Query(None, description="ids to read (repeated or comma separated)"),
+            db: Session = Depends(get_db),
+        ):
+            """
+            Read a page of items (as they were at as_of if given, else with the number of items in
+            the X-Total-Count header), or the items with the given ids in request order (the ids
+            not found are listed in the X-Missing-Ids header). ids cannot be combined with as_of
+            or filters.
+
+            The other query parameters filter the items: field=value or field__operator=value
+            with the operators eq, ne, lt, lte, gt, gte, between (a,b), in (a,b,...), prefix
+            and is_null (true/false), e.g. ?start_minute__between=600,720
+            """
+            try:
+                filter = filters.parse(
+                    self.service.CRUD.model,
+                    [item for item in request.query_params.multi_items() if item[0] not in list_parameters],
+                )
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=ErrorMessageConstants.INVALID_FILTER.format(e))
+            if ids is not None:
+                ids = [id for value in ids for id in value.split(",") if id]
+                if len(ids) > config.BATCH_GET_MAX_IDS:
+                    raise HTTPException(
+                        status_code=400,
+                        detail=ErrorMessageConstants.TOO_MANY_IDS.format(config.BATCH_GET_MAX_IDS),
+                    )
+                # the current rows are read by primary key: neither as of a time nor filtered
+                if as_of is not None or filter:
+                    combined = "as_of" if as_of is not None else "filters"
+                    raise HTTPException(
+                        status_code=400, detail=ErrorMessageConstants.IDS_NOT_COMBINABLE.format(combined)
+                    )
+            if as_of is None:
+                # known before the query: unchanged tables are answered without reading them
+                etag = self.service.list_validator(db, related)
+                if http_cache.is_not_modified(request, etag, None):
+                    return http_cache.not_modified(etag)
+                http_cache.set_validators(response, etag)
+            if ids is not None:
+                records, missing = self.service.read_many(db, ids, children=True)
+                if missing:
+                    response.headers["X-Missing-Ids"] = ",".join(missing)
+                return self.service.resolve(db, records, related)
+            if filter:
+                records = self.service.read_by_filter(
+                    db, filter, children=True, as_of=as_of, skip=skip, limit=limit
+                )
+            else:
+                records = self.service.read_all_paginated(db, skip, limit, children=True, as_of=as_of)
+            if as_of is not None:
+                # versions: their relationships resolved as of the same time
+                return self.service.resolve_as_of(db, records, related, as_of)
+            total, exact = self.service.count(db, filter)
+            response.headers["X-Total-Count"] = str(total)
+            if not exact:
+                response.headers["X-Total-Count-Estimated"] = "true"
+            return self.service.resolve(db, records, related)
+
+        @self.router.post(f"/{entity_name}/batch-get", response_model=batch_read_model(self.output_model))
+        def batch_get(batch: BatchGetRequest, db: Session = Depends(get_db)):
+            """Read the items with the given ids in request order, with the ids that were not found"""
+            records, missing = self.service.read_many(db, batch.ids, children=True)
+            return {"items": self.service.resolve(db, records, related), "missing": missing}
+
+        @self.router.get(f"/{entity_name}/{{id}}", response_model=self.output_model)
+        def read(
+            id: str,
+            request: Request,
+            response: Response,
+            as_of: datetime = None,
+            db: Session = Depends(get_db),
+        ):
+            """Read an item (as it was at as_of if given)"""
+            if as_of is not None:
+                record = self.service.read(db, id, children=True, as_of=as_of)
+                if record is None:
+                    raise HTTPException(status_code=404, detail=ErrorMessageConstants.RESOURCE_NOT_FOUND)
+                return self.service.resolve_as_of(db, [record], related, as_of)[0]
+
+            # validators cached since the entity was last written: 304 without a query
+            validators = self.service.cached_validators(id, related)
+            if validators is not None and http_cache.is_not_modified(request, *validators):
+                return http_cache.not_modified(*validators)
+            record, validators = self.service.read_with_validators(db, id, related)
+            if record is None:
+                raise HTTPException(status_code=404, detail=ErrorMessageConstants.RESOURCE_NOT_FOUND)
+            # 304 before serializing the record
+            if http_cache.is_not_modified(request, *validators):
+                return http_cache.not_modified(*validators)
+            http_cache.set_validators(response, *validators)
+            return record
+
+        @self.router.get(f"/{entity_name}/{{id}}/history", response_model=HistoryPage)
+        def read_history(
+            id: str,
+            limit: int = Query(20, ge=1, le=100),
+            cursor: int = None,
+            db: Session = Depends(get_db),
+        ):
+            """Read the version history of an item, most recent first, with field level changes"""
+            page = self.service.read_history(db, id, limit=limit, cursor=cursor)
+            if page is None:
+                raise HTTPException(status_code=404, detail=ErrorMessageConstants.RESOURCE_NOT_FOUND)
+            return page
+
         
 
 
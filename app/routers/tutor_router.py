@@ -1,7 +1,15 @@
-from app.models.tutor_model import TutorProfileCreate, TutorProfileRead, TutorProfileUpdate, TutorAvailabilityCreate, TutorAvailabilityRead, TutorAvailabilityUpdate, TutorQualificationCreate, TutorQualificationRead, TutorQualificationUpdate, TutorSubjectCreate, TutorSubjectRead, TutorSubjectUpdate, TutorReviewCreate, TutorReviewRead, TutorReviewUpdate
+from app.models.tutor_model import TutorCard, TutorProfileCreate, TutorProfileFull, TutorProfileRead, TutorProfileUpdate, TutorAvailabilityCreate, TutorAvailabilityRead, TutorAvailabilityUpdate, TutorQualificationCreate, TutorQualificationRead, TutorQualificationUpdate, TutorSubjectCreate, TutorSubjectRanked, TutorSubjectRead, TutorSubjectUpdate, TutorReviewCreate, TutorReviewRead, TutorReviewUpdate
 from app.services.tutor_service import TutorProfileService, TutorAvailabilityService, TutorQualificationService, TutorSubjectService, TutorReviewService
 from app.routers.rest_routers import GenericCRUDRouter
-from fastapi import APIRouter
+from app.routers.media_router import upload_to_field
+from app.middleware.admission import AdmissionPolicy
+from app import config
+from app.dependencies import get_db
+from app.utils import http_cache
+from app.utils.messages.error_message_constants import ErrorMessageConstants
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from sqlalchemy.orm import Session
+from typing import List
 
 
 # tutor_profile
@@ -10,10 +18,72 @@ tutor_profile_service = TutorProfileService()
 tutor_profile_router = GenericCRUDRouter[TutorProfileCreate, TutorProfileRead, TutorProfileUpdate, TutorProfileService, TutorProfileCreate, TutorProfileRead](router1, tutor_profile_service, TutorProfileCreate, TutorProfileRead)
 
 
+@router1.get("/{id}/full", response_model=TutorProfileFull)
+def read_tutor_profile_full(id: str, request: Request, db: Session = Depends(get_db)):
+    """Read a tutor profile with its subjects, availabilities, qualifications and reviews"""
+    # cached since the profile was last written: 304 without a query
+    cached = tutor_profile_service.cached_full(id)
+    if cached is not None and http_cache.is_not_modified(request, cached[1], None):
+        return http_cache.not_modified(cached[1])
+    full = tutor_profile_service.read_full(db, id)
+    if full is None:
+        raise HTTPException(status_code=404, detail=ErrorMessageConstants.RESOURCE_NOT_FOUND)
+    body, etag = full
+    if http_cache.is_not_modified(request, etag, None):
+        return http_cache.not_modified(etag)
+    # the document is cached serialized: bypass the response model
+    response = Response(content=body, media_type="application/json")
+    http_cache.set_validators(response, etag)
+    return response
+
+
+@router1.get("/tutor_card", response_model=List[TutorCard])
+def read_tutor_cards(
+    subject: str = None,
+    level: str = None,
+    day: str = None,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(get_db),
+):
+    """A page of tutor listing cards, best rated first, optionally of a subject, level and day of availability"""
+    try:
+        return tutor_profile_service.read_cards(db, subject, level, day, skip=skip, limit=limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=ErrorMessageConstants.INVALID_FILTER.format(e))
+
+
+@router1.put("/{id}/profile_photo", response_model=TutorProfileRead)
+async def upload_tutor_profile_photo(id: str, request: Request, db: Session = Depends(get_db)):
+    """Upload the profile photo of a tutor (the raw image body)"""
+    return await upload_to_field(request, db, tutor_profile_service, id, "profile_photo")
+
+
 # tutor_availability
 router2 = APIRouter()
 tutor_availability_service = TutorAvailabilityService()
-tutor_availability_router = GenericCRUDRouter[TutorAvailabilityCreate, TutorAvailabilityRead, TutorAvailabilityUpdate, TutorAvailabilityService, TutorAvailabilityCreate, TutorAvailabilityRead](router2, tutor_availability_service, TutorAvailabilityCreate, TutorAvailabilityRead)
+# availability searches are the most expensive reads: keep fewer of them running at once
+tutor_availability_admission = (
+    AdmissionPolicy(max_concurrency=config.SEARCH_MAX_CONCURRENCY, max_queue=config.ROUTE_MAX_QUEUE)
+    if config.ADMISSION_ENABLED
+    else None
+)
+tutor_availability_router = GenericCRUDRouter[TutorAvailabilityCreate, TutorAvailabilityRead, TutorAvailabilityUpdate, TutorAvailabilityService, TutorAvailabilityCreate, TutorAvailabilityRead](router2, tutor_availability_service, TutorAvailabilityCreate, TutorAvailabilityRead, admission=tutor_availability_admission)
+
+
+@router2.get("/tutor_availability_search", response_model=List[TutorAvailabilityRead])
+def search_tutor_availability(
+    day: str,
+    start_time: str,
+    end_time: str,
+    mode: str = Query("cover", pattern="^(cover|overlap)$"),
+    db: Session = Depends(get_db),
+):
+    """Find the availabilities covering (or overlapping) a time range, e.g. tuesday 17:00-18:00"""
+    try:
+        return tutor_availability_service.search_availability(db, day, start_time, end_time, mode=mode)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=ErrorMessageConstants.INVALID_AVAILABILITY.format(e))
 
 
 # tutor_qualification
@@ -28,6 +98,20 @@ tutor_subject_service = TutorSubjectService()
 tutor_subject_router = GenericCRUDRouter[TutorSubjectCreate, TutorSubjectRead, TutorSubjectUpdate, TutorSubjectService, TutorSubjectCreate, TutorSubjectRead](router4, tutor_subject_service, TutorSubjectCreate, TutorSubjectRead)
 
 
+@router4.get("/tutor_subject_top", response_model=List[TutorSubjectRanked])
+def read_tutor_subject_top(
+    subject: str,
+    level: str,
+    k: int = Query(10, ge=1, le=config.RANKING_TOP_K),
+    db: Session = Depends(get_db),
+):
+    """The best ranked tutors of a subject and level, e.g. GCSE Maths (rating, reviews, response time, experience, price)"""
+    return [
+        TutorSubjectRanked(**TutorSubjectRead.model_validate(record, from_attributes=True).model_dump(), score=score)
+        for record, score in tutor_subject_service.top(db, subject, level, k)
+    ]
+
+
 # tutor_review
 router5 = APIRouter()
 tutor_review_service = TutorReviewService()
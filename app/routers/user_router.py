@@ -1,10 +1,19 @@
 from app.models.user_model import UserCreate, UserRead, UserUpdate
 from app.services.user_service import UserService
 from app.routers.rest_routers import GenericCRUDRouter
-from fastapi import APIRouter
+from app.routers.media_router import upload_to_field
+from app.dependencies import get_db
+from fastapi import APIRouter, Depends, Request
+from sqlalchemy.orm import Session
 
 
 router = APIRouter()
 service = UserService()
 
-user_router = GenericCRUDRouter[UserCreate, UserRead, UserUpdate, UserService, UserCreate, UserRead](router, service, UserCreate, UserRead)
\ No newline at end of file
+user_router = GenericCRUDRouter[UserCreate, UserRead, UserUpdate, UserService, UserCreate, UserRead](router, service, UserCreate, UserRead)
+
+
+@router.put("/{id}/profile_picture", response_model=UserRead)
+async def upload_profile_picture(id: str, request: Request, db: Session = Depends(get_db)):
+    """Upload the profile picture of a user (the raw image body)"""
+    return await upload_to_field(request, db, service, id, "profile_picture")
@@ -0,0 +1,44 @@
+"""
+Run the API, optionally with several worker processes.
+
+    python -m app.serve --workers 4
+
+Every worker opens its own database engine (uvicorn starts them as fresh processes; the
+engine is also disposed after fork for pre-fork servers such as gunicorn --preload) and
+they share the cache tier in SHARED_CACHE_DIR, so a write in one worker invalidates the
+cached entries of all of them. The tier is shared with a single worker too: the job workers
+(python -m app.utils.jobs, with the same --cache-dir) write to the database as well.
+"""
+
+import argparse
+import os
+
+import uvicorn
+
+from app import config
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the extraclasses API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=config.WORKERS)
+    parser.add_argument("--cache-dir", default=config.SHARED_CACHE_DIR or config.DEFAULT_SHARED_CACHE_DIR)
+    args = parser.parse_args()
+
+    # the environment is inherited by the workers, which build the shared cache from it (a
+    # single worker runs in this process, where config is already loaded)
+    os.environ["SHARED_CACHE_DIR"] = config.SHARED_CACHE_DIR = args.cache_dir
+
+    # create the tables once before the workers import the app concurrently
+    from app.database import crud  # noqa: F401 - registers the models
+    from app.database.database import Base, engine
+
+    Base.metadata.create_all(engine)
+    engine.dispose()
+
+    uvicorn.run("app.main:app", host=args.host, port=args.port, workers=args.workers)
+
+
+if __name__ == "__main__":
+    main()
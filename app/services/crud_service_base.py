@@ -2,30 +2,71 @@
 crud_service_base for all common services 
 """
 
+from app import config
+from app.database import counts
 from app.database.crud.base import CRUDBase
-from typing import List, Dict, Any
+from app.database.database import pin_to_primary
+from app.database.loader import loader
+from app.database.writer import writer
+from app.database import crud
+from app.utils.cache import cache
+from app.utils.jobs import enqueue, job
+from typing import List, Dict, Any, Optional, Tuple
+from datetime import datetime
 import warnings
 from sqlalchemy.orm import Session
 from uuid import UUID
 
 
+@job("soft_delete")
+def soft_delete_job(db: Session, tablename: str, id: str, metadata: Dict[str, Any] = None):
+    """Soft delete an entity and its children out of the request"""
+    getattr(crud, tablename).soft_delete(db, id, metadata=metadata)
+
+
 class CRUDServiceBase():
     def __init__(self, CRUD: CRUDBase):
         self.CRUD = CRUD
         self._tablename = CRUD.model.__tablename__
         
+    def _write(self, db: Session, operation):
+        """
+        Run a write operation with the request session, or hand it to the group commit writer
+        when enabled (the written entities are then merged into the request session)
+        """
+        if not config.WRITER_ENABLED:
+            return operation(db)
+        try:
+            result = writer.execute(operation)
+        finally:
+            # flushed by the writer's session: read the write back from the primary
+            pin_to_primary(db)
+        if isinstance(result, list):
+            return [self._merge(db, item) for item in result]
+        return self._merge(db, result)
+
+    def _ids_by_field(self, db: Session, field: str, value: Any) -> List[Any]:
+        """primary keys of the entities (active or not) with field == value"""
+        records = self.CRUD.read_by_filter(db, {field: value}, is_active=False)
+        return [getattr(record, self.CRUD.primary_key) for record in records]
+
+    def _merge(self, db: Session, item):
+        if hasattr(item, "_sa_instance_state"):
+            return db.merge(item, load=False)
+        return item
+        
     def create(self, db: Session, input_object):
         """Create an entity in the database"""
         try:
-            return self.CRUD.create(db, input_object)
+            return self._write(db, lambda session: self.CRUD.create(session, input_object))
         except Exception as e:
             warnings.warn(f"Failed to create {self._tablename} in the database")
             raise e
         
     def create_multi(self, db: Session, input_objects: List[Dict[str, Any]]):
-        """Create multiple entities in the database"""
+        """Create multiple entities in the database (in a single write)"""
         try:
-            return self.CRUD.create_multi(db, input_objects)
+            return self._write(db, lambda session: self.CRUD.bulk_create(session, input_objects))
         except Exception as e:
             warnings.warn(f"Failed to create {self._tablename} in the database")
             raise e
@@ -33,27 +74,120 @@ class CRUDServiceBase():
     def create_from_dict(self, db: Session, input_dict: Dict[str, Any]):
         """Create an entity in the database from a dictionary"""
         try:
-            return self.CRUD.create_from_dict(db, input_dict)
+            return self._write(db, lambda session: self.CRUD.create(session, input_dict))
         except Exception as e:
             warnings.warn(f"Failed to create {self._tablename} in the database")
             raise e
         
-    def read(self, db: Session, id: UUID):
-        """Read an entity from the database"""
+    def read(self, db: Session, id: UUID, children: bool = False, as_of: datetime = None):
+        """Read an entity from the database (as it was at as_of if given)"""
         try:
-            return self.CRUD.read(db, id)
+            return self.CRUD.read(db, id, children=children, as_of=as_of)
         except Exception as e:
             warnings.warn(f"Failed to read {self._tablename} from the database")
             raise e
         
+    def _related_tables(self, related: List[str]) -> List[str]:
+        relationships = self.CRUD.model.__mapper__.relationships
+        return [relationships[name].mapper.local_table.name for name in related]
+        
+    def cached_validators(
+        self, id: UUID, related: List[str] = ()
+    ) -> Optional[Tuple[str, Optional[datetime]]]:
+        """
+        The (ETag, Last-Modified) of an entity cached by read_with_validators, or None. Only
+        used when the cache generations are shared with every process writing to the database
+        (SHARED_CACHE_DIR): the writes of the others would not invalidate a local entry.
+        """
+        if not cache.shared:
+            return None
+        return cache.get(
+            f"validators:{self._tablename}:{id}",
+            self._related_tables(related),
+            entities=[(self._tablename, id)],
+        )
+        
+    def read_with_validators(self, db: Session, id: UUID, related: List[str] = ()):
+        """
+        Read an entity (with children) and its HTTP validators (ETag, Last-Modified) computed
+        from the versions of the entity and of its `related` records. The validators are
+        cached until the entity (or a table of its related records) is written.
+
+        Returns:
+            Tuple: (record, (etag, last_modified)), or (None, None) if the entity does not exist.
+        """
+        key = f"validators:{self._tablename}:{id}"
+        tables = self._related_tables(related)
+        entities = [(self._tablename, id)]
+        stamp = cache.stamp(key, tables, entities)
+        record = self.read(db, id, children=True)
+        if record is None:
+            return None, None
+        try:
+            validators = self.CRUD.read_validators(db, record, related)
+        except Exception as e:
+            warnings.warn(f"Failed to read the versions of {self._tablename} from the database")
+            raise e
+        cache.set(key, validators, tables, stamp=stamp)
+        return record, validators
+        
+    def list_validator(self, db: Session, related: List[str] = ()) -> str:
+        """
+        ETag of the lists of entities: the cache generations of the table and of the tables of
+        the related records, which every commit writing to them bumps (known without a query).
+        Without a shared cache the generations only count the commits of this process, and the
+        ETag is read from the versions of the tables instead.
+        """
+        if not cache.shared:
+            try:
+                return self.CRUD.read_list_validator(db, related)
+            except Exception as e:
+                warnings.warn(f"Failed to read the versions of {self._tablename} from the database")
+                raise e
+        tables = [self._tablename] + self._related_tables(related)
+        generations = "-".join(str(cache.table_generation(tablename)) for tablename in tables)
+        return f'W/"g{cache.generations.epoch:x}-{generations}"'
+        
     def read_multi(self, db: Session, ids: List[UUID]):
-        """Read multiple entities from the database"""
+        """Read multiple entities from the database (in the order of ids, missing ids are skipped)"""
+        records, _ = self.read_many(db, ids)
+        return records
+        
+    def read_many(self, db: Session, ids: List[UUID], children: bool = False):
+        """
+        Read multiple entities from the database in chunked queries
+
+        Returns:
+            Tuple[List, List]: The entities in the order of ids, and the ids that were not found.
+        """
         try:
-            return self.CRUD.read_multi(db, ids)
+            return self.CRUD.read_many(db, ids, children=children)
         except Exception as e:
             warnings.warn(f"Failed to read {self._tablename} from the database")
             raise e
         
+    def resolve(self, db: Session, records: List, relationships: List[str]):
+        """
+        Load the many-to-one relationships of a page of entities in one query per related
+        model with the request scoped DataLoader, instead of one lazy load per entity
+        """
+        try:
+            return loader(db).resolve(records, relationships)
+        except Exception as e:
+            warnings.warn(f"Failed to read the relationships of {self._tablename} from the database")
+            raise e
+        
+    def resolve_as_of(self, db: Session, versions: List, relationships: List[str], as_of: datetime):
+        """
+        Resolve the many-to-one relationships of versions read as of a time, as of the same
+        time, in one query per relationship
+        """
+        try:
+            return self.CRUD.resolve_as_of(db, versions, relationships, as_of)
+        except Exception as e:
+            warnings.warn(f"Failed to read the relationships of {self._tablename} from the database")
+            raise e
+        
     def read_all(self, db: Session):
         """Read all entities from the database"""
         try:
@@ -62,10 +196,57 @@ class CRUDServiceBase():
             warnings.warn(f"Failed to read {self._tablename} from the database")
             raise e
         
-    def read_all_paginated(self, db: Session, skip: int = 0, limit: int = 100):
-        """Read all entities from the database paginated"""
+    def read_all_paginated(
+        self,
+        db: Session,
+        skip: int = 0,
+        limit: int = 100,
+        children: bool = False,
+        as_of: datetime = None,
+    ):
+        """Read all entities from the database paginated (as they were at as_of if given)"""
         try:
-            return self.CRUD.read_multi(db, skip, limit)
+            return self.CRUD.read_multi(db, skip, limit, children=children, as_of=as_of)
+        except Exception as e:
+            warnings.warn(f"Failed to read {self._tablename} from the database")
+            raise e
+        
+    def count(self, db: Session, filter: Dict[str, Any] = None) -> Tuple[int, bool]:
+        """
+        Number of active entities matching an equality filter: read from a maintained counter
+        when there is one for the filter, otherwise counted and cached for COUNT_ESTIMATE_TTL
+
+        Returns:
+            Tuple[int, bool]: The count, and whether it is exact.
+        """
+        try:
+            return counts.count(db, self.CRUD, filter)
+        except Exception as e:
+            warnings.warn(f"Failed to count {self._tablename} in the database")
+            raise e
+        
+    def read_history(self, db: Session, id: UUID, limit: int = 20, cursor: int = None):
+        """Read a page of the version history of an entity"""
+        try:
+            return self.CRUD.read_history(db, id, limit=limit, cursor=cursor)
+        except Exception as e:
+            warnings.warn(f"Failed to read the history of {self._tablename} from the database")
+            raise e
+        
+    def read_by_filter(
+        self,
+        db: Session,
+        filter: Dict[str, Any],
+        children: bool = False,
+        as_of: datetime = None,
+        skip: int = None,
+        limit: int = None,
+    ):
+        """Read the entities matching a filter (as they were at as_of if given)"""
+        try:
+            return self.CRUD.read_by_filter(
+                db, filter, children=children, as_of=as_of, skip=skip, limit=limit
+            )
         except Exception as e:
             warnings.warn(f"Failed to read {self._tablename} from the database")
             raise e
@@ -81,23 +262,40 @@ class CRUDServiceBase():
     def update(self, db: Session, id: UUID, input_object):
         """Update an entity in the database"""
         try:
-            return self.CRUD.update(db, id, input_object)
+            return self._write(db, lambda session: self.CRUD.update(session, id, input_object))
         except Exception as e:
             warnings.warn(f"Failed to update {self._tablename} in the database")
             raise e
         
     def update_by_field(self, db: Session, field: str, value: Any, input_object):
-        """Update an entity in the database by a field"""
+        """Update the entities with field == value in the database (in a single write)"""
         try:
-            return self.CRUD.update_by_field(db, field, value, input_object)
+            return self._write(
+                db,
+                lambda session: [
+                    self.CRUD.update(session, id, input_object)
+                    for id in self._ids_by_field(session, field, value)
+                ],
+            )
         except Exception as e:
             warnings.warn(f"Failed to update {self._tablename} in the database")
             raise e
         
     def update_multi(self, db: Session, ids: List[UUID], input_objects):
-        """Update multiple entities in the database"""
+        """
+        Update multiple entities in the database (in a single write): input_objects is a list
+        matching ids, or one update applied to every entity
+        """
+        if not isinstance(input_objects, list):
+            input_objects = [input_objects] * len(ids)
         try:
-            return self.CRUD.update_multi(db, ids, input_objects)
+            return self._write(
+                db,
+                lambda session: [
+                    self.CRUD.update(session, id, input_object)
+                    for id, input_object in zip(ids, input_objects)
+                ],
+            )
         except Exception as e:
             warnings.warn(f"Failed to update {self._tablename} in the database")
             raise e
@@ -105,31 +303,72 @@ class CRUDServiceBase():
     def delete(self, db: Session, id: UUID):
         """Delete an entity from the database"""
         try:
-            return self.CRUD.delete(db, id)
+            return self._write(db, lambda session: self.CRUD.delete(session, id))
         except Exception as e:
             warnings.warn(f"Failed to delete {self._tablename} from the database")
             raise e
         
     def delete_multi(self, db: Session, ids: List[UUID]):
-        """Delete multiple entities from the database"""
+        """Delete multiple entities from the database (in a single write)"""
+        try:
+            return self._write(db, lambda session: [self.CRUD.delete(session, id) for id in ids])
+        except Exception as e:
+            warnings.warn(f"Failed to delete {self._tablename} from the database")
+            raise e
+        
+    def soft_delete(
+        self, db: Session, id: UUID, metadata: Dict[str, Any] = None, background: bool = False
+    ):
+        """
+        Soft delete an entity and its children. With background=True the (possibly large)
+        cascade runs as a job and the job id is returned.
+        """
+        if background:
+            return self.enqueue(
+                db, "soft_delete", tablename=self._tablename, id=str(id), metadata=metadata
+            )
         try:
-            return self.CRUD.delete_multi(db, ids)
+            return self._write(
+                db, lambda session: self.CRUD.soft_delete(session, id, metadata=metadata)
+            )
         except Exception as e:
             warnings.warn(f"Failed to delete {self._tablename} from the database")
             raise e
         
+    def enqueue(self, db: Session, name: str, priority: int = 0, delay: float = 0, **payload):
+        """
+        Enqueue follow-up work as a background job (see app.utils.jobs). If db has writes
+        that are not committed yet, the job is held until they commit.
+        """
+        try:
+            return enqueue(name, db=db, payload=payload, priority=priority, delay=delay)
+        except Exception as e:
+            warnings.warn(f"Failed to enqueue {name} for {self._tablename}")
+            raise e
+        
     def delete_by_field(self, db: Session, field: str, value: Any):
-        """Delete an entity from the database by a field"""
+        """Delete the entities with field == value from the database (in a single write)"""
         try:
-            return self.CRUD.delete_by_field(db, field, value)
+            return self._write(
+                db,
+                lambda session: [
+                    self.CRUD.delete(session, id) for id in self._ids_by_field(session, field, value)
+                ],
+            )
         except Exception as e:
             warnings.warn(f"Failed to delete {self._tablename} from the database")
             raise e
         
     def delete_all(self, db: Session):
-        """Delete all entities from the database"""
+        """Delete all entities from the database (in a single write)"""
         try:
-            return self.CRUD.delete_all(db)
+            return self._write(
+                db,
+                lambda session: [
+                    self.CRUD.delete(session, getattr(record, self.CRUD.primary_key))
+                    for record in self.CRUD.read_by_filter(session, {})
+                ],
+            )
         except Exception as e:
             warnings.warn(f"Failed to delete {self._tablename} from the database")
             raise e
@@ -1,4 +1,25 @@
+from typing import Any, Dict, List, Optional, Tuple
+import hashlib
+import threading
+import time
+import warnings
+from sqlalchemy.orm import Session
+from app import config
 from app.services.crud_service_base import CRUDServiceBase
+from app.database.database import SessionLocal
+from app.database.events import Change, on_commit
+from app.utils import metrics
+from app.utils.cache import cache
+from app.utils.availability.interval_index import IntervalIndex
+from app.utils.availability.minutes_of_week import parse_day, to_week_range
+from app.utils.ranking.tutor_ranking import TutorRanking
+from app.models.tutor_model import (
+    TutorAvailabilityRead,
+    TutorProfileFull,
+    TutorQualificationRead,
+    TutorReviewRead,
+    TutorSubjectRead,
+)
 from app.database.crud import tutor_profile as tutor_profileCRUD
 from app.database.crud import tutor_availability as tutor_availabilityCRUD
 from app.database.crud import tutor_qualification as tutor_qualificationCRUD
@@ -6,21 +27,373 @@ from app.database.crud import tutor_subject as tutor_subjectCRUD
 from app.database.crud import tutor_review as tutor_reviewCRUD
 
 
+ranking_rebuilds = metrics.Counter("tutor_ranking_rebuilds_total", "Full rebuilds of the tutor ranking by trigger (initial, stale, interval)")
+
+
 class TutorProfileService(CRUDServiceBase):
+    # relationships embedded in the full profile document, with their read models
+    FULL_CHILDREN = {
+        "tutor_subject": TutorSubjectRead,
+        "tutor_availability": TutorAvailabilityRead,
+        "tutor_qualification": TutorQualificationRead,
+        "tutor_review": TutorReviewRead,
+    }
+    # generation shared by every full document (a cache "table" without rows)
+    FULL_SCOPE = "tutor_profile_full"
+
     def __init__(self):
         super().__init__(tutor_profileCRUD)
+        relationships = self.CRUD.model.__mapper__.relationships
+        self._child_tables = {
+            relationships[name].mapper.local_table.name: relationships[name].remote_side
+            for name in self.FULL_CHILDREN
+        }
+        on_commit(*self._child_tables)(self._invalidate_full)
+
+    def _full_key(self, id: str) -> str:
+        return f"tutor_profile_full:{id}"
+
+    def cached_full(self, id: str) -> Optional[Tuple[bytes, str]]:
+        """The (JSON document, ETag) of a full profile cached by read_full, or None"""
+        return cache.get(self._full_key(id), [self.FULL_SCOPE], entities=[(self._tablename, id)])
+
+    def read_full(self, db: Session, id: str) -> Optional[Tuple[bytes, str]]:
+        """
+        Read a profile with its subjects, availabilities, qualifications and reviews in a
+        single query, serialized as a TutorProfileFull JSON document. The document and its
+        ETag are cached until the profile or one of its children is written.
+
+        Returns:
+            Optional[Tuple[bytes, str]]: (JSON document, ETag), or None if the profile does not exist.
+        """
+        key = self._full_key(id)
+        entities = [(self._tablename, id)]
+        cached = cache.get(key, [self.FULL_SCOPE], entities=entities)
+        if cached is not None:
+            return cached
+        stamp = cache.stamp(key, [self.FULL_SCOPE], entities)
+        try:
+            document = self.CRUD.read_full(db, id, self.FULL_CHILDREN)
+        except Exception as e:
+            warnings.warn(f"Failed to read the full {self._tablename} from the database")
+            raise e
+        if document is None:
+            return None
+        body = TutorProfileFull.model_validate(document).model_dump_json().encode()
+        etag = f'W/"f{hashlib.blake2b(body, digest_size=12).hexdigest()}"'
+        cache.set(key, (body, etag), [self.FULL_SCOPE], stamp=stamp)
+        return body, etag
+
+    def read_cards(
+        self, db: Session, subject: str = None, level: str = None, day: str = None, skip: int = 0, limit: int = 100
+    ) -> List[Dict[str, Any]]:
+        """
+        Read a page of tutor cards, best rated first (see app.database.tutor_card)
+
+        Raises:
+            ValueError: if the day cannot be parsed.
+        """
+        day_index = None if day is None else parse_day(day)
+        try:
+            return self.CRUD.read_cards(db, subject, level, day_index, skip=skip, limit=limit)
+        except Exception as e:
+            warnings.warn("Failed to read the tutor cards from the database")
+            raise e
+
+    def _invalidate_full(self, changes):
+        """
+        drop the cached full documents of the profiles whose children were written, and of
+        the previous profile of a child moved to another one
+        """
+        for change in changes:
+            columns = self._child_tables[change.tablename]
+            profile_ids = {change.values.get(column.key) for column in columns}
+            profile_ids |= {change.previous[column.key] for column in columns if column.key in change.previous}
+            if None in profile_ids:
+                # the profile of the child is unknown: drop every full document
+                cache.invalidate_table(self.FULL_SCOPE)
+                continue
+            for profile_id in profile_ids:
+                cache.invalidate(self._full_key(profile_id))
         
 class TutorAvailabilityService(CRUDServiceBase):
-    def __init__(self):
+    def __init__(self, use_index: bool = None):
         super().__init__(tutor_availabilityCRUD)
+        self.use_index = config.AVAILABILITY_INDEX_ENABLED if use_index is None else use_index
+        self.index = IntervalIndex()
+        self._index_generation = None
+        self._index_lock = threading.Lock()
+        if self.use_index:
+            on_commit(self._tablename)(self._refresh_index)
+
+    def search_availability(
+        self, db: Session, day: str, start_time: str, end_time: str, mode: str = "cover"
+    ) -> List:
+        """
+        Search the active availabilities matching a day and time range.
+        Served from the in-memory interval index when enabled, otherwise from the indexed SQL query.
+
+        Raises:
+            ValueError: if the day or one of the times cannot be parsed.
+        """
+        start, end = to_week_range(day, start_time, end_time)
+        try:
+            if not self.use_index:
+                return self.CRUD.read_by_week_range(db, start, end, mode=mode)
+            self._load_index(db)
+            ids = list(self.index.search(start, end, mode=mode))
+            if not ids:
+                return []
+            records = self.CRUD.read_by_filter(db, {self.CRUD.model.__tablename__ + "_id": ids})
+            return sorted(records, key=lambda record: record.start_minute)
+        except Exception as e:
+            warnings.warn(f"Failed to search {self._tablename} in the database")
+            raise e
+
+    def _load_index(self, db: Session):
+        """
+        (re)load the interval index from the database on first use, or when another worker
+        wrote to the table since it was loaded
+        """
+        if self._index_generation == cache.table_generation(self._tablename):
+            return
+        with self._index_lock:
+            generation = cache.table_generation(self._tablename)
+            if self._index_generation == generation:
+                return
+            index = IntervalIndex()
+            for record in self.CRUD.read_all(db):
+                if record.start_minute is not None:
+                    index.add(
+                        record.tutor_availability_id,
+                        record.start_minute,
+                        record.end_minute,
+                        record.tutor_profile_id,
+                    )
+            self.index = index
+            self._index_generation = generation
+
+    def _refresh_index(self, changes):
+        """apply the writes committed by this worker to the interval index"""
+        if self._index_generation is None:
+            return
+        generation = cache.table_generation(self._tablename)
+        for change in changes:
+            values = change.values
+            if (
+                change.operation == "delete"
+                or not values.get("is_active", True)
+                or values.get("start_minute") is None
+            ):
+                self.index.remove(change.primary_key)
+            else:
+                self.index.add(
+                    change.primary_key,
+                    values["start_minute"],
+                    values["end_minute"],
+                    values.get("tutor_profile_id"),
+                )
+        # only this commit bumped the generation: the index is still in sync,
+        # otherwise another worker wrote too and the index is reloaded on the next search
+        if generation == self._index_generation + 1:
+            self._index_generation = generation
         
 class TutorQualificationService(CRUDServiceBase):
     def __init__(self):
         super().__init__(tutor_qualificationCRUD)
         
 class TutorSubjectService(CRUDServiceBase):
+    # the tables the ranking is computed from
+    RANKING_TABLES = ("tutor_profile", "tutor_review", "tutor_subject")
+    # the columns of each table the ranking is computed from
+    RANKING_COLUMNS = {
+        "tutor_profile": ("is_active", "average_response_time", "experience_years"),
+        "tutor_review": ("is_active", "tutor_profile_id", "rating"),
+        "tutor_subject": ("is_active", "tutor_profile_id", "subject", "level", "price"),
+    }
+
     def __init__(self):
         super().__init__(tutor_subjectCRUD)
+        self.ranking = TutorRanking(config.RANKING_TOP_K)
+        # table -> cache generation the ranking is in sync with, None until it is built
+        self._ranking_generations: Optional[Dict[str, int]] = None
+        self._ranking_built_on = 0.0
+        self._ranking_lock = threading.Lock()
+        # guards the incremental updates, and the backlog of the commits made during a rebuild
+        self._ranking_changes_lock = threading.Lock()
+        self._ranking_backlog: Optional[List[List[Change]]] = None
+        on_commit(*self.RANKING_TABLES)(self._refresh_ranking)
+
+    def top(self, db: Session, subject: str, level: str, k: int = None) -> List[Tuple[Any, float]]:
+        """
+        The best ranked tutor subjects of a (subject, level), with their scores
+        (see app.utils.ranking.tutor_ranking), served from the in-memory ranking.
+
+        Returns:
+            List[Tuple[TutorSubject, float]]: At most k (and RANKING_TOP_K) records and scores, best first.
+        """
+        try:
+            self._load_ranking(db)
+            ranked = self.ranking.top(subject, level, k)
+            if not ranked:
+                return []
+            scores = dict(ranked)
+            records, _ = self.CRUD.read_many(db, list(scores))
+            return [(record, scores[record.tutor_subject_id]) for record in records]
+        except Exception as e:
+            warnings.warn(f"Failed to rank {self._tablename} from the database")
+            raise e
+
+    def _current_generations(self) -> Dict[str, int]:
+        return {tablename: cache.table_generation(tablename) for tablename in self.RANKING_TABLES}
+
+    def _load_ranking(self, db: Session):
+        """
+        build the ranking on first use, then rebuild it in the background when another worker
+        wrote to one of its tables since, or once it is older than RANKING_REBUILD_INTERVAL
+        (it keeps being served meanwhile)
+        """
+        if self._ranking_generations is None:
+            with self._ranking_lock:
+                if self._ranking_generations is None:
+                    self._rebuild_ranking(db)
+                    ranking_rebuilds.inc(trigger="initial")
+            return
+        if self._ranking_generations != self._current_generations():
+            trigger = "stale"
+        elif time.monotonic() - self._ranking_built_on > config.RANKING_REBUILD_INTERVAL:
+            trigger = "interval"
+        else:
+            return
+        # a rebuild already running picks the latest writes up (or is followed by another one)
+        if self._ranking_lock.acquire(blocking=False):
+            threading.Thread(
+                target=self._rebuild_ranking_in_background, args=(trigger,), name="tutor-ranking", daemon=True
+            ).start()
+
+    def _rebuild_ranking_in_background(self, trigger: str):
+        # holds _ranking_lock (taken by _load_ranking)
+        try:
+            with SessionLocal() as db:
+                self._rebuild_ranking(db)
+            ranking_rebuilds.inc(trigger=trigger)
+        except Exception as e:
+            warnings.warn(f"Failed to rebuild the tutor ranking: {e}")
+            # served as it is until the next interval
+            self._ranking_built_on = time.monotonic()
+        finally:
+            self._ranking_lock.release()
+
+    def _rebuild_ranking(self, db: Session):
+        """build a new ranking from the active rows, then replay the commits made meanwhile"""
+        with self._ranking_changes_lock:
+            self._ranking_backlog = []
+        try:
+            generations = self._current_generations()
+            ranking = TutorRanking(config.RANKING_TOP_K)
+            for profile in tutor_profileCRUD.read_all(db):
+                ranking.set_profile(profile.tutor_profile_id, profile.average_response_time, profile.experience_years)
+            for review in tutor_reviewCRUD.read_all(db):
+                ranking.set_review(review.tutor_review_id, review.tutor_profile_id, review.rating)
+            for subject in self.CRUD.read_all(db):
+                ranking.set_subject(
+                    subject.tutor_subject_id, subject.tutor_profile_id, subject.subject, subject.level, subject.price
+                )
+        except Exception:
+            with self._ranking_changes_lock:
+                self._ranking_backlog = None
+            raise
+        with self._ranking_changes_lock:
+            backlog, self._ranking_backlog = self._ranking_backlog, None
+            for changes in backlog:
+                # replays are idempotent: a commit already read by the rebuild changes nothing
+                self._apply_ranking_changes(ranking, changes)
+                generations[changes[0].tablename] += 1
+            self.ranking = ranking
+            # still behind the current generations if another worker wrote meanwhile: rebuilt again on the next read
+            self._ranking_generations = generations
+            self._ranking_built_on = time.monotonic()
+
+    def _refresh_ranking(self, changes: List[Change]):
+        """apply the writes committed by this worker to the ranking"""
+        if self._ranking_generations is None and self._ranking_backlog is None:
+            return
+        changes = self._complete_changes(changes)
+        with self._ranking_changes_lock:
+            if self._ranking_backlog is not None:
+                self._ranking_backlog.append(changes)
+            if self._ranking_generations is None:
+                return
+            tablename = changes[0].tablename
+            generation = cache.table_generation(tablename)
+            self._apply_ranking_changes(self.ranking, changes)
+            # as for the availability index: only in sync if no other worker wrote to the table
+            if generation == self._ranking_generations[tablename] + 1:
+                self._ranking_generations[tablename] = generation
+
+    def _complete_changes(self, changes: List[Change]) -> List[Change]:
+        """
+        the changes with the values of the current rows when a write did not load every
+        ranking column (e.g. an update of some columns of an expired object), so an entry is
+        never ranked under a missing subject or level
+        """
+        tablename = changes[0].tablename
+        columns = self.RANKING_COLUMNS[tablename]
+        incomplete = [
+            change
+            for change in changes
+            if change.operation != "delete" and any(column not in change.values for column in columns)
+        ]
+        if not incomplete:
+            return changes
+        model = {
+            "tutor_profile": tutor_profileCRUD.model,
+            "tutor_review": tutor_reviewCRUD.model,
+            "tutor_subject": self.CRUD.model,
+        }[tablename]
+        current = {}
+        # a session of its own on the primary: the write is committed, a read engine may lag
+        with SessionLocal() as db:
+            for change in incomplete:
+                row = db.get(model, change.primary_key)
+                if row is None:
+                    # deleted since: unranked
+                    current[change.primary_key] = Change("delete", tablename, change.primary_key, {})
+                else:
+                    values = {column: getattr(row, column) for column in columns}
+                    current[change.primary_key] = Change(change.operation, tablename, change.primary_key, values)
+        return [
+            change if change.operation == "delete" else current.get(change.primary_key, change)
+            for change in changes
+        ]
+
+    @staticmethod
+    def _apply_ranking_changes(ranking: TutorRanking, changes: List[Change]):
+        for change in changes:
+            values = change.values
+            active = change.operation != "delete" and values.get("is_active", True)
+            if change.tablename == "tutor_profile":
+                if active:
+                    ranking.set_profile(
+                        change.primary_key, values.get("average_response_time"), values.get("experience_years")
+                    )
+                else:
+                    ranking.remove_profile(change.primary_key)
+            elif change.tablename == "tutor_review":
+                if active:
+                    ranking.set_review(change.primary_key, values.get("tutor_profile_id"), values.get("rating"))
+                else:
+                    ranking.remove_review(change.primary_key)
+            elif active:
+                ranking.set_subject(
+                    change.primary_key,
+                    values.get("tutor_profile_id"),
+                    values.get("subject"),
+                    values.get("level"),
+                    values.get("price"),
+                )
+            else:
+                ranking.remove_subject(change.primary_key)
         
 class TutorReviewService(CRUDServiceBase):
     def __init__(self):
@@ -0,0 +1,98 @@
+"""
+In-memory interval index over minutes-of-week ranges.
+
+Intervals are registered in every fixed-size bucket they overlap. Availability slots
+are at most a day long, so each one lives in a handful of buckets and a query only
+inspects the buckets covering the query range. Adds and removes are O(buckets per
+interval), which keeps the index cheap to refresh incrementally from committed writes.
+"""
+
+import threading
+from typing import Dict, Hashable, List, Set, Tuple
+
+from app.utils.availability.minutes_of_week import (
+    MINUTES_PER_DAY,
+    MINUTES_PER_WEEK,
+    query_windows,
+)
+
+
+class IntervalIndex:
+    """
+    Bucketed interval index.
+
+    Args:
+        bucket_size (int, optional): Width of a bucket in minutes. Defaults to 60.
+        span (int, optional): Largest minute an interval may end at. Defaults to a week plus a day.
+    """
+
+    def __init__(self, bucket_size: int = 60, span: int = MINUTES_PER_WEEK + MINUTES_PER_DAY):
+        self.bucket_size = bucket_size
+        self._buckets: List[Set[Hashable]] = [set() for _ in range(span // bucket_size + 1)]
+        self._intervals: Dict[Hashable, Tuple[int, int, Hashable]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._intervals)
+
+    def _bucket_range(self, start: int, end: int) -> range:
+        last = min(max(end - 1, start) // self.bucket_size, len(self._buckets) - 1)
+        return range(max(start, 0) // self.bucket_size, last + 1)
+
+    def add(self, key: Hashable, start: int, end: int, value: Hashable):
+        """Add (or replace) the interval [start, end) identified by key"""
+        with self._lock:
+            self._remove(key)
+            self._intervals[key] = (start, end, value)
+            for bucket in self._bucket_range(start, end):
+                self._buckets[bucket].add(key)
+
+    def remove(self, key: Hashable):
+        """Remove the interval identified by key (no-op if absent)"""
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key: Hashable):
+        interval = self._intervals.pop(key, None)
+        if interval is None:
+            return
+        for bucket in self._bucket_range(interval[0], interval[1]):
+            self._buckets[bucket].discard(key)
+
+    def clear(self):
+        with self._lock:
+            for bucket in self._buckets:
+                bucket.clear()
+            self._intervals.clear()
+
+    def search(self, start: int, end: int, mode: str = "cover") -> Dict[Hashable, Hashable]:
+        """
+        Intervals matching the range [start, end).
+
+        Args:
+            start (int): Start of the query range in minutes of week.
+            end (int): End of the query range in minutes of week.
+            mode (str, optional): "cover" for intervals containing the whole range,
+                "overlap" for intervals intersecting it. Defaults to "cover".
+
+        Returns:
+            Dict: key -> value of the matching intervals.
+        """
+        results = {}
+        with self._lock:
+            for window_start, window_end in query_windows(start, end):
+                if mode == "cover":
+                    # a covering interval necessarily overlaps the first minute of the window
+                    buckets = self._bucket_range(window_start, window_start + 1)
+                else:
+                    buckets = self._bucket_range(window_start, window_end)
+                for bucket in buckets:
+                    for key in self._buckets[bucket]:
+                        interval_start, interval_end, value = self._intervals[key]
+                        if mode == "cover":
+                            match = interval_start <= window_start and interval_end >= window_end
+                        else:
+                            match = interval_start < window_end and interval_end > window_start
+                        if match:
+                            results[key] = value
+        return results
@@ -0,0 +1,94 @@
+"""
+Conversion of free-form availability strings (day, start time, end time) into
+minutes-of-week ranges: Monday 00:00 is minute 0 and Sunday 23:59 is minute 10079.
+
+Slots ending before their start time run overnight, so a range ends at most one day
+after the end of the week (MINUTES_PER_WEEK + MINUTES_PER_DAY). A slot ending at its
+start time is rejected rather than read as 24 hours long.
+"""
+
+import re
+from typing import Tuple
+
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+DAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+DAY_ALIASES = {
+    "mon": 0,
+    "tue": 1,
+    "tues": 1,
+    "wed": 2,
+    "thu": 3,
+    "thur": 3,
+    "thurs": 3,
+    "fri": 4,
+    "sat": 5,
+    "sun": 6,
+}
+
+TIME_PATTERN = re.compile(
+    r"^(?P<hour>\d{1,2})(?::?(?P<minute>\d{2}))?(?::\d{2})?\s*(?P<meridiem>am|pm)?$"
+)
+
+
+def parse_day(day: str) -> int:
+    """Index of a day of the week (monday = 0), accepts full names and common abbreviations"""
+    value = day.strip().lower()
+    if value in DAYS:
+        return DAYS.index(value)
+    if value in DAY_ALIASES:
+        return DAY_ALIASES[value]
+    raise ValueError(f"Unrecognised day '{day}'")
+
+
+def parse_time(time: str) -> int:
+    """Minutes since midnight of a time such as '17:00', '17:00:00', '1700', '5pm' or '5:30 pm'"""
+    match = TIME_PATTERN.match(time.strip().lower())
+    if match is None:
+        raise ValueError(f"Unrecognised time '{time}'")
+    hour = int(match.group("hour"))
+    minute = int(match.group("minute") or 0)
+    meridiem = match.group("meridiem")
+    if meridiem:
+        if not 1 <= hour <= 12:
+            raise ValueError(f"Unrecognised time '{time}'")
+        hour = hour % 12 + (12 if meridiem == "pm" else 0)
+    if hour == 24 and minute == 0:
+        return MINUTES_PER_DAY
+    if hour > 23 or minute > 59:
+        raise ValueError(f"Unrecognised time '{time}'")
+    return hour * 60 + minute
+
+
+def to_week_range(day: str, start_time: str, end_time: str) -> Tuple[int, int]:
+    """
+    Minutes-of-week range [start, end) of a slot.
+
+    Raises:
+        ValueError: if the day or one of the times cannot be parsed, or the slot is empty.
+    """
+    day_start = parse_day(day) * MINUTES_PER_DAY
+    start = parse_time(start_time)
+    end = parse_time(end_time)
+    if end < start:
+        # overnight slot
+        end += MINUTES_PER_DAY
+    if end == start:
+        raise ValueError(f"Empty time range '{start_time}' to '{end_time}'")
+    return day_start + start, day_start + end
+
+
+def query_windows(start: int, end: int):
+    """
+    Windows to match a query range against. Stored slots and queries can both run past the
+    end of the week (Sunday overnight): the query is also matched a week later (a Monday
+    query against Sunday overnight slots) and a week earlier (a Sunday overnight query
+    against Monday slots), where that lands on stored ranges.
+    """
+    windows = []
+    for shift in (0, MINUTES_PER_WEEK, -MINUTES_PER_WEEK):
+        if start + shift < MINUTES_PER_WEEK + MINUTES_PER_DAY and end + shift > 0:
+            windows.append((start + shift, end + shift))
+    return windows
@@ -0,0 +1,23 @@
+"""
+Process wide cache instance (see shared_cache.py)
+
+Set SHARED_CACHE_DIR to share the cache and its invalidations between worker processes, and
+with the job workers run by python -m app.utils.jobs (python -m app.serve and the jobs command
+both set it).
+"""
+
+import os
+
+from app import config
+from app.utils.cache.generations import GenerationCounters
+from app.utils.cache.shared_cache import SharedCache, entity_key, table_key
+
+
+if config.SHARED_CACHE_DIR:
+    cache = SharedCache(
+        GenerationCounters(os.path.join(config.SHARED_CACHE_DIR, "generations")),
+        path=os.path.join(config.SHARED_CACHE_DIR, "cache.db"),
+        max_entries=config.CACHE_MAX_ENTRIES,
+    )
+else:
+    cache = SharedCache(GenerationCounters(), max_entries=config.CACHE_MAX_ENTRIES)
@@ -0,0 +1,89 @@
+"""
+Generation counters shared between worker processes
+
+Each name (a table, a cache key...) hashes to a 64-bit counter slot in a memory mapped
+file. Readers compare the counter they saw when they cached something with the current
+one: reading a counter is a memory access, no syscall. Writers bump the counter under an
+exclusive file lock. Names sharing a slot only cause spurious invalidations.
+
+Without a directory the counters live in anonymous shared memory, which is only shared
+with processes forked after it was created.
+
+The last slot holds a random epoch, set when the counters are created: counters start
+again from 0 in a new file or process, so values derived from generations that outlive
+them (e.g. HTTP ETags) must include the epoch.
+"""
+
+import fcntl
+import mmap
+import os
+import secrets
+import struct
+import threading
+import zlib
+from typing import Optional
+
+
+SLOT = struct.Struct("<Q")
+
+
+class GenerationCounters:
+    """
+    Args:
+        path (str, optional): File backing the counters. Defaults to None (anonymous memory).
+        slots (int, optional): Number of counters. Defaults to 4096.
+    """
+
+    def __init__(self, path: Optional[str] = None, slots: int = 4096):
+        self.path = path
+        self.slots = slots
+        size = slots * SLOT.size
+        self._lock = threading.Lock()
+        if path is None:
+            self._fd = None
+            self._map = mmap.mmap(-1, size)
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            if os.fstat(self._fd).st_size < size:
+                os.ftruncate(self._fd, size)
+            self._map = mmap.mmap(self._fd, size)
+        self._init_epoch()
+
+    def _init_epoch(self):
+        offset = (self.slots - 1) * SLOT.size
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            if SLOT.unpack_from(self._map, offset)[0] == 0:
+                SLOT.pack_into(self._map, offset, secrets.randbits(63) + 1)
+        finally:
+            if self._fd is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    @property
+    def epoch(self) -> int:
+        """Random value identifying this set of counters"""
+        return SLOT.unpack_from(self._map, (self.slots - 1) * SLOT.size)[0]
+
+    def _offset(self, name: str) -> int:
+        # the last slot is the epoch
+        return (zlib.crc32(name.encode()) % (self.slots - 1)) * SLOT.size
+
+    def current(self, name: str) -> int:
+        """The current generation of a name"""
+        return SLOT.unpack_from(self._map, self._offset(name))[0]
+
+    def bump(self, name: str) -> int:
+        """Increment the generation of a name, returns the new generation"""
+        offset = self._offset(name)
+        with self._lock:
+            if self._fd is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                generation = SLOT.unpack_from(self._map, offset)[0] + 1
+                SLOT.pack_into(self._map, offset, generation)
+            finally:
+                if self._fd is not None:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+        return generation
@@ -0,0 +1,199 @@
+"""
+Two level cache shared between worker processes
+
+- L1: per process LRU dict.
+- L2 (when a cache directory is configured): an SQLite file every worker reads and writes.
+
+Entries are stamped with the generations of their key and of the tables they were built
+from. An entry is only served while all those generations are unchanged, so invalidating
+a key or committing a write to one of its tables (see app.database.events) invalidates it
+in every worker without having to reach into their memory.
+"""
+
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Iterable, Tuple
+
+from app.utils.cache.generations import GenerationCounters
+
+
+MISSING = object()
+
+
+def table_key(tablename: str) -> str:
+    return f"table:{tablename}"
+
+
+def entity_key(tablename: str, primary_key) -> str:
+    """Key of the data cached for a single row (invalidated by the commits writing that row)"""
+    return f"entity:{tablename}:{primary_key}"
+
+
+class SharedCache:
+    """
+    Args:
+        generations (GenerationCounters): The counters used to validate entries.
+        path (str, optional): SQLite file of the L2 tier. Defaults to None (L1 only).
+        max_entries (int, optional): Size of the L1 LRU. Defaults to 10000.
+    """
+
+    def __init__(self, generations: GenerationCounters, path: str = None, max_entries: int = 10000):
+        self.generations = generations
+        self.path = path
+        self.max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        if path is not None:
+            self._connection().execute(
+                "CREATE TABLE IF NOT EXISTS cache_entry ("
+                "key TEXT PRIMARY KEY, value BLOB, stamp BLOB, expires_on REAL)"
+            )
+
+    @property
+    def shared(self) -> bool:
+        """Whether the generations are seen by every process using the same directory"""
+        return self.generations.path is not None
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None or getattr(self._local, "pid", None) != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=OFF")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def stamp(
+        self, key: str, tables: Iterable[str] = (), entities: Iterable[Tuple[str, Any]] = ()
+    ) -> Tuple[int, ...]:
+        """
+        Generations an entry depends on: its key, the tables and the (tablename, primary key)
+        rows it was built from. Take the stamp before reading the data to cache so that a write
+        committed while it is built invalidates it.
+        """
+        names = (
+            [key]
+            + [table_key(tablename) for tablename in tables]
+            + [entity_key(tablename, primary_key) for tablename, primary_key in entities]
+        )
+        return tuple(self.generations.current(name) for name in names)
+
+    def get(
+        self,
+        key: str,
+        tables: Iterable[str] = (),
+        default: Any = None,
+        entities: Iterable[Tuple[str, Any]] = (),
+    ) -> Any:
+        """The cached value of key, or default if it is missing, expired or invalidated"""
+        stamp = self.stamp(key, tables, entities)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, entry_stamp, expires_on = entry
+                if entry_stamp == stamp and (expires_on is None or expires_on > now):
+                    self._entries.move_to_end(key)
+                    return value
+                del self._entries[key]
+
+        if self.path is None:
+            return default
+        row = self._connection().execute(
+            "SELECT value, stamp, expires_on FROM cache_entry WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return default
+        value, entry_stamp, expires_on = row
+        if pickle.loads(entry_stamp) != stamp or (expires_on is not None and expires_on <= now):
+            return default
+        value = pickle.loads(value)
+        self._store_local(key, value, stamp, expires_on)
+        return value
+
+    def set(
+        self,
+        key: str,
+        value: Any,
+        tables: Iterable[str] = (),
+        ttl: float = None,
+        stamp: Tuple[int, ...] = None,
+        entities: Iterable[Tuple[str, Any]] = (),
+    ):
+        """
+        Cache a value.
+
+        Args:
+            key (str): The cache key.
+            value (Any): A picklable value.
+            tables (Iterable[str], optional): Tables the value was built from.
+            ttl (float, optional): Lifetime in seconds. Defaults to None (until invalidated).
+            stamp (Tuple[int, ...], optional): The stamp taken before building the value.
+                Defaults to the current one.
+            entities (Iterable[Tuple[str, Any]], optional): (tablename, primary key) of the
+                rows the value was built from.
+        """
+        stamp = stamp if stamp is not None else self.stamp(key, tables, entities)
+        expires_on = time.time() + ttl if ttl is not None else None
+        self._store_local(key, value, stamp, expires_on)
+        if self.path is not None:
+            self._connection().execute(
+                "INSERT OR REPLACE INTO cache_entry (key, value, stamp, expires_on) VALUES (?, ?, ?, ?)",
+                (key, pickle.dumps(value), pickle.dumps(stamp), expires_on),
+            )
+
+    def get_or_set(
+        self,
+        key: str,
+        factory: Callable[[], Any],
+        tables: Iterable[str] = (),
+        ttl: float = None,
+        entities: Iterable[Tuple[str, Any]] = (),
+    ) -> Any:
+        """The cached value of key, built with factory() and cached if missing"""
+        tables, entities = tuple(tables), tuple(entities)
+        stamp = self.stamp(key, tables, entities)
+        value = self.get(key, tables, default=MISSING, entities=entities)
+        if value is not MISSING:
+            return value
+        value = factory()
+        self.set(key, value, tables, ttl=ttl, stamp=stamp)
+        return value
+
+    def invalidate(self, key: str) -> int:
+        """Invalidate a key in every worker"""
+        with self._lock:
+            self._entries.pop(key, None)
+        return self.generations.bump(key)
+
+    def invalidate_table(self, tablename: str) -> int:
+        """Invalidate every entry built from a table in every worker"""
+        return self.generations.bump(table_key(tablename))
+
+    def table_generation(self, tablename: str) -> int:
+        return self.generations.current(table_key(tablename))
+
+    def invalidate_entity(self, tablename: str, primary_key) -> int:
+        """Invalidate the entries of a row in every worker"""
+        return self.invalidate(entity_key(tablename, primary_key))
+
+    def clear(self):
+        """Drop the entries of this worker (and the L2 tier)"""
+        with self._lock:
+            self._entries.clear()
+        if self.path is not None:
+            self._connection().execute("DELETE FROM cache_entry")
+
+    def _store_local(self, key, value, stamp, expires_on):
+        with self._lock:
+            self._entries[key] = (value, stamp, expires_on)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
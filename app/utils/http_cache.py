@@ -0,0 +1,80 @@
+"""
+HTTP conditional requests
+
+Helpers to set ETag / Last-Modified on responses and to answer If-None-Match /
+If-Modified-Since with 304 Not Modified. If-None-Match takes precedence over
+If-Modified-Since (RFC 9110 13.2.2) and ETags are compared weakly, as required for GET.
+"""
+
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional
+
+from fastapi import Request, Response
+
+
+CACHE_CONTROL = "no-cache"
+# content addressed resources never change: cached for a year without revalidation
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+def http_date(moment: datetime) -> str:
+    """Format a naive UTC (or aware) datetime as an HTTP date"""
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return format_datetime(moment.astimezone(timezone.utc), usegmt=True)
+
+
+def _opaque(etag: str) -> str:
+    etag = etag.strip()
+    return etag[2:] if etag.startswith("W/") else etag
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    """Weak comparison of an ETag with an If-None-Match header"""
+    if header.strip() == "*":
+        return True
+    opaque = _opaque(etag)
+    return any(_opaque(candidate) == opaque for candidate in header.split(","))
+
+
+def is_not_modified(request: Request, etag: Optional[str], last_modified: Optional[datetime]) -> bool:
+    """Whether the client copy validated by the request headers is still current"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag is not None and etag_matches(if_none_match, etag)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        modified = last_modified if last_modified.tzinfo else last_modified.replace(tzinfo=timezone.utc)
+        # HTTP dates have a one second resolution
+        return modified.replace(microsecond=0) <= since
+    return False
+
+
+def set_validators(
+    response: Response,
+    etag: Optional[str],
+    last_modified: Optional[datetime] = None,
+    cache_control: str = CACHE_CONTROL,
+):
+    """Add the validators (and a revalidation Cache-Control by default) to a response"""
+    if etag is not None:
+        response.headers["ETag"] = etag
+    if last_modified is not None:
+        response.headers["Last-Modified"] = http_date(last_modified)
+    response.headers["Cache-Control"] = cache_control
+
+
+def not_modified(
+    etag: Optional[str], last_modified: Optional[datetime] = None, cache_control: str = CACHE_CONTROL
+) -> Response:
+    """A 304 response carrying the current validators"""
+    response = Response(status_code=304)
+    set_validators(response, etag, last_modified, cache_control)
+    return response
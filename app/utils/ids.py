@@ -0,0 +1,55 @@
+"""
+Time ordered ids
+
+UUIDv7 (RFC 9562): a 48 bit unix timestamp in milliseconds, then a 12 bit counter and 62
+random bits. Ids generated later sort after the earlier ones (as text and as bytes), so new
+rows are appended to the right of the primary key indexes instead of splitting random pages,
+and the ids stay valid UUIDs (same 36 character text as uuid4).
+
+Within a millisecond the counter is incremented, so the ids of a process are strictly
+increasing; the random bits keep the ids of different processes unique.
+"""
+
+import os
+import threading
+import time
+from uuid import UUID
+
+
+_lock = threading.Lock()
+_last_millisecond = 0
+_counter = 0
+
+COUNTER_BITS = 12
+RANDOM_BITS = 62
+
+
+def uuid7() -> UUID:
+    """A new time ordered UUID (version 7)"""
+    global _last_millisecond, _counter
+    millisecond = time.time_ns() // 1_000_000
+    with _lock:
+        if millisecond > _last_millisecond:
+            # start low in the counter range: leaves room for the ids of this millisecond
+            _counter = int.from_bytes(os.urandom(2), "big") >> (16 - COUNTER_BITS + 1)
+            _last_millisecond = millisecond
+        else:
+            _counter += 1
+            if _counter >> COUNTER_BITS:
+                # counter overflow (or the clock went back): borrow the next millisecond
+                _counter = 0
+                _last_millisecond += 1
+        millisecond, counter = _last_millisecond, _counter
+    random = int.from_bytes(os.urandom(8), "big") >> (64 - RANDOM_BITS)
+    value = millisecond << 80 | 0x7 << 76 | counter << 64 | 0b10 << 62 | random
+    return UUID(int=value)
+
+
+def new_id() -> str:
+    """A new primary key: a time ordered UUID as text"""
+    return str(uuid7())
+
+
+def id_time(id: str) -> float:
+    """The creation time (unix seconds) of a uuid7 id"""
+    return (UUID(id).int >> 80) / 1000
@@ -0,0 +1,90 @@
+"""
+Background jobs (see queue.py and runner.py)
+
+Work that does not have to happen in the request (aggregate refreshes, index maintenance,
+cascading soft deletes of large trees, notifications...) is enqueued as a job and run by the
+job workers: in the API process when JOBS_WORKERS > 0 (started with the app), or in a
+separate process with
+    python -m app.utils.jobs --workers 4
+
+The queue file is only created when it is first used.
+"""
+
+import warnings
+from typing import List
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app import config
+from app.utils import metrics
+from app.utils.jobs.queue import DONE, FAILED, HELD, QUEUED, RUNNING, Job, JobQueue, LeaseLost
+from app.utils.jobs.runner import JobRunner, job
+
+
+job_queue = JobQueue(
+    config.JOBS_DB_PATH,
+    visibility_timeout=config.JOBS_VISIBILITY_TIMEOUT,
+    max_attempts=config.JOBS_MAX_ATTEMPTS,
+    backoff_base=config.JOBS_BACKOFF_BASE,
+    backoff_max=config.JOBS_BACKOFF_MAX,
+)
+runner = JobRunner(job_queue, workers=config.JOBS_WORKERS, poll_interval=config.JOBS_POLL_INTERVAL)
+
+metrics.Gauge(
+    "jobs_queue_depth",
+    "Jobs in the queue by status",
+    callback=lambda: [({"status": status}, count) for status, count in job_queue.depth().items()],
+)
+
+HELD_JOBS = "held_jobs"
+WRITTEN = "written"
+
+
+def _has_writes(db: Session) -> bool:
+    """db has writes that are not committed yet (pending or flushed)"""
+    return bool(db.new or db.dirty or db.deleted or db.info.get(WRITTEN))
+
+
+def enqueue(name: str, db: Session = None, **options) -> int:
+    """
+    Enqueue a job (options are the JobQueue.enqueue arguments).
+    If db has writes that are not committed yet, the job is held until they commit (and
+    discarded if they do not), so jobs never run for writes that did not happen. Otherwise,
+    e.g. in the transaction a read-only session autobegins, it is enqueued right away.
+
+    Returns:
+        int: The job id.
+    """
+    if db is not None and _has_writes(db):
+        job_id = job_queue.enqueue(name, held=True, **options)
+        db.info.setdefault(HELD_JOBS, []).append(job_id)
+        return job_id
+    job_id = job_queue.enqueue(name, **options)
+    runner.wake()
+    return job_id
+
+
+@event.listens_for(Session, "after_flush")
+def _record_writes(session, flush_context):
+    session.info[WRITTEN] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _release_held_jobs(session):
+    held: List[int] = session.info.pop(HELD_JOBS, None)
+    if held:
+        job_queue.release(held)
+        runner.wake()
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _discard_held_jobs(session, transaction):
+    if transaction.parent is not None:
+        return
+    session.info.pop(WRITTEN, None)
+    # still held: the transaction rolled back or the session was closed without a commit
+    held: List[int] = session.info.pop(HELD_JOBS, None)
+    if held:
+        job_queue.discard(held)
+        warnings.warn(f"Discarded the jobs {held}: the transaction of their writes did not commit")
@@ -0,0 +1,47 @@
+"""
+Run job workers outside of the API processes:
+    python -m app.utils.jobs --workers 4
+
+The jobs write to the database, so they share the cache tier of the API (the same
+--cache-dir as python -m app.serve): their commits invalidate the API's cached entries and
+validators.
+"""
+
+import argparse
+import os
+import signal
+import threading
+
+from app import config
+from app.utils.jobs import job_queue, runner
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the background job workers")
+    parser.add_argument("--workers", type=int, default=max(config.JOBS_WORKERS, 1))
+    parser.add_argument("--cache-dir", default=config.SHARED_CACHE_DIR or config.DEFAULT_SHARED_CACHE_DIR)
+    args = parser.parse_args()
+
+    # before the cache is built (on the first import of the modules using it)
+    os.environ["SHARED_CACHE_DIR"] = config.SHARED_CACHE_DIR = args.cache_dir
+    import app.services.crud_service_base  # noqa: F401 - registers the jobs of the services
+    import app.database.backup  # noqa: F401 - registers the scheduled snapshots
+    import app.database.archive  # noqa: F401 - registers the message archive
+    from app.utils.cache import cache
+
+    if not cache.shared:
+        # the API would keep serving what the jobs change
+        raise SystemExit("the job workers need the shared cache tier: set SHARED_CACHE_DIR or --cache-dir")
+
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopped.set())
+    signal.signal(signal.SIGINT, lambda *_: stopped.set())
+    job_queue.purge(config.JOBS_RETENTION_DAYS * 86400)
+    runner.workers = args.workers
+    runner.start()
+    stopped.wait()
+    runner.stop()
+
+
+if __name__ == "__main__":
+    main()
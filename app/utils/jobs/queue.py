@@ -0,0 +1,252 @@
+"""
+Persistent job queue in an SQLite file
+
+Jobs are rows of the `job` table. A worker claims the ready job with the highest priority
+in an immediate transaction, which marks it running and hides it from the other workers
+(in any process) until its visibility timeout. A job that is not completed or failed
+before the timeout (e.g. its worker died) becomes claimable again.
+
+The claim is a lease: a worker only completes or fails a job while it still holds it (the
+job was not claimed again after the timeout), otherwise LeaseLost is raised.
+
+Failed jobs are retried with exponential backoff until max_attempts, then kept as "failed".
+Held jobs are enqueued but not claimable until released (or discarded), e.g. until the
+transaction that requested them commits.
+"""
+
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, NamedTuple, Optional
+
+
+HELD = "held"
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class LeaseLost(Exception):
+    """The visibility timeout of a claimed job expired and it was claimed again"""
+
+
+class Job(NamedTuple):
+    job_id: int
+    name: str
+    payload: Dict[str, Any]
+    priority: int
+    attempts: int
+    max_attempts: int
+    enqueued_on: float
+
+
+class JobQueue:
+    """
+    Args:
+        path (str): SQLite file of the queue.
+        visibility_timeout (float, optional): Seconds a claimed job stays hidden from other workers.
+        max_attempts (int, optional): Default number of attempts of a job.
+        backoff_base (float, optional): Delay before the first retry, doubled on every attempt.
+        backoff_max (float, optional): Maximum delay between attempts.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        visibility_timeout: float = 60,
+        max_attempts: int = 5,
+        backoff_base: float = 1,
+        backoff_max: float = 300,
+    ):
+        self.path = path
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        # opened (and the file created) on first use, not when the queue is constructed
+        connection = getattr(self._local, "connection", None)
+        if connection is None or getattr(self._local, "pid", None) != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS job (
+                    job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    priority INTEGER NOT NULL DEFAULT 0,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    max_attempts INTEGER NOT NULL,
+                    -- queued: earliest start, running: end of the visibility timeout
+                    run_after REAL NOT NULL,
+                    enqueued_on REAL NOT NULL,
+                    started_on REAL,
+                    finished_on REAL,
+                    last_error TEXT
+                );
+                CREATE INDEX IF NOT EXISTS ix_job_ready ON job (status, priority, run_after);
+                """
+            )
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def enqueue(
+        self,
+        name: str,
+        payload: Dict[str, Any] = None,
+        priority: int = 0,
+        delay: float = 0,
+        max_attempts: int = None,
+        held: bool = False,
+    ) -> int:
+        """
+        Add a job to the queue.
+
+        Args:
+            name (str): The registered job to run.
+            payload (Dict[str, Any], optional): JSON serialisable keyword arguments of the job.
+            priority (int, optional): Jobs with a higher priority are claimed first. Defaults to 0.
+            delay (float, optional): Seconds before the job can start. Defaults to 0.
+            max_attempts (int, optional): Defaults to the queue max_attempts.
+            held (bool, optional): Not claimable until released. Defaults to False.
+
+        Returns:
+            int: The job id.
+        """
+        now = time.time()
+        cursor = self._connection().execute(
+            "INSERT INTO job (name, payload, priority, status, max_attempts, run_after, enqueued_on) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                name,
+                json.dumps(payload or {}, default=str),
+                priority,
+                HELD if held else QUEUED,
+                max_attempts or self.max_attempts,
+                now + delay,
+                now,
+            ),
+        )
+        return cursor.lastrowid
+
+    def claim(self) -> Optional[Job]:
+        """Claim the next ready job (or a running job whose visibility timeout expired)"""
+        connection = self._connection()
+        now = time.time()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute(
+                "SELECT job_id, name, payload, priority, attempts, max_attempts, enqueued_on FROM job "
+                "WHERE status IN (?, ?) AND run_after <= ? "
+                "ORDER BY priority DESC, run_after LIMIT 1",
+                (QUEUED, RUNNING, now),
+            ).fetchone()
+            if row is None:
+                connection.execute("COMMIT")
+                return None
+            connection.execute(
+                "UPDATE job SET status = ?, attempts = attempts + 1, run_after = ?, started_on = ? "
+                "WHERE job_id = ?",
+                (RUNNING, now + self.visibility_timeout, now, row[0]),
+            )
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        job_id, name, payload, priority, attempts, max_attempts, enqueued_on = row
+        return Job(job_id, name, json.loads(payload), priority, attempts + 1, max_attempts, enqueued_on)
+
+    def release(self, job_ids: List[int]):
+        """Make held jobs claimable"""
+        self._connection().executemany(
+            "UPDATE job SET status = ? WHERE job_id = ? AND status = ?",
+            [(QUEUED, job_id, HELD) for job_id in job_ids],
+        )
+
+    def discard(self, job_ids: List[int]):
+        """Delete held jobs"""
+        self._connection().executemany(
+            "DELETE FROM job WHERE job_id = ? AND status = ?", [(job_id, HELD) for job_id in job_ids]
+        )
+
+    def _finish(self, job: Job, query: str, parameters: tuple):
+        # only the worker holding the lease (the claim of this attempt) records its outcome
+        cursor = self._connection().execute(
+            query + " WHERE job_id = ? AND status = ? AND attempts = ?",
+            parameters + (job.job_id, RUNNING, job.attempts),
+        )
+        if cursor.rowcount == 0:
+            raise LeaseLost(f"job {job.job_id} was claimed again after its visibility timeout")
+
+    def complete(self, job: Job):
+        self._finish(
+            job, "UPDATE job SET status = ?, finished_on = ?, last_error = NULL", (DONE, time.time())
+        )
+
+    def fail(self, job: Job, error: str) -> bool:
+        """
+        Record a failed attempt: the job is retried after a backoff until it has used its
+        attempts. Returns True if it will be retried.
+        """
+        now = time.time()
+        if job.attempts >= job.max_attempts:
+            self._finish(
+                job, "UPDATE job SET status = ?, finished_on = ?, last_error = ?", (FAILED, now, error)
+            )
+            return False
+        delay = min(self.backoff_base * 2 ** (job.attempts - 1), self.backoff_max)
+        # jitter so that jobs failing together do not retry together
+        delay *= random.uniform(0.5, 1)
+        self._finish(
+            job, "UPDATE job SET status = ?, run_after = ?, last_error = ?", (QUEUED, now + delay, error)
+        )
+        return True
+
+    def depth(self) -> Dict[str, int]:
+        """Number of jobs per status"""
+        rows = self._connection().execute("SELECT status, count(*) FROM job GROUP BY status").fetchall()
+        return dict(rows)
+
+    def list(self, status: str = None, limit: int = 100) -> List[Dict[str, Any]]:
+        """The most recent jobs, optionally with a given status"""
+        query = "SELECT * FROM job"
+        parameters: tuple = ()
+        if status is not None:
+            query += " WHERE status = ?"
+            parameters = (status,)
+        cursor = self._connection().execute(query + " ORDER BY job_id DESC LIMIT ?", parameters + (limit,))
+        columns = [column[0] for column in cursor.description]
+        jobs = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        for job in jobs:
+            job["payload"] = json.loads(job["payload"])
+        return jobs
+
+    def retry(self, job_id: int) -> bool:
+        """Queue a failed job again with a fresh set of attempts"""
+        cursor = self._connection().execute(
+            "UPDATE job SET status = ?, attempts = 0, run_after = ?, finished_on = NULL "
+            "WHERE job_id = ? AND status = ?",
+            (QUEUED, time.time(), job_id, FAILED),
+        )
+        return cursor.rowcount > 0
+
+    def purge(self, older_than: float) -> int:
+        """
+        Delete the jobs that finished (done or failed) more than older_than seconds ago, and
+        the jobs held for as long (their process died before releasing them)
+        """
+        cursor = self._connection().execute(
+            "DELETE FROM job WHERE (status IN (?, ?) AND finished_on < ?) OR (status = ? AND enqueued_on < ?)",
+            (DONE, FAILED, time.time() - older_than, HELD, time.time() - older_than),
+        )
+        return cursor.rowcount
@@ -0,0 +1,125 @@
+"""
+Worker threads running the jobs of a JobQueue
+
+Jobs are registered by name with the `job` decorator. A job is called with a fresh
+database session and the keyword arguments of its payload, and is responsible for
+committing its own work:
+
+    @job("refresh_tutor_rating")
+    def refresh_tutor_rating(db, tutor_profile_id): ...
+
+Every worker process can run a JobRunner on the same queue file: claims are atomic, so a
+job runs in a single worker at a time.
+"""
+
+import threading
+import time
+import traceback
+import warnings
+from typing import Callable, Dict, List, Optional
+
+from app.database.database import SessionLocal
+from app.utils import metrics
+from app.utils.jobs.queue import Job, JobQueue, LeaseLost
+
+
+_jobs: Dict[str, Callable] = {}
+
+
+def job(name: str):
+    """Register a job handler under a name"""
+
+    def decorator(handler):
+        _jobs[name] = handler
+        return handler
+
+    return decorator
+
+
+jobs_processed = metrics.Counter("jobs_processed_total", "Jobs run by outcome (done, retried, failed, lost)")
+job_duration = metrics.Histogram("job_duration_seconds", "Time spent running a job")
+job_latency = metrics.Histogram(
+    "job_latency_seconds", "Time from enqueue to completion of a job", buckets=metrics.DEFAULT_BUCKETS + (300, 900, 3600)
+)
+
+
+class JobRunner:
+    """
+    Args:
+        queue (JobQueue): The queue to consume.
+        workers (int, optional): Number of worker threads. Defaults to 2.
+        poll_interval (float, optional): Seconds an idle worker sleeps between claims. Defaults to 0.5.
+    """
+
+    def __init__(self, queue: JobQueue, workers: int = 2, poll_interval: float = 0.5):
+        self.queue = queue
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._threads: List[threading.Thread] = []
+        self._stopping = threading.Event()
+        self._wake = threading.Event()
+
+    def start(self):
+        if self._threads:
+            return
+        self._stopping.clear()
+        self._threads = [
+            threading.Thread(target=self._work, name=f"job-worker-{index}", daemon=True)
+            for index in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout: float = None):
+        """Stop the workers after their current job"""
+        self._stopping.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def wake(self):
+        """Make idle workers poll immediately (after an enqueue)"""
+        self._wake.set()
+
+    def _work(self):
+        while not self._stopping.is_set():
+            try:
+                claimed = self.queue.claim()
+            except Exception as e:
+                warnings.warn(f"Failed to claim a job: {e}")
+                claimed = None
+            if claimed is None:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+                continue
+            self.run(claimed)
+
+    def run(self, claimed: Job) -> bool:
+        """Run a claimed job and record its outcome; returns True if it succeeded"""
+        handler: Optional[Callable] = _jobs.get(claimed.name)
+        started = time.perf_counter()
+        try:
+            try:
+                if handler is None:
+                    raise LookupError(f"no job registered as {claimed.name}")
+                with SessionLocal() as db:
+                    handler(db, **claimed.payload)
+            except Exception as e:
+                error = "".join(traceback.format_exception_only(type(e), e)).strip()
+                retried = self.queue.fail(claimed, error)
+                jobs_processed.inc(job=claimed.name, outcome="retried" if retried else "failed")
+                if not retried:
+                    warnings.warn(f"Job {claimed.name} ({claimed.job_id}) failed: {error}")
+                return False
+            finally:
+                job_duration.observe(time.perf_counter() - started, job=claimed.name)
+            self.queue.complete(claimed)
+        except LeaseLost as e:
+            # the job ran for longer than the visibility timeout: its new owner records the outcome
+            jobs_processed.inc(job=claimed.name, outcome="lost")
+            warnings.warn(f"Job {claimed.name} ({claimed.job_id}): {e}")
+            return False
+        jobs_processed.inc(job=claimed.name, outcome="done")
+        job_latency.observe(time.time() - claimed.enqueued_on, job=claimed.name)
+        return True
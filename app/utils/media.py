@@ -0,0 +1,199 @@
+"""
+Content addressed media storage
+
+Uploaded images are streamed to a temporary file chunk by chunk (never held in memory),
+hashed on the way, and moved to MEDIA_DIR/<sha256[:2]>/<sha256>.<ext>: the same content is
+stored once whoever uploads it, and a stored file never changes, so it is served with a one
+year immutable Cache-Control. The type is taken from the magic bytes of the content, not
+from the request headers.
+
+Thumbnails (longest side of each MEDIA_THUMBNAIL_SIZES) are made with Pillow in a process
+pool, off the event loop and out of the GIL, and stored as
+MEDIA_DIR/thumbnails/<size>/<sha256[:2]>/<sha256>.<ext>. They need Pillow: the application
+refuses to start without it unless MEDIA_THUMBNAIL_SIZES is empty.
+"""
+
+import asyncio
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, Dict, List, NamedTuple, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from app import config
+from app.utils import metrics
+
+try:
+    from PIL import Image
+except ImportError:  # only needed for thumbnails (see check)
+    Image = None
+
+
+CONTENT_TYPES = {"jpg": "image/jpeg", "png": "image/png", "gif": "image/gif", "webp": "image/webp"}
+ASSET_NAME = re.compile(r"[0-9a-f]{64}\.(jpg|png|gif|webp)")
+# bytes of the content needed to recognise its type
+HEAD_SIZE = 12
+
+uploads = metrics.Counter("media_uploads_total", "Uploaded media by result (created, deduplicated, rejected)")
+
+
+class MediaError(ValueError):
+    """An upload that is not a supported image"""
+
+
+class MediaTooLarge(MediaError):
+    """An upload larger than MEDIA_MAX_BYTES"""
+
+
+class Asset(NamedTuple):
+    """A stored upload"""
+
+    name: str  # <sha256>.<ext>
+    size: int
+    content_type: str
+    created: bool  # False when the same content was already stored
+    thumbnails: Tuple[int, ...]
+
+
+def sniff(head: bytes) -> Optional[str]:
+    """The extension of an image from its first bytes, None if it is not a supported image"""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "jpg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if head.startswith((b"GIF87a", b"GIF89a")):
+        return "gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+def asset_path(name: str, size: int = None) -> str:
+    """The path of a stored asset, or of one of its thumbnails"""
+    if size is None:
+        return os.path.join(config.MEDIA_DIR, name[:2], name)
+    return os.path.join(config.MEDIA_DIR, "thumbnails", str(size), name[:2], name)
+
+
+def check():
+    """
+    Raises:
+        RuntimeError: if thumbnails are configured (MEDIA_THUMBNAIL_SIZES) without Pillow.
+    """
+    if Image is None and config.MEDIA_THUMBNAIL_SIZES:
+        raise RuntimeError(
+            "Pillow is needed for the media thumbnails: install it, or set MEDIA_THUMBNAIL_SIZES= to disable them"
+        )
+
+
+def find(name: str, size: int = None) -> Optional[str]:
+    """The file of an asset (or of its thumbnail of a size), None if not stored"""
+    if not ASSET_NAME.fullmatch(name):
+        return None
+    path = asset_path(name, size)
+    return path if os.path.exists(path) else None
+
+
+async def store(chunks: AsyncIterator[bytes]) -> Asset:
+    """
+    Store an upload from the chunks of its body and make its thumbnails.
+
+    Raises:
+        MediaTooLarge: if the body is larger than MEDIA_MAX_BYTES.
+        MediaError: if it is not a jpeg, png, gif or webp image.
+    """
+    temporary = os.path.join(config.MEDIA_DIR, "tmp")
+    os.makedirs(temporary, exist_ok=True)
+    descriptor, partial = tempfile.mkstemp(dir=temporary)
+    digest = hashlib.sha256()
+    size = 0
+    head = b""
+    try:
+        with os.fdopen(descriptor, "wb") as file:
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > config.MEDIA_MAX_BYTES:
+                    raise MediaTooLarge(f"more than {config.MEDIA_MAX_BYTES} bytes")
+                if len(head) < HEAD_SIZE:
+                    head += chunk[: HEAD_SIZE - len(head)]
+                digest.update(chunk)
+                # a write can block on a slow or busy disk: off the event loop
+                await run_in_threadpool(file.write, chunk)
+        extension = sniff(head)
+        if extension is None:
+            raise MediaError("not a jpeg, png, gif or webp image")
+        name = f"{digest.hexdigest()}.{extension}"
+        path = asset_path(name)
+        created = not os.path.exists(path)
+        if created:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # atomic: a stored file is never seen partially written
+            os.replace(partial, path)
+    except MediaError:
+        uploads.inc(result="rejected")
+        raise
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+    uploads.inc(result="created" if created else "deduplicated")
+    thumbnails = await make_thumbnails(name)
+    return Asset(name, size, CONTENT_TYPES[extension], created, thumbnails)
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _thumbnail_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=config.MEDIA_THUMBNAIL_WORKERS)
+        return _pool
+
+
+def shutdown():
+    """Stop the thumbnail processes"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True)
+            _pool = None
+
+
+def _make_thumbnails(path: str, targets: Dict[int, str]) -> List[int]:
+    """Resize an image to each size (longest side, never upscaled): runs in the pool"""
+    made = []
+    with Image.open(path) as image:
+        for size, target in targets.items():
+            thumbnail = image.copy()
+            thumbnail.thumbnail((size, size))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            partial = f"{target}.{os.getpid()}.tmp"
+            thumbnail.save(partial, format=image.format)
+            os.replace(partial, target)
+            made.append(size)
+    return made
+
+
+async def make_thumbnails(name: str) -> Tuple[int, ...]:
+    """Make the missing thumbnails of a stored asset, returns the sizes available"""
+    if Image is None:
+        return ()
+    sizes = config.MEDIA_THUMBNAIL_SIZES
+    targets = {size: asset_path(name, size) for size in sizes if not os.path.exists(asset_path(name, size))}
+    available = [size for size in sizes if size not in targets]
+    if targets:
+        try:
+            available += await asyncio.get_running_loop().run_in_executor(
+                _thumbnail_pool(), _make_thumbnails, asset_path(name), targets
+            )
+        except Exception as e:
+            # a corrupt image: stored, served without thumbnails
+            warnings.warn(f"Could not make the thumbnails of {name}: {e}")
+    return tuple(sorted(available))
@@ -13,6 +13,14 @@ class ErrorMessageConstants:
     UNAUTHORISED_ACCESS = "Unauthorised access to the resource."
     RESOURCE_NOT_FOUND = "Resource not found."
     CONFLICT_ERROR = "Conflict occurred while processing the request. Please refresh and try again."
+    SERVER_BUSY = "The server is busy. Please try again later."
+    RATE_LIMITED = "Too many requests. Please try again later."
+    TOO_MANY_IDS = "Too many ids: at most {} can be read at once."
+    INVALID_FILTER = "Invalid filter: {}"
+    IDS_NOT_COMBINABLE = "ids cannot be combined with {}."
+    UNSUPPORTED_MEDIA = "Unsupported media: {}"
+    MEDIA_TOO_LARGE = "The upload exceeds the maximum size of {} bytes."
+    BACKUP_FAILED = "Backup failed: {}"
     
     
     # User
@@ -22,4 +30,8 @@ class ErrorMessageConstants:
     USER_UPDATE_FAILED = "User update failed."
     USER_DELETE_FAILED = "User deletion failed."
     USER_READ_FAILED = "User read failed."
-    USER_READ_ALL_FAILED = "Failed to read all users."
\ No newline at end of file
+    USER_READ_ALL_FAILED = "Failed to read all users."
+    
+    
+    # Tutor
+    INVALID_AVAILABILITY = "Invalid availability: {}"
@@ -0,0 +1,121 @@
+"""
+Process metrics in the Prometheus text format
+
+Counters, gauges and histograms are registered in a module level registry and rendered
+by `render()` (served by the admin router at /admin/metrics). Gauges can be given a
+callback that is evaluated at scrape time. Metrics are per worker process.
+"""
+
+import bisect
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_registry: List["Metric"] = []
+
+
+def _labels(labels: Dict[str, str]) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format(name: str, labels: Iterable[Tuple[str, str]], value) -> str:
+    labels = list(labels)
+    if labels:
+        rendered = ",".join(f'{key}="{value}"' for key, value in labels)
+        name = f"{name}{{{rendered}}}"
+    return f"{name} {value}"
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        return "\n".join(lines + self.samples())
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, description: str):
+        super().__init__(name, description)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = _labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> List[str]:
+        return [_format(self.name, key, value) for key, value in list(self._values.items())]
+
+
+class Gauge(Metric):
+    """A value that goes up and down; callback() returns (labels dict, value) pairs at scrape time"""
+
+    kind = "gauge"
+
+    def __init__(
+        self, name: str, description: str, callback: Optional[Callable[[], Iterable[Tuple[Dict, float]]]] = None
+    ):
+        super().__init__(name, description)
+        self.callback = callback
+        self._values: Dict[tuple, float] = {}
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[_labels(labels)] = value
+
+    def samples(self) -> List[str]:
+        values = dict(self._values)
+        if self.callback is not None:
+            values.update((_labels(labels), value) for labels, value in self.callback())
+        return [_format(self.name, key, value) for key, value in values.items()]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, description)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [bucket counts..., count, sum]
+        self._values: Dict[tuple, List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = _labels(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.setdefault(key, [0] * (len(self.buckets) + 2))
+            if index < len(self.buckets):
+                counts[index] += 1
+            counts[-2] += 1
+            counts[-1] += value
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, counts in list(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(_format(f"{self.name}_bucket", key + (("le", str(bound)),), cumulative))
+            lines.append(_format(f"{self.name}_bucket", key + (("le", "+Inf"),), counts[-2]))
+            lines.append(_format(f"{self.name}_count", key, counts[-2]))
+            lines.append(_format(f"{self.name}_sum", key, round(counts[-1], 6)))
+        return lines
+
+
+def render() -> str:
+    """All registered metrics in the Prometheus text exposition format"""
+    return "\n".join(metric.render() for metric in _registry) + "\n"
@@ -0,0 +1,78 @@
+"""
+In-memory top-K of scored members.
+
+Every member's score is kept, but only the best K are kept sorted, so a read is a slice and
+an update is a bisect into a list of at most K entries. When a member of the top K drops out
+of it (its score fell or it was removed) the top K is refilled from the scores of the
+others: O(members), and only for updates that demote a member of the top K.
+"""
+
+import bisect
+import heapq
+import threading
+from typing import Dict, Hashable, List, Tuple
+
+
+class TopK:
+    """
+    Best K members by score (ties broken by member, for a stable order).
+
+    Args:
+        k (int): Number of members kept sorted.
+    """
+
+    def __init__(self, k: int):
+        self.k = k
+        self._scores: Dict[Hashable, float] = {}
+        # (-score, member) of the best k members, ascending
+        self._top: List[Tuple[float, Hashable]] = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._scores)
+
+    def set(self, member: Hashable, score: float):
+        """Add a member or change its score"""
+        with self._lock:
+            previous = self._scores.get(member)
+            if previous == score:
+                return
+            self._scores[member] = score
+            entry = (-score, member)
+            if previous is not None and self._discard_top(member, previous):
+                if entry < (-previous, member):
+                    # promoted: still ahead of every member outside the top
+                    bisect.insort(self._top, entry)
+                else:
+                    self._refill()
+            elif len(self._top) < self.k:
+                # the top is short only when it holds every member
+                bisect.insort(self._top, entry)
+            elif entry < self._top[-1]:
+                bisect.insort(self._top, entry)
+                self._top.pop()
+
+    def remove(self, member: Hashable):
+        """Remove a member (no-op if absent)"""
+        with self._lock:
+            score = self._scores.pop(member, None)
+            if score is not None and self._discard_top(member, score):
+                self._refill()
+
+    def _discard_top(self, member: Hashable, score: float) -> bool:
+        entry = (-score, member)
+        index = bisect.bisect_left(self._top, entry)
+        if index < len(self._top) and self._top[index] == entry:
+            del self._top[index]
+            return True
+        return False
+
+    def _refill(self):
+        if len(self._top) < min(self.k, len(self._scores)):
+            self._top = heapq.nsmallest(self.k, ((-score, member) for member, score in self._scores.items()))
+
+    def top(self, k: int = None) -> List[Tuple[Hashable, float]]:
+        """The best k (at most K) members with their scores, best first"""
+        with self._lock:
+            entries = self._top[: self.k if k is None else min(k, self.k)]
+        return [(member, -score) for score, member in entries]
@@ -0,0 +1,199 @@
+"""
+In-memory ranking of the tutors teaching each (subject, level).
+
+Every active tutor subject is scored from its profile, the reviews of the profile and its own
+price, as a weighted sum of components in [0, 1]:
+  - rating: mean review rating (1 to 5) shrunk towards PRIOR_RATING by PRIOR_REVIEWS, so a
+    single 5 star review does not outrank a hundred 4.8 ones;
+  - reviews: number of reviews, on a log scale saturating at REVIEWS_SATURATION;
+  - response: 1 / (1 + hours / RESPONSE_HOURS_SCALE) of the average_response_time;
+  - experience: experience_years, saturating at EXPERIENCE_SATURATION;
+  - price: 1 / (1 + price / PRICE_SCALE), the cheaper first.
+The profile, subject and review columns are free-form text: the first number is used (with
+its unit for the response time) and a value without one scores 0 - missing information never
+helps a tutor.
+
+The review aggregates (count, sum of ratings) are kept per profile, so a write rescores only
+the subjects of the profile it touches, and each (subject, level) keeps its best K in a TopK.
+"""
+
+import math
+import re
+import threading
+from typing import Dict, Hashable, List, Optional, Set, Tuple
+
+from app.utils.ranking.top_k import TopK
+
+
+WEIGHTS = {"rating": 0.5, "reviews": 0.15, "response": 0.15, "experience": 0.1, "price": 0.1}
+PRIOR_RATING = 3.5
+PRIOR_REVIEWS = 5
+REVIEWS_SATURATION = 100
+RESPONSE_HOURS_SCALE = 12
+EXPERIENCE_SATURATION = 20
+PRICE_SCALE = 30
+
+NUMBER = re.compile(r"\d+(?:\.\d+)?")
+# hours per unit of a response time, hours when there is no unit
+HOURS = (("min", 1 / 60), ("day", 24), ("week", 168))
+
+
+def parse_number(text: Optional[str]) -> Optional[float]:
+    """The first number in a free-form value ("£30/hour" -> 30.0), None if there is none"""
+    match = NUMBER.search(text or "")
+    return float(match.group()) if match else None
+
+
+def response_hours(text: Optional[str]) -> Optional[float]:
+    """A free-form response time in hours ("30 minutes" -> 0.5, "2 days" -> 48.0)"""
+    number = parse_number(text)
+    if number is None:
+        return None
+    lowered = text.lower()
+    for unit, hours in HOURS:
+        if unit in lowered:
+            return number * hours
+    return number
+
+
+def subject_key(subject: Optional[str], level: Optional[str]) -> Tuple[str, str]:
+    """(subject, level) case and whitespace insensitive: "gcse  maths" is "GCSE Maths" """
+    return " ".join((subject or "").lower().split()), " ".join((level or "").lower().split())
+
+
+class _Profile:
+    __slots__ = ("response", "experience", "reviews", "rating_sum", "score", "subjects")
+
+    def __init__(self):
+        self.response = 0.0
+        self.experience = 0.0
+        self.reviews = 0
+        self.rating_sum = 0.0
+        self.score = None  # None until the profile itself is loaded (or once it is removed)
+        self.subjects: Set[Hashable] = set()
+
+
+class TutorRanking:
+    """
+    Scores and per-(subject, level) top K of the tutor subjects.
+
+    Args:
+        k (int): Number of tutor subjects kept ranked per (subject, level).
+    """
+
+    def __init__(self, k: int):
+        self.k = k
+        self._profiles: Dict[Hashable, _Profile] = {}
+        # review id -> (profile id, rating)
+        self._reviews: Dict[Hashable, Tuple[Hashable, float]] = {}
+        # subject id -> (profile id, (subject, level), price component)
+        self._subjects: Dict[Hashable, Tuple[Hashable, Tuple[str, str], float]] = {}
+        self._top: Dict[Tuple[str, str], TopK] = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._subjects)
+
+    def _profile(self, profile_id: Hashable) -> _Profile:
+        profile = self._profiles.get(profile_id)
+        if profile is None:
+            profile = self._profiles[profile_id] = _Profile()
+        return profile
+
+    def set_profile(self, profile_id: Hashable, average_response_time: str, experience_years: str):
+        """Add or update an active profile"""
+        with self._lock:
+            profile = self._profile(profile_id)
+            hours = response_hours(average_response_time)
+            profile.response = 0.0 if hours is None else 1 / (1 + hours / RESPONSE_HOURS_SCALE)
+            years = parse_number(experience_years)
+            profile.experience = 0.0 if years is None else min(years / EXPERIENCE_SATURATION, 1.0)
+            self._rescore(profile_id, profile, loaded=True)
+
+    def remove_profile(self, profile_id: Hashable):
+        """Unrank the subjects of a deleted (or deactivated) profile"""
+        with self._lock:
+            profile = self._profiles.get(profile_id)
+            if profile is not None:
+                self._rescore(profile_id, profile, loaded=False)
+
+    def set_review(self, review_id: Hashable, profile_id: Hashable, rating: str):
+        """Add or update an active review (a rating that is not a number is ignored)"""
+        with self._lock:
+            self.remove_review(review_id)
+            value = parse_number(rating)
+            if value is None or profile_id is None:
+                return
+            value = min(max(value, 1.0), 5.0)
+            self._reviews[review_id] = (profile_id, value)
+            profile = self._profile(profile_id)
+            profile.reviews += 1
+            profile.rating_sum += value
+            self._rescore(profile_id, profile)
+
+    def remove_review(self, review_id: Hashable):
+        with self._lock:
+            review = self._reviews.pop(review_id, None)
+            if review is None:
+                return
+            profile_id, value = review
+            profile = self._profiles[profile_id]
+            profile.reviews -= 1
+            profile.rating_sum -= value
+            self._rescore(profile_id, profile)
+
+    def set_subject(self, subject_id: Hashable, profile_id: Hashable, subject: str, level: str, price: str):
+        """Add or update an active tutor subject"""
+        with self._lock:
+            self.remove_subject(subject_id)
+            if profile_id is None:
+                return
+            amount = parse_number(price)
+            price_score = 0.0 if amount is None else 1 / (1 + amount / PRICE_SCALE)
+            key = subject_key(subject, level)
+            self._subjects[subject_id] = (profile_id, key, price_score)
+            profile = self._profile(profile_id)
+            profile.subjects.add(subject_id)
+            if profile.score is not None:
+                self._ranked(key).set(subject_id, profile.score + WEIGHTS["price"] * price_score)
+
+    def remove_subject(self, subject_id: Hashable):
+        with self._lock:
+            entry = self._subjects.pop(subject_id, None)
+            if entry is None:
+                return
+            profile_id, key, _ = entry
+            self._profiles[profile_id].subjects.discard(subject_id)
+            self._ranked(key).remove(subject_id)
+
+    def _ranked(self, key: Tuple[str, str]) -> TopK:
+        top = self._top.get(key)
+        if top is None:
+            top = self._top[key] = TopK(self.k)
+        return top
+
+    def _rescore(self, profile_id: Hashable, profile: _Profile, loaded: bool = None):
+        """recompute the profile part of the score and rerank its subjects"""
+        if loaded is None:
+            loaded = profile.score is not None
+        if not loaded:
+            profile.score = None
+            for subject_id in profile.subjects:
+                _, key, _ = self._subjects[subject_id]
+                self._ranked(key).remove(subject_id)
+            return
+        rating = (PRIOR_RATING * PRIOR_REVIEWS + profile.rating_sum) / (PRIOR_REVIEWS + profile.reviews)
+        profile.score = (
+            WEIGHTS["rating"] * (rating - 1) / 4
+            + WEIGHTS["reviews"] * min(math.log1p(profile.reviews) / math.log1p(REVIEWS_SATURATION), 1.0)
+            + WEIGHTS["response"] * profile.response
+            + WEIGHTS["experience"] * profile.experience
+        )
+        for subject_id in profile.subjects:
+            _, key, price_score = self._subjects[subject_id]
+            self._ranked(key).set(subject_id, profile.score + WEIGHTS["price"] * price_score)
+
+    def top(self, subject: str, level: str, k: int = None) -> List[Tuple[Hashable, float]]:
+        """The best k (at most K) tutor subjects of a (subject, level) with their scores, best first"""
+        top = self._top.get(subject_key(subject, level))
+        return [] if top is None else top.top(k)
@@ -0,0 +1,98 @@
+"""
+Benchmark: latency of as-of reads as the history grows.
+
+Creates a scratch SQLite database, grows the history of a fixed set of users with
+updates and measures CRUDBase.read(as_of=...) at random points in time after each step.
+The as-of read is two index seeks, so its latency should stay flat while the path available
+before it grows with the history: load the entry, its whole `versions` collection (what
+read_versions did) and the transaction of each version, and keep the last one at as_of.
+
+    python -m benchmarks.as_of_read
+"""
+
+import os
+import random
+import statistics
+import tempfile
+import time
+import warnings
+from datetime import datetime
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.database.database import Base
+from app.database import crud
+from app.database.schemas.user_schema import User
+
+
+ENTITIES = 200
+HISTORY_STEPS = [1_000, 5_000, 20_000, 50_000]
+READS = 500
+
+
+def grow_history(db, ids, updates):
+    for i in range(updates):
+        user = db.get(User, random.choice(ids))
+        user.phone_number = str(i)
+        if i % 500 == 499:
+            db.commit()
+    db.commit()
+
+
+def scan_as_of(db, id, moment):
+    """as of reads before CRUDBase.read(as_of=...): every version of the entry, in python"""
+    head = crud.user.read(db, id, is_active=False)
+    valid = None
+    for version in head.versions.all():
+        if version.transaction.issued_at <= moment:
+            valid = version
+    return valid
+
+
+def measure(fn, reads):
+    timings = []
+    for _ in range(reads):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1e6)
+    timings.sort()
+    return statistics.mean(timings), timings[int(len(timings) * 0.95)]
+
+
+def main():
+    warnings.simplefilter("ignore")
+    path = os.path.join(tempfile.mkdtemp(), "as_of.db")
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    db = sessionmaker(bind=engine)()
+
+    ids = [f"user-{i}" for i in range(ENTITIES)]
+    db.add_all([User(user_id=user_id, role="student", phone_number="0") for user_id in ids])
+    db.commit()
+    started = datetime.utcnow()
+
+    print(f"{'versions':>10} {'as_of mean us':>14} {'as_of p95 us':>13} {'scan mean us':>13}")
+    total = ENTITIES
+    for step in HISTORY_STEPS:
+        grow_history(db, ids, step - total)
+        total = step
+        now = datetime.utcnow()
+
+        def as_of_read():
+            moment = started + (now - started) * random.random()
+            db.expunge_all()
+            crud.user.read(db, random.choice(ids), as_of=moment)
+
+        def history_scan():
+            moment = started + (now - started) * random.random()
+            db.expunge_all()
+            scan_as_of(db, random.choice(ids), moment)
+
+        mean, p95 = measure(as_of_read, READS)
+        scan_mean, _ = measure(history_scan, READS // 10)
+        print(f"{total:>10} {mean:>14.1f} {p95:>13.1f} {scan_mean:>13.1f}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Benchmark: backup throughput and its impact on the latency of a concurrent writer.
+
+Fills a scratch SQLite file with SIZE_MIB of rows, then copies it while a writer thread
+commits a small insert every WRITE_INTERVAL seconds, with:
+  - a plain file copy (shutil.copyfile): what copying database.db under load amounts to, the
+    copy is not consistent (a torn file when a commit lands during the copy);
+  - the backup API in a single step: one read transaction for the whole copy;
+  - the backup API in steps of PAGES pages with a pause in between (app.database.backup),
+    falling back to a single step after BACKUP_MAX_RESTARTS restarts by the writer.
+in WAL and in rollback journal mode (SQLITE_WAL=0). Reports the copy throughput, the steps
+and restarts, and the commit latency of the writer during the copy (p50, p99, max).
+
+    python -m benchmarks.backup
+"""
+
+import os
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+
+from app.database.backup import copy_database
+
+
+SIZE_MIB = 64
+ROW_BYTES = 1000
+WRITE_INTERVAL = 0.002
+CASES = {
+    "file copy": None,
+    "single step": {"pages": -1, "pause": 0},
+    "steps 256": {"pages": 256, "pause": 0.005},
+    "steps 1024": {"pages": 1024, "pause": 0.005},
+}
+
+
+def fill(path: str, journal_mode: str):
+    connection = sqlite3.connect(path)
+    connection.execute(f"PRAGMA journal_mode={journal_mode}")
+    connection.execute("CREATE TABLE row (id INTEGER PRIMARY KEY, body BLOB)")
+    rows = SIZE_MIB * 2**20 // ROW_BYTES
+    connection.executemany("INSERT INTO row (body) VALUES (randomblob(?))", [(ROW_BYTES,)] * rows)
+    connection.commit()
+    connection.close()
+
+
+def run(path: str, target: str, options):
+    latencies = []
+    stopped = threading.Event()
+
+    def writer():
+        connection = sqlite3.connect(path, timeout=30)
+        while not stopped.is_set():
+            started = time.perf_counter()
+            connection.execute("INSERT INTO row (body) VALUES (randomblob(100))")
+            connection.commit()
+            latencies.append(time.perf_counter() - started)
+            time.sleep(WRITE_INTERVAL)
+        connection.close()
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    time.sleep(0.2)
+    latencies.clear()
+    started = time.perf_counter()
+    if options is None:
+        shutil.copyfile(path, target)
+        stats = {"steps": "-", "restarts": "-"}
+    else:
+        stats = copy_database(target, source=path, **options)
+    elapsed = time.perf_counter() - started
+    stopped.set()
+    thread.join()
+    os.remove(target)
+    latencies.sort()
+    return {
+        "mib_s": os.path.getsize(path) / 2**20 / elapsed,
+        "steps": stats["steps"],
+        "restarts": stats["restarts"],
+        "writes": len(latencies),
+        "p50": statistics.median(latencies) * 1000 if latencies else 0,
+        "p99": latencies[int(len(latencies) * 0.99)] * 1000 if latencies else 0,
+        "max": latencies[-1] * 1000 if latencies else 0,
+    }
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    print(f"{SIZE_MIB} MiB database, a commit every {WRITE_INTERVAL * 1000:.0f} ms during the copy")
+    print(f"{'':<8} {'':<12} {'MiB/s':>7} {'steps':>6} {'restarts':>8} {'writes':>7} {'p50 ms':>7} {'p99 ms':>7} {'max ms':>8}")
+    for journal_mode in ("wal", "delete"):
+        path = os.path.join(directory, f"{journal_mode}.db")
+        fill(path, journal_mode)
+        for name, options in CASES.items():
+            result = run(path, os.path.join(directory, "copy.db"), options)
+            print(
+                f"{journal_mode:<8} {name:<12} {result['mib_s']:>7.0f} {result['steps']:>6} {result['restarts']:>8} "
+                f"{result['writes']:>7} {result['p50']:>7.2f} {result['p99']:>7.2f} {result['max']:>8.1f}"
+            )
+    shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Benchmark: per call Python overhead of the CRUDBase hot reads.
+
+Runs read (by primary key), read_multi (a page of 10) and read_many (20 ids) against an
+in-memory SQLite database, with the previous Query based implementations (rebuilding the
+query and looking up the model columns by name on every call) and with CRUDBase (cached
+select() statements with bound parameters and precomputed model metadata), first still with
+noload("*") and then with the noload options of CRUDBase, which leave out the dynamic
+`versions` relationship of versioned models: noload("*") sets it up with queries for every
+loaded row. The queries hit few rows of a memory database, so the difference is the per
+call overhead.
+
+    python -m benchmarks.crud_overhead
+"""
+
+import time
+import warnings
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session, noload
+from sqlalchemy.pool import StaticPool
+
+from app.database import crud
+from app.database.crud.base import CRUDBase
+from app.database.database import Base
+from app.database.schemas.tutor_schema import TutorSubject
+
+
+ROWS = 1_000
+CALLS = 2_000
+
+
+def scratch_session() -> Session:
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    Base.metadata.create_all(engine)
+    db = Session(engine)
+    db.add_all(
+        TutorSubject(
+            tutor_subject_id=f"s{i:05}", tutor_profile_id=f"p{i % 50}", subject="maths", level="gcse", price="30"
+        )
+        for i in range(ROWS)
+    )
+    db.commit()
+    return db
+
+
+class QueryCRUD:
+    """The previous implementations of the hot reads"""
+
+    model = TutorSubject
+
+    def read(self, db, id, children=False, is_active=True):
+        query = db.query(self.model)
+        if not children:
+            query = query.options(noload("*"))
+        if "updated_on" in self.model.__dict__.keys():
+            query = query.order_by(self.model.__dict__["updated_on"].desc())
+        if "is_active" in self.model.__dict__.keys() and is_active:
+            query = query.filter(self.model.__dict__["is_active"])
+        query = query.filter(self.model.__dict__[self.model.__tablename__ + "_id"] == id)
+        return query.first()
+
+    def read_multi(self, db, skip=0, limit=100, children=False, is_active=True):
+        query = db.query(self.model)
+        if children is False:
+            query = query.options(noload("*"))
+        if is_active and "is_active" in self.model.__dict__.keys():
+            query = query.filter(self.model.__dict__["is_active"])
+        if "updated_on" in self.model.__dict__.keys():
+            query = query.order_by(self.model.__dict__["updated_on"])
+        return query.offset(skip).limit(limit).all()
+
+    def read_many(self, db, ids, children=False, is_active=True):
+        primary_key = self.model.__tablename__ + "_id"
+        column = self.model.__dict__[primary_key]
+        query = db.query(self.model).filter(column.in_(list(dict.fromkeys(ids))))
+        if not children:
+            query = query.options(noload("*"))
+        if is_active and "is_active" in self.model.__dict__.keys():
+            query = query.filter(self.model.__dict__["is_active"])
+        found = {getattr(record, primary_key): record for record in query}
+        return [found[id] for id in ids if id in found]
+
+
+def measure(call) -> float:
+    call(0)  # warm up the compiled cache
+    started = time.perf_counter()
+    for i in range(CALLS):
+        call(i)
+    return (time.perf_counter() - started) / CALLS * 1e6
+
+
+def main():
+    warnings.simplefilter("ignore")
+    db = scratch_session()
+    legacy, current = QueryCRUD(), crud.tutor_subject
+    select_noload_all = CRUDBase(TutorSubject)
+    select_noload_all.noload_options = (noload("*"),)
+    ids = [f"s{i:05}" for i in range(ROWS)]
+    cases = {
+        "read": lambda crud_object: lambda i: crud_object.read(db, ids[i % ROWS]),
+        "read_multi (10)": lambda crud_object: lambda i: crud_object.read_multi(db, i % 100, 10),
+        "read_many (20)": lambda crud_object: lambda i: crud_object.read_many(db, ids[i % 900 : i % 900 + 20]),
+    }
+    print(f"{'':<18} {'Query':>10} {'select, noload(*)':>18} {'CRUDBase':>10} {'saved':>8}   (us/call)")
+    for name, case in cases.items():
+        before = measure(case(legacy))
+        statements = measure(case(select_noload_all))
+        after = measure(case(current))
+        print(f"{name:<18} {before:>10.1f} {statements:>18.1f} {after:>10.1f} {1 - after / before:>8.0%}")
+
+
+if __name__ == "__main__":
+    main()
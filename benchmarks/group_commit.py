@@ -0,0 +1,86 @@
+"""
+Benchmark: message inserts per second with per-request commits vs the group commit writer.
+
+Creates a scratch SQLite database (WAL, synchronous=FULL so every commit is fsynced) and
+inserts messages from a growing number of threads, once with a session and commit per
+insert and once through the writer. With per-request commits throughput is capped by the
+fsync rate; with the writer it grows with the number of concurrent writers.
+
+    python -m benchmarks.group_commit
+"""
+
+import os
+import tempfile
+import threading
+import time
+import warnings
+from datetime import datetime
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from app.database.database import Base
+from app.database import crud
+from app.database.writer import Writer
+from app.models.message_model import MessageCreate
+
+
+CONCURRENCY = [1, 4, 16, 64]
+WRITES_PER_THREAD = 25
+
+
+def scratch_engine():
+    path = os.path.join(tempfile.mkdtemp(), "group_commit.db")
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False, "timeout": 30})
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        dbapi_connection.execute("PRAGMA journal_mode=WAL")
+        dbapi_connection.execute("PRAGMA synchronous=FULL")
+
+    Base.metadata.create_all(engine)
+    return engine
+
+
+def run(threads: int, write) -> float:
+    def worker():
+        for _ in range(WRITES_PER_THREAD):
+            write()
+
+    started = time.perf_counter()
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return threads * WRITES_PER_THREAD / (time.perf_counter() - started)
+
+
+def main():
+    warnings.simplefilter("ignore")
+    engine = scratch_engine()
+    Session = sessionmaker(bind=engine)
+    writer = Writer(bind=engine)
+    message = MessageCreate(
+        sender_id="sender", receiver_id="receiver", message="hello", date_sent=datetime.utcnow(), date_read=None
+    )
+
+    def direct():
+        with Session() as db:
+            crud.message.create(db, message)
+
+    def grouped():
+        writer.execute(lambda db: crud.message.create(db, message))
+
+    print(f"{'threads':>8} {'direct/s':>10} {'grouped/s':>10} {'ops/batch':>10}")
+    for threads in CONCURRENCY:
+        batches, operations = writer.batches, writer.operations
+        direct_rate = run(threads, direct)
+        grouped_rate = run(threads, grouped)
+        per_batch = (writer.operations - operations) / max(writer.batches - batches, 1)
+        print(f"{threads:>8} {direct_rate:>10.0f} {grouped_rate:>10.0f} {per_batch:>10.1f}", flush=True)
+    writer.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Benchmark: insert rate and size of the message table with each kind of id.
+
+Inserts ROWS messages (in transactions of BATCH rows) into a scratch SQLite file with:
+  - uuid4 as text: the previous ids, random, every insert lands on a random page of the
+    primary key index;
+  - uuid7 as text: time ordered (app.utils.ids), inserts append to the right of the index;
+  - uuid7 as 16 byte blobs (ID_STORAGE=blob, app.database.types.CompactUUID).
+
+The page cache is kept small (CACHE_KIB) so that, as in a database larger than memory, the
+random inserts have to read and write back index pages. Reports the rows per second and the
+size of the table and of its primary key index (dbstat).
+
+    python -m benchmarks.message_ids
+"""
+
+import os
+import tempfile
+import time
+from datetime import datetime
+from uuid import uuid4
+
+from sqlalchemy import Column, DateTime, MetaData, String, Table, create_engine, event, text
+
+from app.database.types import CompactUUID
+from app.utils.ids import new_id
+
+
+ROWS = 200_000
+BATCH = 1_000
+USERS = 100
+CACHE_KIB = 2_000
+
+
+def message_table(id_type) -> Table:
+    """The columns of the message table with an id type"""
+    return Table(
+        "message",
+        MetaData(),
+        Column("message_id", id_type, primary_key=True),
+        Column("sender_id", id_type),
+        Column("receiver_id", id_type),
+        Column("message", String),
+        Column("date_sent", DateTime),
+        Column("date_read", DateTime, nullable=True),
+    )
+
+
+def run(id_type, generate):
+    path = os.path.join(tempfile.mkdtemp(), "messages.db")
+    engine = create_engine(f"sqlite:///{path}")
+
+    @event.listens_for(engine, "connect")
+    def small_cache(dbapi_connection, connection_record):
+        dbapi_connection.execute(f"PRAGMA cache_size = -{CACHE_KIB}")
+
+    table = message_table(id_type)
+    table.metadata.create_all(engine)
+    users = [generate() for _ in range(USERS)]
+    started = time.perf_counter()
+    for start in range(0, ROWS, BATCH):
+        rows = [
+            {
+                "message_id": generate(),
+                "sender_id": users[i % USERS],
+                "receiver_id": users[(i * 7 + 1) % USERS],
+                "message": f"message {i}",
+                "date_sent": datetime.utcnow(),
+            }
+            for i in range(start, start + BATCH)
+        ]
+        with engine.begin() as connection:
+            connection.execute(table.insert(), rows)
+    rate = ROWS / (time.perf_counter() - started)
+    with engine.connect() as connection:
+        sizes = dict(
+            connection.execute(
+                text("SELECT name, sum(pgsize) FROM dbstat WHERE name LIKE '%message%' GROUP BY name")
+            ).all()
+        )
+    engine.dispose()
+    os.remove(path)
+    index = sum(size for name, size in sizes.items() if name.startswith("sqlite_autoindex"))
+    return rate, sizes["message"], index
+
+
+def main():
+    cases = {
+        "uuid4 text": (String(), lambda: str(uuid4())),
+        "uuid7 text": (String(), new_id),
+        "uuid7 blob": (CompactUUID(), new_id),
+    }
+    print(f"{ROWS} messages, cache {CACHE_KIB} KiB")
+    print(f"{'':<12} {'rows/s':>10} {'table MiB':>10} {'pk index MiB':>13}")
+    for name, (id_type, generate) in cases.items():
+        rate, table_size, index_size = run(id_type, generate)
+        print(f"{name:<12} {rate:>10.0f} {table_size / 2**20:>10.1f} {index_size / 2**20:>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Benchmark: request throughput with 1 to N worker processes.
+
+Starts `python -m app.serve --workers N` on a scratch copy of the database for each N,
+then fires concurrent GET requests from a thread pool and reports requests per second.
+
+    python -m benchmarks.worker_scaling --workers 1 2 4 --requests 2000 --concurrency 32
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+
+def wait_ready(url: str, timeout: float = 30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"server at {url} did not start")
+
+
+def run(workers: int, requests: int, concurrency: int, path: str, port: int) -> float:
+    directory = tempfile.mkdtemp()
+    shutil.copy("database.db", os.path.join(directory, "database.db"))
+    environment = dict(os.environ, PYTHONPATH=os.getcwd())
+    server = subprocess.Popen(
+        [sys.executable, "-m", "app.serve", "--workers", str(workers), "--port", str(port),
+         "--cache-dir", os.path.join(directory, ".cache")],
+        cwd=directory,
+        env=environment,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}{path}"
+    try:
+        wait_ready(url)
+        with httpx.Client(limits=httpx.Limits(max_connections=concurrency)) as client:
+            for _ in range(50):
+                client.get(url)
+            started = time.perf_counter()
+            with ThreadPoolExecutor(concurrency) as pool:
+                list(pool.map(lambda _: client.get(url), range(requests)))
+            return requests / (time.perf_counter() - started)
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--path", default="/user/user?limit=20")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    print(f"{'workers':>8} {'req/s':>10} {'speedup':>8}")
+    baseline = None
+    for workers in args.workers:
+        throughput = run(workers, args.requests, args.concurrency, args.path, args.port)
+        baseline = baseline or throughput
+        print(f"{workers:>8} {throughput:>10.1f} {throughput / baseline:>8.2f}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
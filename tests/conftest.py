@@ -0,0 +1,28 @@
+"""
+The tests run against a database created in a temporary directory: the engine opens
+./database.db (and the job queue ./jobs.db) relative to the working directory.
+"""
+
+import os
+import tempfile
+
+os.chdir(tempfile.mkdtemp(prefix="extraclasses-tests-"))
+
+import pytest  # noqa: E402
+
+from app.database import crud  # noqa: E402, F401 - configures the mappers
+from app.database.counts import ensure_counters  # noqa: E402
+from app.database.database import Base, SessionLocal, engine  # noqa: E402
+
+
+@pytest.fixture(scope="session", autouse=True)
+def database():
+    Base.metadata.create_all(engine)
+    ensure_counters()
+    yield engine
+
+
+@pytest.fixture
+def db():
+    with SessionLocal() as session:
+        yield session
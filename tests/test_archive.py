@@ -0,0 +1,44 @@
+from datetime import datetime
+
+from app.database import archive, crud
+from app.database.schemas.message_schema import Message
+from app.utils.ids import new_id
+
+
+def add_message(db, date_sent):
+    message = Message(message_id=new_id(), sender_id="a", receiver_id="b", message="hello", date_sent=date_sent)
+    db.add(message)
+    db.commit()
+    return message.message_id
+
+
+def test_archived_messages_are_read_from_their_partition(db):
+    # a backdated message: its id was generated now, its partition is the month it was sent in
+    id = add_message(db, datetime(2020, 3, 14))
+    assert archive.archive_month("2020_03") == 1
+    assert crud.message.read(db, id, is_active=False).message == "hello"
+    records, missing = crud.message.read_many(db, [id, "unknown"])
+    assert [record.message_id for record in records] == [id]
+    assert missing == ["unknown"]
+
+
+def test_hot_and_archived_messages_are_returned_in_the_order_of_the_ids(db):
+    archived = add_message(db, datetime(2020, 2, 10))
+    archive.archive_month("2020_02")
+    hot = add_message(db, datetime.now())
+    records, missing = crud.message.read_many(db, [archived, hot, "unknown", archived])
+    assert [record.message_id for record in records] == [archived, hot, archived]
+    assert missing == ["unknown"]
+
+
+def test_unknown_ids_do_not_read_the_partitions(db):
+    add_message(db, datetime(2020, 4, 1))
+    archive.archive_month("2020_04")
+    assert archive.read_ids(db, ["unknown", new_id()]) == {}
+
+
+def test_archive_moves_each_row_once(db):
+    ids = [add_message(db, datetime(2020, 5, day)) for day in range(1, 6)]
+    assert archive.archive_month("2020_05", chunk_size=2) == 5
+    assert db.query(Message).filter(Message.message_id.in_(ids)).count() == 0
+    assert set(archive.read_ids(db, ids)) == set(ids)
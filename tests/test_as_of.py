@@ -0,0 +1,84 @@
+import time
+from datetime import date, datetime, timezone
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+from app.database.database import engine
+from app.database.schemas.message_schema import Message
+from app.database.schemas.user_schema import User
+from app.main import app
+from app.utils.ids import new_id
+
+
+def add_user(db, username):
+    user = User(
+        user_id=new_id(),
+        role="student",
+        username=username,
+        first_name="First",
+        last_name="Last",
+        profile_picture="picture.png",
+        email=f"{username}@example.com",
+        phone_number="0123456789",
+        DOB=date(2000, 1, 1),
+    )
+    db.add(user)
+    db.commit()
+    return user
+
+
+def moment():
+    """a time strictly between the transactions committed before and after it"""
+    time.sleep(0.01)
+    as_of = datetime.now(timezone.utc)
+    time.sleep(0.01)
+    return as_of.isoformat()
+
+
+def statements(client, path, params):
+    """the JSON of a GET and the number of SQL statements it ran"""
+    log = []
+
+    def listener(connection, cursor, statement, *args):
+        log.append(statement)
+
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        return client.get(path, params=params).json(), len(log)
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+
+
+def test_as_of_list_resolves_the_relationships_as_of_the_same_time(db):
+    sender = add_user(db, "sender")
+    receivers = [add_user(db, f"receiver{index}") for index in range(3)]
+    db.add_all(
+        Message(message_id=new_id(), sender_id=sender.user_id, receiver_id=receiver.user_id, message="hello", date_sent=datetime.now())
+        for receiver in receivers
+    )
+    db.commit()
+    as_of = moment()
+    sender.username = "renamed"
+    db.commit()
+
+    client = TestClient(app)
+    messages, queries = statements(client, "/message/message", {"sender_id": sender.user_id, "as_of": as_of})
+    assert [message["sender"]["username"] for message in messages] == ["sender"] * 3
+    assert sorted(message["receiver"]["username"] for message in messages) == ["receiver0", "receiver1", "receiver2"]
+    # one query per relationship, not per message
+    _, single_queries = statements(client, "/message/message", {"sender_id": sender.user_id, "as_of": as_of, "limit": 1})
+    assert queries == single_queries
+    (message, *_) = client.get("/message/message", params={"sender_id": sender.user_id}).json()
+    assert message["sender"]["username"] == "renamed"
+
+
+def test_as_of_list_has_no_entity_for_a_missing_reference(db):
+    sender = add_user(db, "early")
+    db.add(Message(message_id=new_id(), sender_id=sender.user_id, receiver_id=new_id(), message="hello", date_sent=datetime.now()))
+    db.commit()
+    as_of = moment()
+
+    (message,) = TestClient(app).get("/message/message", params={"sender_id": sender.user_id, "as_of": as_of}).json()
+    assert message["sender"]["username"] == "early"
+    assert message["receiver"] is None
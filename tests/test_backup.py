@@ -0,0 +1,32 @@
+import pytest
+
+from app.database import backup
+from app.database.schemas.message_schema import Message
+from app.utils.ids import new_id
+
+
+def write(db):
+    db.add(Message(message_id=new_id(), sender_id="a", receiver_id="b", message="backup"))
+    db.commit()
+
+
+def test_snapshots_are_incremental_and_restorable(db, tmp_path, monkeypatch):
+    monkeypatch.setattr(backup.config, "BACKUP_DIR", str(tmp_path))
+    assert backup.snapshot(full=True)["kind"] == "full"
+    write(db)
+    entry = backup.snapshot()
+    assert entry["kind"] == "delta"
+    backup.restore(entry["name"], str(tmp_path / "restored.db"))
+
+
+def test_a_diverged_base_takes_a_full_snapshot(db, tmp_path, monkeypatch):
+    monkeypatch.setattr(backup.config, "BACKUP_DIR", str(tmp_path))
+    backup.snapshot(full=True)
+    with open(tmp_path / backup.CURRENT, "r+b") as current:
+        current.seek(200)
+        current.write(b"\xff" * 16)
+    write(db)
+    with pytest.warns(UserWarning, match="does not match"):
+        entry = backup.snapshot()
+    assert entry["kind"] == "full"
+    assert backup.verify(entry["name"])["ok"]
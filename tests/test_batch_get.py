@@ -0,0 +1,71 @@
+from datetime import date
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import config
+from app.database import crud
+from app.database.crud import base
+from app.database.schemas.user_schema import User
+from app.main import app
+from app.utils.ids import new_id
+
+
+@pytest.fixture
+def client():
+    return TestClient(app)
+
+
+def add_users(db, number):
+    users = [
+        User(
+            user_id=new_id(),
+            role="student",
+            username=f"user{index}",
+            first_name="First",
+            last_name="Last",
+            profile_picture="picture.png",
+            email=f"user{index}@example.com",
+            phone_number="0123456789",
+            DOB=date(2000, 1, 1),
+        )
+        for index in range(number)
+    ]
+    db.add_all(users)
+    db.commit()
+    return [user.user_id for user in users]
+
+
+def test_batch_get_keeps_the_request_order_and_repeats(client, db):
+    a, b, c = add_users(db, 3)
+    unknown = new_id()
+    response = client.post("/user/user/batch-get", json={"ids": [c, a, unknown, c, b]})
+    assert response.status_code == 200
+    assert [item["user_id"] for item in response.json()["items"]] == [c, a, c, b]
+    assert response.json()["missing"] == [unknown]
+
+
+def test_get_ids_lists_the_missing_ids_in_a_header(client, db):
+    a, b = add_users(db, 2)
+    unknown = new_id()
+    response = client.get("/user/user", params={"ids": f"{b},{unknown},{a}"})
+    assert [item["user_id"] for item in response.json()] == [b, a]
+    assert response.headers["X-Missing-Ids"] == unknown
+    response = client.get("/user/user", params=[("ids", a), ("ids", a)])
+    assert [item["user_id"] for item in response.json()] == [a, a]
+    assert "X-Missing-Ids" not in response.headers
+
+
+def test_ids_are_read_in_chunks(db, monkeypatch):
+    ids = add_users(db, 5)
+    monkeypatch.setattr(base, "MAX_IN_PARAMETERS", 2)
+    requested = ids[::-1] + [ids[0]]
+    records, missing = crud.user.read_many(db, requested)
+    assert [record.user_id for record in records] == requested
+    assert missing == []
+
+
+def test_too_many_ids_are_rejected(client, db, monkeypatch):
+    monkeypatch.setattr(config, "BATCH_GET_MAX_IDS", 2)
+    response = client.get("/user/user", params={"ids": ",".join(new_id() for _ in range(3))})
+    assert response.status_code == 400
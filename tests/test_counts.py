@@ -0,0 +1,118 @@
+import threading
+
+from sqlalchemy import delete, func, select, text
+
+from app.database import counts, crud
+from app.database.database import SessionLocal, engine
+from app.database.schemas.tutor_schema import TutorSubject
+from app.utils.jobs import job_queue
+from app.utils.ids import new_id
+
+
+def add_subjects(db, tutor_profile_id, number):
+    ids = [new_id() for _ in range(number)]
+    db.add_all(
+        TutorSubject(tutor_subject_id=id, tutor_profile_id=tutor_profile_id, subject="maths", level="gcse", price="20")
+        for id in ids
+    )
+    db.commit()
+    return ids
+
+
+def active_subjects(tutor_profile_id=None):
+    query = select(func.count()).select_from(TutorSubject).where(TutorSubject.is_active)
+    if tutor_profile_id is not None:
+        query = query.where(TutorSubject.tutor_profile_id == tutor_profile_id)
+    with engine.connect() as connection:
+        return connection.execute(query).scalar()
+
+
+def rebuild(db):
+    for name in ("tutor_subject", "tutor_subject:tutor_profile_id"):
+        counts.rebuild_counter(db, name)
+
+
+def test_insert_is_counted(db):
+    profile = new_id()
+    total, exact = counts.count(db, crud.tutor_subject)
+    add_subjects(db, profile, 3)
+    assert counts.count(db, crud.tutor_subject) == (total + 3, True)
+    assert counts.count(db, crud.tutor_subject, {"tutor_profile_id": profile}) == (3, True)
+    assert exact
+
+
+def test_soft_delete_is_counted(db):
+    profile = new_id()
+    ids = add_subjects(db, profile, 2)
+    total, _ = counts.count(db, crud.tutor_subject)
+    crud.tutor_subject.soft_delete(db, ids[0])
+    assert counts.count(db, crud.tutor_subject) == (total - 1, True)
+    assert counts.count(db, crud.tutor_subject, {"tutor_profile_id": profile}) == (1, True)
+
+
+def test_core_delete_drops_the_counters(db):
+    profile = new_id()
+    ids = add_subjects(db, profile, 4)
+    with engine.begin() as connection:
+        connection.execute(delete(TutorSubject).where(TutorSubject.tutor_subject_id == ids[0]))
+    # an estimate until the counter is rebuilt, by a job and not by the request
+    assert counts.count(db, crud.tutor_subject, {"tutor_profile_id": profile}) == (3, False)
+    queued = [job["payload"]["name"] for job in job_queue.list(limit=10) if job["name"] == "rebuild_counter"]
+    assert "tutor_subject:tutor_profile_id" in queued
+    rebuild(db)
+    assert counts.count(db, crud.tutor_subject, {"tutor_profile_id": profile}) == (3, True)
+
+
+def test_raw_sql_in_a_session_drops_the_counters(db):
+    profile = new_id()
+    add_subjects(db, profile, 2)
+    db.execute(text("UPDATE tutor_subject SET is_active = 0 WHERE tutor_profile_id = :id"), {"id": profile})
+    db.commit()
+    assert counts.count(db, crud.tutor_subject)[1] is False
+    rebuild(db)
+    assert counts.count(db, crud.tutor_subject) == (active_subjects(), True)
+
+
+def test_rebuild_concurrent_with_writes(db):
+    profile = new_id()
+    counts.invalidate(db.connection(), "tutor_subject")
+    db.commit()
+    errors = []
+
+    def write():
+        try:
+            with SessionLocal() as session:
+                for _ in range(10):
+                    add_subjects(session, profile, 2)
+        except Exception as e:
+            errors.append(e)
+
+    def recount():
+        try:
+            with SessionLocal() as session:
+                for _ in range(5):
+                    counts.invalidate(session.connection(), "tutor_subject")
+                    session.commit()
+                    rebuild(session)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=write) for _ in range(3)] + [threading.Thread(target=recount) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    rebuild(db)
+    assert counts.count(db, crud.tutor_subject) == (active_subjects(), True)
+    assert counts.count(db, crud.tutor_subject, {"tutor_profile_id": profile}) == (60, True)
+
+
+def test_raw_sql_after_a_flush_drops_the_counters(db):
+    profile = new_id()
+    db.add(TutorSubject(tutor_subject_id=new_id(), tutor_profile_id=profile, subject="maths", level="gcse", price="20"))
+    db.flush()
+    db.execute(text("DELETE FROM tutor_subject WHERE tutor_profile_id = :id"), {"id": profile})
+    db.commit()
+    assert counts.count(db, crud.tutor_subject, {"tutor_profile_id": profile}) == (0, False)
+    rebuild(db)
@@ -0,0 +1,48 @@
+import sys
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import Column, Integer, Numeric, String
+from sqlalchemy.orm import declarative_base
+
+from app.database import filters
+
+
+Base = declarative_base()
+
+
+class Item(Base):
+    __tablename__ = "item"
+    item_id = Column(Integer, primary_key=True)
+    name = Column(String)
+    price = Column(Numeric)
+
+
+@pytest.mark.parametrize("value", ["abc", "1,5", ""])
+def test_invalid_values_are_value_errors(value):
+    with pytest.raises(ValueError):
+        filters.parse(Item, [("price", value)])
+
+
+def test_decimal_value():
+    assert filters.parse(Item, [("price__gte", "1.5")]) == {"price__gte": Decimal("1.5")}
+
+
+def test_repeated_column_matches_any_value():
+    assert filters.parse(Item, [("name", "a"), ("name", "b"), ("name", "c")]) == {"name": ["a", "b", "c"]}
+    assert filters.parse(Item, [("item_id__in", "1,2"), ("item_id__in", "3")]) == {"item_id__in": [1, 2, 3]}
+
+
+def test_repeated_operator_is_rejected():
+    with pytest.raises(ValueError):
+        filters.parse(Item, [("item_id__gte", "1"), ("item_id__gte", "2")])
+
+
+def test_prefix_of_the_last_code_point():
+    last = chr(sys.maxunicode)
+    assert filters._next_prefix("ab") == "ac"
+    assert filters._next_prefix("a" + last) == "b"
+    assert filters._next_prefix(last) is None
+    clauses, params = filters.compile_filter(Item, {"name__prefix": last})
+    assert params == {"f0": last}
+    assert str(clauses[0]) == "item.name >= :f0"
@@ -0,0 +1,83 @@
+from datetime import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.database.schemas.message_schema import Message
+from app.main import app
+from app.utils.cache import cache
+from app.utils.cache.generations import GenerationCounters
+from app.utils.ids import new_id
+
+
+@pytest.fixture
+def client():
+    # not entered: the startup handlers (job workers, backups...) are not run
+    return TestClient(app)
+
+
+@pytest.fixture
+def sender():
+    """a sender of its own: the lists of the tests only have their messages"""
+    return new_id()
+
+
+def add_message(db, sender, text="hello"):
+    message = Message(message_id=new_id(), sender_id=sender, receiver_id="b", message=text, date_sent=datetime.now())
+    db.add(message)
+    db.commit()
+    return message
+
+
+def revalidate(client, path, etag):
+    return client.get(path, headers={"If-None-Match": etag})
+
+
+def test_unchanged_list_is_not_modified(client, db, sender):
+    add_message(db, sender)
+    path = f"/message/message?sender_id={sender}"
+    etag = client.get(path).headers["ETag"]
+    response = revalidate(client, path, etag)
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+
+
+def test_list_is_modified_by_the_writes_of_another_process(client, db, sender, monkeypatch):
+    add_message(db, sender)
+    path = f"/message/message?sender_id={sender}"
+    etag = client.get(path).headers["ETag"]
+    # a process local cache: the commits of another process do not bump its generations
+    assert not cache.shared
+    monkeypatch.setattr(cache.generations, "bump", lambda name: 0)
+    add_message(db, sender, "from another process")
+    response = revalidate(client, path, etag)
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert "from another process" in [message["message"] for message in response.json()]
+
+
+def test_entity_is_modified_by_the_writes_of_another_process(client, db, sender, monkeypatch):
+    message = add_message(db, sender)
+    path = f"/message/message/{message.message_id}"
+    etag = client.get(path).headers["ETag"]
+    assert revalidate(client, path, etag).status_code == 304
+    monkeypatch.setattr(cache.generations, "bump", lambda name: 0)
+    message.message = "edited in another process"
+    db.commit()
+    response = revalidate(client, path, etag)
+    assert response.status_code == 200
+    assert response.json()["message"] == "edited in another process"
+
+
+def test_shared_generations_validate_the_lists_without_a_query(client, db, sender, tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "generations", GenerationCounters(str(tmp_path / "generations")))
+    assert cache.shared
+    add_message(db, sender)
+    path = f"/message/message?sender_id={sender}"
+    etag = client.get(path).headers["ETag"]
+    assert etag.startswith('W/"g')
+    assert revalidate(client, path, etag).status_code == 304
+    add_message(db, sender, "after the etag")
+    response = revalidate(client, path, etag)
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
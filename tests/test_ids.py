@@ -0,0 +1,60 @@
+from uuid import UUID
+
+import pytest
+from sqlalchemy import Column, MetaData, Table, create_engine, func, select
+
+from app.database.types import CompactUUID, id_text
+from app.utils import ids
+from app.utils.ids import id_time, new_id
+
+
+@pytest.fixture
+def frozen_clock(monkeypatch):
+    """every id generated in the same millisecond (then the clock goes back)"""
+    clock = {"ns": 1_700_000_000_000 * 1_000_000}
+    monkeypatch.setattr(ids.time, "time_ns", lambda: clock["ns"])
+    monkeypatch.setattr(ids, "_last_millisecond", 0)
+    monkeypatch.setattr(ids, "_counter", 0)
+    return clock
+
+
+def test_ids_are_strictly_increasing():
+    generated = [new_id() for _ in range(10000)]
+    assert generated == sorted(generated)
+    assert len(set(generated)) == len(generated)
+    assert [UUID(id).bytes for id in generated] == sorted(UUID(id).bytes for id in generated)
+    uuid = UUID(generated[0])
+    assert (uuid.version, uuid.variant) == (7, "specified in RFC 4122")
+
+
+def test_counter_overflow_borrows_the_next_millisecond(frozen_clock):
+    generated = [new_id() for _ in range(2 ** ids.COUNTER_BITS + 10)]
+    assert generated == sorted(set(generated))
+    assert id_time(generated[0]) == 1_700_000_000
+    assert id_time(generated[-1]) > id_time(generated[0])
+
+
+def test_ids_keep_increasing_when_the_clock_goes_back(frozen_clock):
+    before = new_id()
+    frozen_clock["ns"] -= 5_000 * 1_000_000
+    assert new_id() > before
+
+
+def test_compact_ids_round_trip(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'ids.db'}")
+    table = Table("item", MetaData(), Column("id", CompactUUID(), primary_key=True))
+    table.metadata.create_all(engine)
+    generated = [new_id() for _ in range(100)]
+    # an id that is not a canonical UUID is kept as text
+    legacy = "legacy-id"
+    with engine.begin() as connection:
+        connection.execute(table.insert(), [{"id": id} for id in generated[::-1] + [legacy]])
+    with engine.connect() as connection:
+        storage = select(func.typeof(table.c.id), func.length(table.c.id)).where(table.c.id == generated[0])
+        assert connection.execute(storage).one() == ("blob", 16)
+        stored = connection.execute(select(table.c.id).where(table.c.id != legacy).order_by(table.c.id)).scalars()
+        # the bytes sort like the text: the ids stay time ordered in the index
+        assert stored.all() == generated
+        found = connection.execute(select(table.c.id).where(table.c.id.in_([generated[5], legacy]))).scalars()
+        assert set(found) == {generated[5], legacy}
+        assert set(connection.execute(select(id_text(table.c.id))).scalars()) == set(generated) | {legacy}
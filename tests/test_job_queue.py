@@ -0,0 +1,63 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app.utils.jobs import queue as job_queue_module
+from app.utils.jobs.queue import DONE, FAILED, JobQueue, LeaseLost
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """the time of the queue, moved by the tests"""
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(job_queue_module, "time", SimpleNamespace(time=lambda: clock.now))
+    # no jitter: the retries run after the full backoff
+    monkeypatch.setattr(job_queue_module.random, "uniform", lambda low, high: high)
+    return clock
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(str(tmp_path / "jobs.db"), visibility_timeout=10, max_attempts=4, backoff_base=2, backoff_max=5)
+
+
+def status(queue, job_id):
+    (job,) = [job for job in queue.list() if job["job_id"] == job_id]
+    return job
+
+
+def test_expired_lease_is_claimed_again(queue, clock):
+    job_id = queue.enqueue("work")
+    first = queue.claim()
+    assert first.job_id == job_id and first.attempts == 1
+    clock.now += 9
+    assert queue.claim() is None
+    clock.now += 2
+    second = queue.claim()
+    assert second.job_id == job_id and second.attempts == 2
+    # the first worker outlived its lease: only the second one records the outcome
+    with pytest.raises(LeaseLost):
+        queue.complete(first)
+    queue.complete(second)
+    assert status(queue, job_id)["status"] == DONE
+
+
+def test_failed_job_is_retried_with_backoff(queue, clock):
+    job_id = queue.enqueue("work")
+    delays = []
+    for attempt in range(3):
+        job = queue.claim()
+        assert job.attempts == attempt + 1
+        failed_on = clock.now
+        assert queue.fail(job, "error")
+        delays.append(status(queue, job_id)["run_after"] - failed_on)
+        clock.now = status(queue, job_id)["run_after"] - 0.1
+        assert queue.claim() is None
+        clock.now += 0.1
+    # doubled on every attempt, up to backoff_max
+    assert delays == [2, 4, 5]
+    job = queue.claim()
+    assert not queue.fail(job, "last error")
+    assert queue.claim() is None
+    failed = status(queue, job_id)
+    assert (failed["status"], failed["attempts"], failed["last_error"]) == (FAILED, 4, "last error")
@@ -0,0 +1,63 @@
+import sqlite3
+
+import sqlalchemy as sa
+
+from app.database.online_migration import OnlineMigration
+
+
+def item_table(price_type):
+    return sa.Table(
+        "item",
+        sa.MetaData(),
+        sa.Column("item_id", sa.String(), primary_key=True),
+        sa.Column("price", price_type),
+        sa.Index("ix_item_price", "price"),
+    )
+
+
+def price_to_number(row):
+    return {**row, "price": float(row["price"].lstrip("£"))}
+
+
+def migrate(tmp_path, rows, **options):
+    path = tmp_path / "migrated.db"
+    engine = sa.create_engine(f"sqlite:///{path}")
+    table = item_table(sa.String())
+    table.create(engine)
+    with engine.begin() as connection:
+        connection.execute(table.insert(), [{"item_id": str(index), "price": f"£{index}"} for index in range(rows)])
+    engine.dispose()
+    OnlineMigration(
+        "item_price_number", item_table(sa.Float()), transform=price_to_number, chunk_size=7, pause=0,
+        url=f"sqlite:///{path}", **options,
+    ).run()
+    return sqlite3.connect(path)
+
+
+def indexes(connection, table):
+    return dict(
+        connection.execute("SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL", (table,))
+    )
+
+
+def test_rows_are_rewritten_with_the_final_indexes(tmp_path):
+    connection = migrate(tmp_path, 50)
+    assert connection.execute("SELECT count(*), sum(price) FROM item").fetchone() == (50, sum(range(50)))
+    assert list(indexes(connection, "item")) == ["ix_item_price"]
+    assert '"ix_item_price" ON "item"' in indexes(connection, "item")["ix_item_price"]
+    plan = connection.execute("EXPLAIN QUERY PLAN SELECT item_id FROM item WHERE price > 40").fetchall()
+    assert "ix_item_price" in str(plan)
+    assert connection.execute("PRAGMA integrity_check").fetchone() == ("ok",)
+    assert connection.execute("SELECT phase FROM online_migration").fetchone() == ("done",)
+
+
+def test_the_kept_original_keeps_its_indexes_renamed(tmp_path):
+    connection = migrate(tmp_path, 10, keep_old=True)
+    assert list(indexes(connection, "_item_old")) == ["ix_item_price__old"]
+    assert list(indexes(connection, "item")) == ["ix_item_price"]
+    assert connection.execute("PRAGMA integrity_check").fetchone() == ("ok",)
+    # both still written and read through their indexes
+    connection.execute("INSERT INTO item VALUES ('new', 99.5)")
+    connection.execute("INSERT INTO _item_old VALUES ('new', '£99.5')")
+    assert connection.execute("SELECT item_id FROM item WHERE price = 99.5").fetchall() == [("new",)]
+    assert connection.execute("PRAGMA integrity_check").fetchone() == ("ok",)
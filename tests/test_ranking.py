@@ -0,0 +1,52 @@
+import threading
+
+from app.database.events import Change
+from app.database.schemas.tutor_schema import TutorProfile, TutorSubject
+from app.services.tutor_service import TutorSubjectService
+from app.utils.cache import cache
+from app.utils.ids import new_id
+
+
+def add_subject(db, subject, level, price="20"):
+    profile = TutorProfile(tutor_profile_id=new_id(), average_response_time="2 hours", experience_years="5")
+    row = TutorSubject(
+        tutor_subject_id=new_id(), tutor_profile_id=profile.tutor_profile_id, subject=subject, level=level, price=price
+    )
+    db.add_all([profile, row])
+    db.commit()
+    return row
+
+
+def ranked(service, db, subject, level):
+    return [record.tutor_subject_id for record, _ in service.top(db, subject, level)]
+
+
+def test_partial_update_keeps_the_subject_and_level(db):
+    service = TutorSubjectService()
+    row = add_subject(db, "Ranking Maths", "GCSE")
+    assert ranked(service, db, "ranking maths", "gcse") == [row.tutor_subject_id]
+    # an update that did not load every column
+    service._refresh_ranking([Change("update", "tutor_subject", row.tutor_subject_id, {"price": "10"})])
+    assert ranked(service, db, "ranking maths", "gcse") == [row.tutor_subject_id]
+    assert service.ranking.top("", "") == []
+
+
+def test_writes_of_another_worker_are_rebuilt_in_the_background(db, monkeypatch):
+    service = TutorSubjectService()
+    row = add_subject(db, "Ranking Physics", "A level")
+    assert ranked(service, db, "ranking physics", "a level") == [row.tutor_subject_id]
+    rebuilt = threading.Event()
+    rebuild = service._rebuild_ranking
+
+    def record_rebuild(db):
+        assert threading.current_thread() is not threading.main_thread()
+        rebuild(db)
+        rebuilt.set()
+
+    monkeypatch.setattr(service, "_rebuild_ranking", record_rebuild)
+    # a commit of another worker: only the generation moves
+    cache.invalidate_table("tutor_subject")
+    # served from the current ranking meanwhile
+    assert ranked(service, db, "ranking physics", "a level") == [row.tutor_subject_id]
+    assert rebuilt.wait(5)
+    assert service._ranking_generations == service._current_generations()
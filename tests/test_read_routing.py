@@ -0,0 +1,67 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import select
+
+from app.database import crud, database
+from app.database.database import PINNED, SessionLocal, engine, pin_to_primary
+from app.database.schemas.message_schema import Message
+from app.utils.ids import new_id
+
+
+@pytest.fixture
+def read_engine(monkeypatch):
+    """read-only connections to the test database, as with READ_ROUTING_ENABLED"""
+    read_engine = database.create_read_engine()
+    monkeypatch.setattr(database, "read_engine", read_engine)
+    yield read_engine
+    read_engine.dispose()
+
+
+def bind_of_a_read(db):
+    db.info[database.READ_ONLY] = 1
+    try:
+        return db.get_bind(clause=select(Message))
+    finally:
+        del db.info[database.READ_ONLY]
+
+
+def add_message(db):
+    message = Message(message_id=new_id(), sender_id="a", receiver_id="b", message="hello", date_sent=datetime.now())
+    db.add(message)
+    return message
+
+
+def test_reads_run_on_the_read_engine(read_engine, db):
+    assert bind_of_a_read(db) is read_engine
+    # not marked read only: the primary
+    assert db.get_bind(clause=select(Message)) is engine
+
+
+def test_a_flush_pins_the_session_to_the_primary(read_engine, db):
+    message = add_message(db)
+    db.flush()
+    assert db.info[PINNED]
+    assert bind_of_a_read(db) is engine
+    # the uncommitted row is only visible on the primary connection of the session
+    assert crud.message.read(db, message.message_id).message == "hello"
+    db.rollback()
+    # still pinned until the session is closed, then routed again
+    assert bind_of_a_read(db) is engine
+    db.close()
+    assert bind_of_a_read(db) is read_engine
+
+
+def test_a_write_committed_by_the_writer_pins_the_request_session(read_engine):
+    with SessionLocal() as db:
+        pin_to_primary(db)
+        assert bind_of_a_read(db) is engine
+    with SessionLocal() as db:
+        assert bind_of_a_read(db) is read_engine
+
+
+def test_nothing_is_pinned_without_read_routing(db):
+    add_message(db)
+    db.flush()
+    assert PINNED not in db.info
+    db.rollback()
@@ -0,0 +1,90 @@
+from sqlalchemy import select
+
+from app.database import tutor_card
+from app.database.schemas.tutor_schema import TutorAvailability, TutorProfile, TutorReview, TutorSubject
+from app.database.tutor_card import tutor_card as card_table
+from app.utils.ids import new_id
+
+
+def add_profile(db, name="tutor"):
+    profile = TutorProfile(tutor_profile_id=new_id(), display_name=name, tutor_title="Maths tutor")
+    db.add(profile)
+    db.commit()
+    return profile
+
+
+def card(db, profile_id):
+    row = db.execute(select(card_table).where(card_table.c.tutor_profile_id == profile_id)).first()
+    return None if row is None else row._mapping
+
+
+def test_card_follows_the_writes_of_the_children(db):
+    profile = add_profile(db)
+    assert card(db, profile.tutor_profile_id)["subjects"] == []
+    subject = TutorSubject(tutor_profile_id=profile.tutor_profile_id, subject="maths", level="gcse", price="30")
+    db.add_all([
+        subject,
+        TutorSubject(tutor_profile_id=profile.tutor_profile_id, subject="physics", level="a-level", price="£25.50"),
+        TutorAvailability(tutor_profile_id=profile.tutor_profile_id, day="Tuesday", start_time="10:00", end_time="11:00"),
+        TutorReview(tutor_profile_id=profile.tutor_profile_id, review="good", rating="4"),
+        TutorReview(tutor_profile_id=profile.tutor_profile_id, review="great", rating="5"),
+    ])
+    db.commit()
+    current = card(db, profile.tutor_profile_id)
+    assert current["subjects"] == [{"subject": "maths", "level": "gcse"}, {"subject": "physics", "level": "a-level"}]
+    assert current["min_price"] == 25.5
+    assert current["days"] == ["tuesday"]
+    assert (current["review_count"], current["rating"]) == (2, 4.5)
+
+    subject.price = "20"
+    db.commit()
+    assert card(db, profile.tutor_profile_id)["min_price"] == 20
+    subject.is_active = False
+    db.commit()
+    current = card(db, profile.tutor_profile_id)
+    assert current["subjects"] == [{"subject": "physics", "level": "a-level"}]
+    assert current["min_price"] == 25.5
+
+
+def test_moving_a_child_refreshes_both_cards(db):
+    first, second = add_profile(db, "first"), add_profile(db, "second")
+    subject = TutorSubject(tutor_profile_id=first.tutor_profile_id, subject="maths", level="gcse", price="30")
+    db.add(subject)
+    db.commit()
+    subject.tutor_profile_id = second.tutor_profile_id
+    db.commit()
+    assert card(db, first.tutor_profile_id)["subjects"] == []
+    assert card(db, second.tutor_profile_id)["subjects"] == [{"subject": "maths", "level": "gcse"}]
+
+
+def test_child_loaded_without_its_profile_refreshes_the_card(db):
+    profile_id = add_profile(db).tutor_profile_id
+    subject_id = new_id()
+    db.add(TutorSubject(tutor_subject_id=subject_id, tutor_profile_id=profile_id, subject="maths", price="30"))
+    db.commit()
+    subject = db.get(TutorSubject, subject_id)
+    # the profile id is not loaded: the listener looks it up
+    db.expire(subject, ["tutor_profile_id"])
+    subject.price = "10"
+    db.commit()
+    assert card(db, profile_id)["min_price"] == 10
+
+
+def test_rolled_back_savepoint_restores_the_card(db):
+    profile = add_profile(db)
+    savepoint = db.begin_nested()
+    db.add(TutorReview(tutor_profile_id=profile.tutor_profile_id, review="bad", rating="1"))
+    db.flush()
+    assert card(db, profile.tutor_profile_id)["review_count"] == 1
+    savepoint.rollback()
+    db.commit()
+    assert card(db, profile.tutor_profile_id)["review_count"] == 0
+
+
+def test_inactive_profile_has_no_card_and_the_check_finds_no_drift(db):
+    profile = add_profile(db)
+    profile.is_active = False
+    db.commit()
+    assert card(db, profile.tutor_profile_id) is None
+    report = tutor_card.check()
+    assert report["missing"] == report["orphaned"] == report["stale"] == []
@@ -0,0 +1,91 @@
+import pytest
+from sqlalchemy import create_engine, event, select, text
+
+from app.database.database import Base
+from app.database.schemas.message_schema import Message
+from app.database.writer import Writer
+from app.utils.ids import new_id
+
+
+@pytest.fixture
+def statements(tmp_path):
+    """a scratch engine, with the SQL its connections run"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'writer.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(engine)
+    engine.dispose()
+    log = []
+
+    @event.listens_for(engine, "connect")
+    def trace(dbapi_connection, connection_record):
+        dbapi_connection.set_trace_callback(log.append)
+
+    yield engine, log
+    engine.dispose()
+
+
+def add_message(text_):
+    def operation(db):
+        message = Message(message_id=new_id(), sender_id="a", receiver_id="b", message=text_)
+        db.add(message)
+        db.commit()
+        return message
+
+    return operation
+
+
+def fail_after(operation):
+    def failing(db):
+        operation(db)
+        raise ValueError("rejected")
+
+    return failing
+
+
+def run_batch(writer, operations):
+    """submit the operations together (one batch) and wait for them"""
+    futures = [writer.submit(operation) for operation in operations]
+    results = []
+    for future in futures:
+        try:
+            results.append(future.result(timeout=10))
+        except ValueError as e:
+            results.append(e)
+    return results
+
+
+def test_a_batch_is_one_transaction(statements):
+    engine, log = statements
+    writer = Writer(bind=engine, batch_window=0.5, max_batch=3)
+    try:
+        run_batch(writer, [add_message(str(index)) for index in range(3)])
+    finally:
+        writer.stop()
+    assert writer.batches == 1
+    boundaries = [statement for statement in log if statement.split()[0] in ("BEGIN", "COMMIT")]
+    assert boundaries == ["BEGIN IMMEDIATE", "COMMIT"]
+    assert log[-1] == "COMMIT"
+
+
+def test_a_failing_operation_only_rolls_back_its_savepoint(statements):
+    engine, _ = statements
+    writer = Writer(bind=engine, batch_window=0.5, max_batch=3)
+    try:
+        first, second, third = run_batch(
+            writer, [fail_after(add_message("failed")), add_message("kept"), add_message("kept too")]
+        )
+    finally:
+        writer.stop()
+    assert writer.batches == 1
+    assert isinstance(first, ValueError)
+    assert {second.message, third.message} == {"kept", "kept too"}
+    with engine.connect() as connection:
+        assert sorted(connection.execute(select(Message.message)).scalars()) == ["kept", "kept too"]
+        # every version kept points at a transaction that was kept, one per operation
+        orphans = connection.execute(
+            text(
+                'SELECT count(*) FROM message_version v WHERE NOT EXISTS '
+                '(SELECT 1 FROM "transaction" t WHERE t.id = v.transaction_id)'
+            )
+        ).scalar()
+        assert orphans == 0
+        assert connection.execute(text('SELECT count(*) FROM "transaction"')).scalar() == 2